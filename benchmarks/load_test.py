@@ -0,0 +1,219 @@
+"""End-to-end latency and throughput of /simulate_transaction with a deterministic fake LLM.
+
+    python -m benchmarks.load_test --requests 1000 --concurrency 50 --latency 0.3 --output run.json
+    python -m benchmarks.load_test --async --history-prefetch --baseline run.json
+
+Runs the FastAPI app in-process against a scratch database (a temporary SQLite file
+by default): it creates the schema, seeds policies and users, then drives the
+endpoint at the requested concurrency. The LLM is replaced by `FakeLLM`, so results
+only depend on the code under test and the simulated LLM latency.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+import platform
+import tempfile
+import datetime
+from collections import Counter
+
+POLICIES = [
+    {"rule_name": "No Gambling", "description": "Transactions at casinos or betting sites are prohibited.", "category": "Gambling"},
+    {"rule_name": "High Value Transactions", "description": "Any single transaction above $5000 is blocked.", "amount_threshold": 5000},
+    {"rule_name": "Travel Meal Limit", "description": "Single meal expenses during travel cannot exceed $75."},
+    {"rule_name": "Tech Procurement", "description": "Computer hardware over $500 requires prior IT approval."},
+]
+CATEGORIES = ["Food", "Travel", "Electronics", "Retail", "Software", "Entertainment"]
+
+
+def percentile(sorted_values, p: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def transactions(count: int, users: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.03:
+            category, merchant = "Gambling", "Lucky Casino"
+        else:
+            category, merchant = rng.choice(CATEGORIES), f"Merchant {rng.randint(1, 100)}"
+        amount = round(rng.uniform(5000, 9000), 2) if roll > 0.99 else round(rng.uniform(1, 1500), 2)
+        yield {"user_id": rng.randint(1, users), "merchant": merchant, "amount": amount, "category": category}
+
+
+def outcome(response) -> str:
+    if response.status_code != 200:
+        return f"HTTP_{response.status_code}"
+    body = response.json()
+    reason = body.get("violation_reason") or ""
+    if reason.startswith("Card is FROZEN"):
+        return "FROZEN"
+    if reason.startswith("MANUAL REVIEW"):
+        return "MANUAL_REVIEW"
+    return "VIOLATION" if body.get("is_violation") else "SAFE"
+
+
+def prepare(database, models, users: int) -> None:
+    database.Base.metadata.drop_all(bind=database.engine)
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        db.add_all(models.Policy(is_active=True, **p) for p in POLICIES)
+        db.add_all(
+            models.User(id=i, name=f"User {i}", email=f"user{i}@example.com", card_status=models.CardStatus.ACTIVE)
+            for i in range(1, users + 1)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def drive(app, payloads, concurrency: int):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    outcomes = Counter()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        async def one(payload):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/simulate_transaction", json=payload)
+                    result = outcome(response)
+                except Exception as e:
+                    result = f"ERROR_{type(e).__name__}"
+                latencies.append(time.perf_counter() - started)
+                outcomes[result] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(p) for p in payloads))
+        elapsed = time.perf_counter() - started
+
+    return latencies, outcomes, elapsed
+
+
+def compare(results: dict, baseline: dict) -> None:
+    print("\n== vs baseline ==")
+    for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "statements_per_transaction"):
+        old, new = baseline["results"].get(key), results[key]
+        if old:
+            print(f"  {key:28s} {old:10.2f} -> {new:10.2f} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Scratch database (default: temporary SQLite file)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated LLM latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Extra uniform LLM latency in seconds")
+    parser.add_argument("--decision-mix", default="SAFE=0.8,SUSPICIOUS=0.15,VIOLATION=0.05")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of LLM calls that fail")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="Serve the async request path")
+    parser.add_argument("--history-prefetch", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="Keep the app's own console output")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time
+    url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/load_test.db?timeout=30"
+    os.environ["DATABASE_URL"] = url
+    os.environ["ASYNC_MODE"] = "true" if args.async_mode else "false"
+    os.environ["HISTORY_PREFETCH"] = "true" if args.history_prefetch else "false"
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("LOG_LEVEL", "INFO" if args.verbose else "ERROR")
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from corpcard_sentinel import database, models, main as api, sentinel_agent
+    from corpcard_sentinel.fake_llm import FakeLLM, parse_decision_mix
+
+    fake_llm = FakeLLM(latency=args.latency, jitter=args.jitter, decision_mix=parse_decision_mix(args.decision_mix),
+                       error_rate=args.error_rate, seed=args.seed)
+    sentinel_agent.llm = fake_llm
+
+    print(f"Preparing {args.users} users in {database.engine.url.render_as_string()}")
+    # Console output is not what is being measured
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        prepare(database, models, args.users)
+
+    payloads = list(transactions(args.warmup + args.requests, args.users, args.seed))
+
+    # Counted on every engine, so the lazily created async engine is included
+    statements = Counter()
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements["total"] += 1
+
+    async def run():
+        # Warm-up and measurement share one event loop: async connections are bound to it
+        await drive(api.app, payloads[:args.warmup], args.concurrency)
+        event.listen(Engine, "before_cursor_execute", count_statement)
+        try:
+            return fake_llm.calls, await drive(api.app, payloads[args.warmup:], args.concurrency)
+        finally:
+            event.remove(Engine, "before_cursor_execute", count_statement)
+
+    with quiet:
+        llm_calls_before, (latencies, outcomes, elapsed) = asyncio.run(run())
+
+    latencies_ms = sorted(l * 1000 for l in latencies)
+    results = {
+        "requests": len(latencies_ms),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies_ms) / elapsed, 2),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 2),
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+        "max_ms": round(latencies_ms[-1], 2),
+        "statements": statements["total"],
+        "statements_per_transaction": round(statements["total"] / len(latencies_ms), 2),
+        "llm_calls": fake_llm.calls - llm_calls_before,
+        "outcomes": dict(outcomes),
+        "verdict_cache": sentinel_agent.verdict_cache.stats(),
+    }
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "database_url")}
+    config["database"] = database.engine.dialect.name
+
+    print(f"\n{results['requests']} requests at concurrency {args.concurrency} in {results['duration_s']} s")
+    print(f"  throughput: {results['throughput_rps']} req/s")
+    print(f"  latency:    p50 {results['p50_ms']} ms, p95 {results['p95_ms']} ms, p99 {results['p99_ms']} ms, max {results['max_ms']} ms")
+    print(f"  database:   {results['statements_per_transaction']} statements per transaction")
+    print(f"  llm calls:  {results['llm_calls']}")
+    print(f"  outcomes:   {results['outcomes']}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "started_at": datetime.datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "config": config,
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
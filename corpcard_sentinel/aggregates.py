@@ -0,0 +1,206 @@
+import os
+import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Per-user spending aggregates over approved (non-violation) transactions.
+# They are updated incrementally whenever a transaction is recorded or its
+# violation flag flips, so the investigation summary never scans full history.
+
+RECENT_TRANSACTIONS_LIMIT = int(os.getenv("RECENT_TRANSACTIONS_LIMIT", "10"))
+SUMMARY_TOP_CATEGORIES = 3
+SUMMARY_RECENT_TRANSACTIONS = 3
+
+
+def _entry(transaction: models.Transaction) -> Dict[str, Any]:
+    return {
+        "id": transaction.id,
+        "timestamp": transaction.timestamp.isoformat() if transaction.timestamp else None,
+        "amount": transaction.amount,
+        "merchant": transaction.merchant,
+        "category": transaction.category,
+    }
+
+
+def _sort_recent(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted(entries, key=lambda e: (e["timestamp"] or "", e["id"] or 0), reverse=True)[:RECENT_TRANSACTIONS_LIMIT]
+
+
+def _approved_transactions(db: Session, user_id: int):
+    return db.query(models.Transaction).filter(
+        models.Transaction.user_id == user_id,
+        models.Transaction.is_violation == False
+    ).order_by(models.Transaction.timestamp.desc())
+
+
+def build_aggregate(db: Session, user_id: int, persist: bool = True) -> models.UserSpendingAggregate:
+    """Backfill the aggregate from a full history scan. Only needed once per user."""
+    count = 0
+    total = 0.0
+    categories: Dict[str, int] = {}
+    recent = []
+    for t in _approved_transactions(db, user_id).yield_per(1000):
+        count += 1
+        total += t.amount or 0.0
+        categories[t.category] = categories.get(t.category, 0) + 1
+        if len(recent) < RECENT_TRANSACTIONS_LIMIT:
+            recent.append(_entry(t))
+
+    aggregate = models.UserSpendingAggregate(
+        user_id=user_id,
+        transaction_count=count,
+        total_amount=total,
+        category_counts=categories,
+        recent_transactions=_sort_recent(recent),
+    )
+    if persist:
+        db.add(aggregate)
+        # Flush so later lookups in this session find it in the identity map
+        db.flush()
+    return aggregate
+
+
+def _backfill(db: Session, user_id: int) -> Optional[models.UserSpendingAggregate]:
+    """Build the missing aggregate in a savepoint.
+
+    Returns None when a concurrent request committed the user's aggregate first, so the
+    duplicate key does not fail the caller's whole transaction.
+    """
+    try:
+        with db.begin_nested():
+            return build_aggregate(db, user_id)
+    except IntegrityError:
+        return None
+
+
+def get_aggregate(db: Session, user_id: int) -> models.UserSpendingAggregate:
+    aggregate = db.get(models.UserSpendingAggregate, user_id)
+    if aggregate is None:
+        # Read paths never write: a transaction that reads before it writes cannot take
+        # SQLite's write lock under contention. The user's first write persists it.
+        aggregate = build_aggregate(db, user_id, persist=False)
+    return aggregate
+
+
+def _locked_aggregate(db: Session, user_id: int) -> Optional[models.UserSpendingAggregate]:
+    aggregate = db.get(models.UserSpendingAggregate, user_id, with_for_update=True)
+    if aggregate is None:
+        # First write for this user: the backfill scan already reflects the change
+        db.flush()
+        if _backfill(db, user_id) is not None:
+            return None
+        # Lost the race: the winner's row does not include this change yet
+        aggregate = db.get(models.UserSpendingAggregate, user_id, with_for_update=True, populate_existing=True)
+    return aggregate
+
+
+def record_transaction(db: Session, transaction: models.Transaction) -> None:
+    """Add an approved transaction to its user's aggregate. Caller commits."""
+    aggregate = _locked_aggregate(db, transaction.user_id)
+    if aggregate is None:
+        return
+
+    categories = dict(aggregate.category_counts or {})
+    categories[transaction.category] = categories.get(transaction.category, 0) + 1
+
+    # JSON columns are reassigned rather than mutated so the ORM sees the change
+    aggregate.transaction_count = (aggregate.transaction_count or 0) + 1
+    aggregate.total_amount = (aggregate.total_amount or 0.0) + (transaction.amount or 0.0)
+    aggregate.category_counts = categories
+    aggregate.recent_transactions = _sort_recent(list(aggregate.recent_transactions or []) + [_entry(transaction)])
+
+
+def remove_transaction(db: Session, transaction: models.Transaction) -> None:
+    """Take a previously approved transaction back out of its user's aggregate. Caller commits."""
+    aggregate = _locked_aggregate(db, transaction.user_id)
+    if aggregate is None:
+        return
+
+    categories = dict(aggregate.category_counts or {})
+    remaining = categories.get(transaction.category, 0) - 1
+    if remaining > 0:
+        categories[transaction.category] = remaining
+    else:
+        categories.pop(transaction.category, None)
+
+    aggregate.transaction_count = max(0, (aggregate.transaction_count or 0) - 1)
+    aggregate.total_amount = (aggregate.total_amount or 0.0) - (transaction.amount or 0.0)
+    aggregate.category_counts = categories
+
+    recent = [e for e in aggregate.recent_transactions or [] if e["id"] != transaction.id]
+    if len(recent) < min(RECENT_TRANSACTIONS_LIMIT, aggregate.transaction_count):
+        # The ring lost an entry that older history can replace: bounded refill
+        refill = _approved_transactions(db, transaction.user_id).filter(
+            models.Transaction.id != transaction.id
+        ).limit(RECENT_TRANSACTIONS_LIMIT).all()
+        recent = [_entry(t) for t in refill]
+    aggregate.recent_transactions = _sort_recent(recent)
+
+
+def ensure_aggregate(db: Session, user_id: int) -> models.UserSpendingAggregate:
+    """Persist the user's aggregate if it is missing, built from the history stored so far."""
+    aggregate = db.get(models.UserSpendingAggregate, user_id)
+    if aggregate is None:
+        aggregate = _backfill(db, user_id)
+    if aggregate is None:
+        aggregate = db.get(models.UserSpendingAggregate, user_id, populate_existing=True)
+    return aggregate
+
+
+def add_bulk(db: Session, user_id: int, count: int, total: float, categories: Dict[str, int]) -> None:
+    """Fold a batch of bulk-inserted approved transactions into an existing aggregate. Caller commits.
+
+    The rows were inserted without ORM objects, so the recent ring is refilled from the
+    table with one bounded query instead of being merged entry by entry.
+    """
+    aggregate = db.get(models.UserSpendingAggregate, user_id, with_for_update=True, populate_existing=True)
+    merged = dict(aggregate.category_counts or {})
+    for category, n in categories.items():
+        merged[category] = merged.get(category, 0) + n
+
+    aggregate.transaction_count = (aggregate.transaction_count or 0) + count
+    aggregate.total_amount = (aggregate.total_amount or 0.0) + total
+    aggregate.category_counts = merged
+    recent = _approved_transactions(db, user_id).limit(RECENT_TRANSACTIONS_LIMIT).all()
+    aggregate.recent_transactions = _sort_recent([_entry(t) for t in recent])
+
+
+def set_violation(db: Session, transaction: models.Transaction, is_violation: bool) -> None:
+    """Set the violation flag of a recorded transaction, keeping the aggregate in sync."""
+    was_violation = bool(transaction.is_violation)
+    transaction.is_violation = is_violation
+    if was_violation != is_violation:
+        if is_violation:
+            remove_transaction(db, transaction)
+        else:
+            record_transaction(db, transaction)
+
+
+def summarize(aggregate: Optional[models.UserSpendingAggregate]) -> str:
+    if aggregate is None or not aggregate.transaction_count:
+        return "No previous approved spending history."
+
+    count = aggregate.transaction_count
+    total_spent = aggregate.total_amount
+    avg_spend = total_spent / count
+
+    categories = aggregate.category_counts or {}
+    top_categories = sorted(categories.items(), key=lambda x: (-x[1], x[0]))[:SUMMARY_TOP_CATEGORIES]
+    top_cats_str = ", ".join([f"{c} ({n})" for c, n in top_categories])
+
+    last_3 = (aggregate.recent_transactions or [])[:SUMMARY_RECENT_TRANSACTIONS]
+    last_3_str = "; ".join([
+        f"{datetime.datetime.fromisoformat(e['timestamp']).date() if e['timestamp'] else 'unknown'}: ${e['amount']} at {e['merchant']} ({e['category']})"
+        for e in last_3
+    ])
+
+    return (
+        f"User has {count} approved transactions totaling ${total_spent:.2f}. "
+        f"Average spend: ${avg_spend:.2f}. "
+        f"Top categories: {top_cats_str}. "
+        f"Recent activity: {last_3_str}."
+    )
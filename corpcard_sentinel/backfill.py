@@ -0,0 +1,167 @@
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+from typing import Any, Dict, IO, Iterator, List, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas, aggregates
+from .database import SessionLocal
+
+# Bulk import of historical transactions, bypassing the agent. Rows are streamed from
+# CSV or NDJSON, validated with schemas.TransactionBase and inserted with one executemany
+# per batch; per-user spending aggregates are updated from the same rows, so
+# investigations have context right away without a second pass over the history.
+# Rows of users that do not exist are rejected like invalid rows.
+#
+#   python -m corpcard_sentinel.backfill history.csv
+#   curl --data-binary @history.ndjson "$API_URL/transactions/import?format=ndjson"
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "5000"))
+FORMATS = ("csv", "ndjson")
+MAX_REPORTED_ERRORS = 100
+
+
+def iter_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """Yield (line number, raw record). Blank NDJSON lines are skipped."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            # Empty CSV cells mean "not given", so schema defaults apply
+            yield reader.line_num, {k: v for k, v in record.items() if v not in ("", None)}
+    elif fmt == "ndjson":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+class _UserTotals:
+    __slots__ = ("count", "total", "categories")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.categories: Dict[str, int] = {}
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.count += 1
+        self.total += row["amount"] or 0.0
+        self.categories[row["category"]] = self.categories.get(row["category"], 0) + 1
+
+
+def _missing_users(db: Session, user_ids: Set[int]) -> Set[int]:
+    if not user_ids:
+        return set()
+    found = {user_id for (user_id,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))}
+    return user_ids - found
+
+
+def _flush(db: Session, batch: List[Tuple[int, Dict[str, Any]]], known_users: set) -> List[int]:
+    """Insert the batch and return the line numbers of rows skipped for an unknown user."""
+    # Users are checked with one query per batch, before anything is written
+    missing = _missing_users(db, {row["user_id"] for _, row in batch} - known_users)
+    unknown = [line_number for line_number, row in batch if row["user_id"] in missing]
+    rows = [row for _, row in batch if row["user_id"] not in missing]
+    if not rows:
+        return unknown
+
+    # Missing aggregates are built before the insert, from the history stored so far,
+    # so the batch is counted exactly once
+    for user_id in {row["user_id"] for row in rows} - known_users:
+        aggregates.ensure_aggregate(db, user_id)
+        known_users.add(user_id)
+
+    db.execute(insert(models.Transaction), rows)
+
+    totals: Dict[int, _UserTotals] = {}
+    for row in rows:
+        if not row["is_violation"]:
+            totals.setdefault(row["user_id"], _UserTotals()).add(row)
+    for user_id in sorted(totals):
+        t = totals[user_id]
+        aggregates.add_bulk(db, user_id, t.count, t.total, t.categories)
+    # One commit per batch: rows and aggregates always land together
+    db.commit()
+    return unknown
+
+
+def import_transactions(db: Session, stream: IO[str], fmt: str, batch_size: int = BACKFILL_BATCH_SIZE) -> Dict[str, Any]:
+    """Validate and insert every record of `stream`. Invalid rows and rows of unknown users
+    are skipped and reported."""
+    imported = 0
+    rejected = 0
+    errors: List[Dict[str, Any]] = []
+    known_users: set = set()
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+
+    def reject(line_number: int, error: str) -> None:
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": line_number, "error": error})
+
+    def flush() -> None:
+        nonlocal imported
+        unknown = _flush(db, batch, known_users)
+        imported += len(batch) - len(unknown)
+        for line_number in unknown:
+            reject(line_number, "Unknown user_id")
+        batch.clear()
+
+    for line_number, record in iter_records(stream, fmt):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            if not isinstance(record, dict):
+                raise ValueError("Expected an object")
+            batch.append((line_number, schemas.TransactionBase(**record).model_dump()))
+        except (ValidationError, ValueError, TypeError) as e:
+            reject(line_number, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    # Errors are reported in line order, whichever check rejected the row
+    errors.sort(key=lambda e: e["line"])
+    return {"imported": imported, "rejected": rejected, "users": len(known_users), "errors": errors}
+
+
+def detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import historical transactions without running the agent.")
+    parser.add_argument("path", help="CSV or NDJSON file, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension (.csv, otherwise ndjson)")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path == "-" else detect_format(args.path))
+    stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8") if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    db = SessionLocal()
+    try:
+        with stream:
+            report = import_transactions(db, stream, fmt, args.batch_size)
+    finally:
+        db.close()
+
+    print(f"Imported {report['imported']} transactions for {report['users']} users, rejected {report['rejected']}.")
+    for error in report["errors"]:
+        print(f"  line {error['line']}: {error['error']}")
+    sys.exit(1 if report["rejected"] else 0)
@@ -0,0 +1,406 @@
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas, aggregates, metrics, pagination, policy_rules, policy_selection, risk_model, sentinel_agent, velocity
+from .cache import TTLCache
+from .database import SessionLocal
+from .fake_llm import FakeLLM, RecordedLLM, RecordingLLM, parse_decision_mix
+from .policy_snapshot import PolicySnapshot, fetch_active_policies, format_policy
+
+# Offline backtest: replays stored transactions through the Sentinel graph against a
+# candidate policy set and reports how the decisions would change, without writing
+# anything. Rows stream oldest first; the main process rebuilds each user's spending
+# history in memory as it goes, so every transaction only sees history from before it.
+# Evaluations run in a process pool, and progress is checkpointed so large replays can
+# resume where they stopped.
+#
+#   python -m corpcard_sentinel.backtest --policies candidate.json --llm fake --workers 8
+#   python -m corpcard_sentinel.backtest --llm real --record responses.jsonl --output report.json
+#   python -m corpcard_sentinel.backtest --llm recorded --recordings responses.jsonl
+
+BACKTEST_CHUNK_SIZE = int(os.getenv("BACKTEST_CHUNK_SIZE", "200"))
+MAX_REPORTED_CHANGES = 1000
+OUTCOMES = ("SAFE", "VIOLATION", "MANUAL_REVIEW")
+
+Position = Tuple[str, int]
+
+
+def load_policies(db: Optional[Session] = None, path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """The candidate policy set: a JSON list of policies, or the currently active ones."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            policies = [schemas.PolicyBase(**p).model_dump() for p in json.load(f)]
+        return [p for p in policies if p["is_active"]]
+    return [schemas.Policy.model_validate(p).model_dump() for p in fetch_active_policies(db)]
+
+
+def build_snapshot(policies: List[Dict[str, Any]]) -> PolicySnapshot:
+    # Transient Policy objects: the snapshot is never written back
+    rows = [models.Policy(**{"id": i, **p}) for i, p in enumerate(policies, start=1)]
+    return PolicySnapshot(0, [format_policy(p) for p in rows], policy_rules.compile_policies(rows),
+                          policy_selection.PolicyIndex(rows))
+
+
+def build_llm(spec: Dict[str, Any]):
+    backend = spec.get("backend", "fake")
+    if backend == "fake":
+        return FakeLLM(latency=spec.get("latency", 0.0), decision_mix=spec.get("decision_mix"), seed=spec.get("seed", 0))
+    if backend == "recorded":
+        return RecordedLLM.from_file(spec["recordings"])
+    if backend == "real":
+        llm = sentinel_agent.llm
+        return RecordingLLM(llm, spec["record"]) if spec.get("record") else llm
+    raise ValueError(f"Unknown LLM backend: {backend}")
+
+
+class KnownHistory:
+    """Stands in for the history prefetch: investigate receives the time-correct history
+    computed by the main process instead of reading today's aggregate."""
+
+    def __init__(self, history: str):
+        self.history = history
+
+    def start(self, user_id: int) -> None:
+        pass
+
+    def result(self) -> str:
+        return self.history
+
+    def cancel(self) -> None:
+        pass
+
+
+class UserHistory:
+    """In-memory running aggregate of one user's approved transactions, fed in time order."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.categories: Dict[str, int] = {}
+        self.recent: deque = deque(maxlen=aggregates.RECENT_TRANSACTIONS_LIMIT)
+
+    def add(self, row) -> None:
+        self.count += 1
+        self.total += row.amount or 0.0
+        self.categories[row.category] = self.categories.get(row.category, 0) + 1
+        # Rows arrive oldest first, so the newest entry goes in front
+        self.recent.appendleft(aggregates._entry(row))
+
+    def profile(self) -> risk_model.UserProfile:
+        return risk_model.UserProfile(self.count, self.total, dict(self.categories), (e["merchant"] for e in self.recent))
+
+    def summary(self) -> str:
+        return aggregates.summarize(models.UserSpendingAggregate(
+            transaction_count=self.count,
+            total_amount=self.total,
+            category_counts=self.categories,
+            recent_transactions=list(self.recent),
+        ))
+
+
+def position(row) -> Position:
+    # NULL timestamps sort first in ascending order on MySQL and SQLite
+    return (row.timestamp.isoformat() if row.timestamp else "", row.id)
+
+
+def baseline_outcome(row) -> str:
+    reason = row.violation_reason or ""
+    if reason.startswith("Card is FROZEN"):
+        return "FROZEN"
+    if reason.startswith("MANUAL REVIEW"):
+        return "MANUAL_REVIEW"
+    return "VIOLATION" if row.is_violation else "SAFE"
+
+
+def replay_outcome(state) -> str:
+    if state.get("decision") == "MANUAL_REVIEW":
+        return "MANUAL_REVIEW"
+    return "VIOLATION" if state.get("is_violation") else "SAFE"
+
+
+def iter_tasks(db: Session, user_id: Optional[int] = None, category: Optional[str] = None,
+               since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+               start_after: Optional[Position] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Stream the transactions to replay, each with the history, profile and velocity its user had at that time.
+
+    Rows before `since` (or up to `start_after` when resuming) are still read: they build
+    the history, but are not evaluated again.
+    """
+    t = models.Transaction
+    query = pagination.filter_transactions(db.query(*pagination.TRANSACTION_COLUMNS.values()), user_id=user_id, until=until)
+    query = query.order_by(t.timestamp, t.id)
+    histories: Dict[int, UserHistory] = {}
+    # Counters advance on the stored timestamps, so bursts look as they did live
+    counters = velocity.VelocityStore() if velocity.VELOCITY else None
+    result = db.execute(query.statement.execution_options(yield_per=batch_size, stream_results=True))
+    for row in result:
+        history = histories.setdefault(row.user_id, UserHistory())
+        features = counters.observe(row.user_id, row.merchant, row.amount, row.timestamp) if counters else None
+        in_scope = (
+            (since is None or (row.timestamp is not None and row.timestamp >= since))
+            and (category is None or row.category == category)
+            and (start_after is None or position(row) > tuple(start_after))
+        )
+        if in_scope:
+            yield {
+                "position": position(row),
+                # Replayed as a fresh transaction, like main.transaction_to_dict
+                "transaction": {
+                    "id": row.id,
+                    "user_id": row.user_id,
+                    "merchant": row.merchant,
+                    "amount": row.amount,
+                    "category": row.category,
+                    "timestamp": row.timestamp,
+                    "is_violation": False,
+                },
+                "history": history.summary(),
+                "profile": history.profile(),
+                "velocity": features,
+                "baseline": baseline_outcome(row),
+            }
+        # History only holds what was approved at the time, as in the live aggregate
+        if not row.is_violation:
+            history.add(row)
+
+
+# Per-process state of pool workers, set up once by `init_worker`
+_snapshot: Optional[PolicySnapshot] = None
+
+
+def init_worker(policies: List[Dict[str, Any]], llm_spec: Dict[str, Any]) -> None:
+    global _snapshot
+    _snapshot = build_snapshot(policies)
+    sentinel_agent.llm = build_llm(llm_spec)
+    # Replay misses (a RecordedLLM without the prompt) are not outages: no circuit breaker
+    sentinel_agent.llm_circuit = None
+    sentinel_agent.verdict_cache.clear()
+
+
+def replay(task: Dict[str, Any], snapshot: PolicySnapshot) -> Dict[str, Any]:
+    if task["baseline"] == "FROZEN":
+        # Attempts on a frozen card were never evaluated, and the replay does not freeze
+        # cards: they are counted, not compared
+        return {"transaction": task["transaction"], "baseline": "FROZEN", "replay": None, "reason": None, "investigated": False}
+    config = {"configurable": {"history_prefetch": KnownHistory(task["history"]), "user_profile": task.get("profile"), "dry_run": True}}
+    state = sentinel_agent.app.invoke(sentinel_agent.initial_state(task["transaction"], snapshot, task.get("velocity")), config=config)
+    return {
+        "transaction": task["transaction"],
+        "baseline": task["baseline"],
+        "replay": replay_outcome(state),
+        "reason": state.get("violation_reason"),
+        "investigated": state.get("investigation_count", 0) > 0,
+    }
+
+
+def replay_chunk(tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [replay(task, _snapshot) for task in tasks]
+
+
+def llm_config(llm_spec: Dict[str, Any]) -> Dict[str, Any]:
+    # Everything that decides the replayed verdicts; where responses are recorded does not
+    return {k: v for k, v in llm_spec.items() if k != "record"}
+
+
+def new_report(policies: List[Dict[str, Any]], llm_spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "policy_hash": build_snapshot(policies).policy_hash,
+        "llm": llm_spec.get("backend", "fake"),
+        "llm_config": llm_config(llm_spec),
+        "transactions": 0,
+        "frozen": 0,
+        "changed": 0,
+        "investigated": 0,
+        "baseline": {},
+        "replay": {},
+        "transitions": {},
+        "changes": [],
+        "elapsed_seconds": 0.0,
+        "position": None,
+    }
+
+
+def add_results(report: Dict[str, Any], results: List[Dict[str, Any]]) -> None:
+    baseline, replayed, transitions = Counter(report["baseline"]), Counter(report["replay"]), Counter(report["transitions"])
+    for r in results:
+        report["transactions"] += 1
+        if r["replay"] is None:
+            report["frozen"] = report.get("frozen", 0) + 1
+            continue
+        report["investigated"] += r["investigated"]
+        baseline[r["baseline"]] += 1
+        replayed[r["replay"]] += 1
+        if r["baseline"] != r["replay"]:
+            report["changed"] += 1
+            transitions[f"{r['baseline']}->{r['replay']}"] += 1
+            if len(report["changes"]) < MAX_REPORTED_CHANGES:
+                t = r["transaction"]
+                report["changes"].append({
+                    "id": t["id"], "user_id": t["user_id"], "merchant": t["merchant"], "amount": t["amount"],
+                    "category": t["category"], "timestamp": t["timestamp"].isoformat() if t["timestamp"] else None,
+                    "baseline": r["baseline"], "replay": r["replay"], "reason": r["reason"],
+                })
+    report["baseline"], report["replay"], report["transitions"] = dict(baseline), dict(replayed), dict(transitions)
+
+
+def save_checkpoint(report: Dict[str, Any], path: str) -> None:
+    # Written to a side file and renamed, so a crash never leaves a torn checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: str, policies: List[Dict[str, Any]], llm_spec: Dict[str, Any]) -> Dict[str, Any]:
+    report = new_report(policies, llm_spec)
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("policy_hash") != report["policy_hash"]:
+            raise ValueError("Checkpoint was written for a different policy set")
+        # Round-tripped through JSON like the saved copy, so tuples compare as lists
+        if saved.get("llm_config") != json.loads(json.dumps(report["llm_config"])):
+            raise ValueError("Checkpoint was written for a different LLM configuration")
+        report = saved
+    return report
+
+
+def _chunks(tasks: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for task in tasks:
+        chunk.append(task)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_backtest(db: Session, policies: List[Dict[str, Any]], llm_spec: Dict[str, Any], workers: int = 0,
+                 chunk_size: int = BACKTEST_CHUNK_SIZE, checkpoint: Optional[str] = None,
+                 limit: Optional[int] = None, **filters) -> Dict[str, Any]:
+    """Replay the matching transactions and return the decision diff report.
+
+    With `workers=0` evaluations run in this process. For the duration of the run the LLM
+    backend is swapped in without the circuit breaker, verdicts go to a separate cache and
+    metrics recording is off, so the live process state is left alone. Chunks are collected
+    in order, so the checkpoint position always marks a prefix of the replay that is fully
+    accounted for.
+    """
+    report = load_checkpoint(checkpoint, policies, llm_spec)
+    tasks = iter_tasks(db, start_after=report["position"], **filters)
+    if limit is not None:
+        tasks = (task for _, task in zip(range(max(0, limit - report["transactions"])), tasks))
+
+    started = time.perf_counter()
+    elapsed_before = report["elapsed_seconds"]
+
+    def collect(results: List[Dict[str, Any]], last: Position) -> None:
+        add_results(report, results)
+        report["position"] = list(last)
+        report["elapsed_seconds"] = elapsed_before + time.perf_counter() - started
+        if checkpoint:
+            save_checkpoint(report, checkpoint)
+
+    if workers <= 0:
+        previous = sentinel_agent.llm, sentinel_agent.llm_circuit, sentinel_agent.verdict_cache
+        # Replayed verdicts go to their own cache, not into the live one
+        sentinel_agent.verdict_cache = TTLCache(maxsize=sentinel_agent.VERDICT_CACHE_SIZE, ttl=sentinel_agent.VERDICT_CACHE_TTL)
+        try:
+            init_worker(policies, llm_spec)
+            # Replayed decisions are not live traffic: keep them out of this process's metrics
+            with metrics.recording_disabled():
+                for chunk in _chunks(tasks, chunk_size):
+                    collect(replay_chunk(chunk), chunk[-1]["position"])
+        finally:
+            sentinel_agent.llm, sentinel_agent.llm_circuit, sentinel_agent.verdict_cache = previous
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(policies, llm_spec)) as pool:
+            # A bounded window of chunks in flight keeps memory flat on large replays
+            pending: deque = deque()
+            for chunk in _chunks(tasks, chunk_size):
+                pending.append((pool.submit(replay_chunk, chunk), chunk[-1]["position"]))
+                if len(pending) >= workers * 2:
+                    future, last = pending.popleft()
+                    collect(future.result(), last)
+            while pending:
+                future, last = pending.popleft()
+                collect(future.result(), last)
+
+    report["elapsed_seconds"] = elapsed_before + time.perf_counter() - started
+    report["throughput_per_second"] = report["transactions"] / report["elapsed_seconds"] if report["elapsed_seconds"] else 0.0
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    frozen = report.get("frozen", 0)
+    total = report["transactions"] - frozen
+    lines = [
+        f"Replayed {total} transactions in {report['elapsed_seconds']:.1f}s "
+        f"({report.get('throughput_per_second', 0.0):.1f}/s, LLM: {report['llm']})",
+        f"Changed decisions: {report['changed']} ({100.0 * report['changed'] / total if total else 0.0:.2f}%), "
+        f"investigated: {report['investigated']}",
+        f"Attempts on frozen cards (not compared): {frozen}",
+        f"{'outcome':<15}{'baseline':>10}{'replay':>10}",
+    ]
+    for outcome in OUTCOMES:
+        lines.append(f"{outcome:<15}{report['baseline'].get(outcome, 0):>10}{report['replay'].get(outcome, 0):>10}")
+    for transition, count in sorted(report["transitions"].items(), key=lambda x: -x[1]):
+        lines.append(f"  {transition}: {count}")
+    return "\n".join(lines)
+
+
+def _parse_datetime(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay stored transactions against a policy set without writing anything.")
+    parser.add_argument("--policies", help="JSON list of policies to test (default: the active policies)")
+    parser.add_argument("--llm", choices=("fake", "recorded", "real"), default="fake")
+    parser.add_argument("--recordings", help="JSONL responses for --llm recorded")
+    parser.add_argument("--record", help="With --llm real, also append every response to this JSONL file")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated latency of the fake LLM (seconds)")
+    parser.add_argument("--decision-mix", type=parse_decision_mix, help="Fake LLM weights, e.g. SAFE=0.8,SUSPICIOUS=0.15,VIOLATION=0.05")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--category")
+    parser.add_argument("--since", type=_parse_datetime)
+    parser.add_argument("--until", type=_parse_datetime)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="0 runs in this process")
+    parser.add_argument("--chunk-size", type=int, default=BACKTEST_CHUNK_SIZE)
+    parser.add_argument("--checkpoint", help="Resume from and save progress to this file")
+    parser.add_argument("--output", help="Write the full JSON report here")
+    args = parser.parse_args()
+
+    if args.llm == "recorded" and not args.recordings:
+        parser.error("--llm recorded needs --recordings")
+    llm_spec = {"backend": args.llm, "latency": args.latency, "decision_mix": args.decision_mix,
+                "seed": args.seed, "recordings": args.recordings, "record": args.record}
+
+    db = SessionLocal()
+    try:
+        policies = load_policies(db, args.policies)
+        report = run_backtest(
+            db, policies, llm_spec, workers=args.workers, chunk_size=args.chunk_size,
+            checkpoint=args.checkpoint, limit=args.limit,
+            user_id=args.user_id, category=args.category, since=args.since, until=args.until,
+        )
+    finally:
+        db.close()
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
@@ -4,12 +4,61 @@ import pandas as pd
 
 import os
 
+from corpcard_sentinel.dashboard_client import DashboardClient
+
 # API Configuration
 API_BASE_URL = os.getenv("API_URL", "https://corpcard-sentinel-api.onrender.com")
+# Reads are cached across reruns for this many seconds; mutations clear them right away
+CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "30"))
 
 st.set_page_config(page_title="CorpCard Sentinel Admin", layout="wide")
 st.title("🛡️ CorpCard Sentinel Admin Dashboard")
 
+@st.cache_resource
+def get_client():
+    # One pooled keep-alive session per dashboard process, shared by all reruns
+    return DashboardClient(API_BASE_URL)
+
+client = get_client()
+
+RESOURCES = {
+    "summary": "/stats/summary",
+    "users": "/users",
+    "policies": "/policies",
+    # Rows come with the user name already joined in
+    "audit_logs": "/audit_logs",
+}
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_dashboard_data():
+    # Independent reads go out concurrently: one round trip instead of four
+    return get_client().fetch_all(RESOURCES)
+
+def invalidate():
+    fetch_dashboard_data.clear()
+
+try:
+    dashboard_data, fetch_error = fetch_dashboard_data(), None
+except requests.exceptions.RequestException as e:
+    # Failures are not cached; each tab reports the error where the data is needed
+    dashboard_data, fetch_error = {}, e
+
+def load(name):
+    if fetch_error is not None:
+        raise fetch_error
+    return dashboard_data[name]
+
+# Summary
+try:
+    summary = load("summary")
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Transactions", summary["total_transactions"])
+    m2.metric("Violations", summary["violations"])
+    m3.metric("Frozen Cards", summary["frozen_cards"])
+    m4.metric("Active Cards", summary["active_cards"])
+except requests.exceptions.RequestException:
+    st.warning("Summary unavailable.")
+
 # Create Tabs
 tab1, tab2, tab3, tab4 = st.tabs(["Live Simulation", "Card Management", "Policy Control", "Audit Logs"])
 
@@ -37,7 +86,9 @@ with tab1:
             }
             
             try:
-                response = requests.post(f"{API_BASE_URL}/simulate_transaction", json=payload)
+                response = client.post("/simulate_transaction", json=payload)
+                # A new transaction (and possibly a freeze) changes users, logs and stats
+                invalidate()
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -53,51 +104,55 @@ with tab1:
                 else:
                     st.warning(f"Unexpected Status: {response.status_code}")
                     st.write(response.text)
-            except requests.exceptions.ConnectionError:
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
                 st.error("Failed to connect to API. Is it running?")
+            except requests.exceptions.RequestException as e:
+                st.error(f"Request to the API failed: {e}")
 
 # --- Tab 2: Card Management ---
 with tab2:
     st.header("User & Card Management")
     
     if st.button("Refresh Users"):
+        invalidate()
         st.rerun()
         
     try:
-        response = requests.get(f"{API_BASE_URL}/users")
-        if response.status_code == 200:
-            users = response.json()
-            if users:
-                df = pd.DataFrame(users)
-                
-                # Highlight frozen cards
-                def highlight_frozen(s):
-                    return ['background-color: #ffcccc; color: black' if v == 'FROZEN' else '' for v in s]
-                
-                st.dataframe(df.style.apply(highlight_frozen, subset=['card_status']), use_container_width=True)
-                
-                # Unfreeze Action
-                st.subheader("Unfreeze User")
-                col_u1, col_u2 = st.columns([1, 3], vertical_alignment="bottom")
-                with col_u1:
-                    unfreeze_id = st.number_input("User ID to Unfreeze", min_value=1, step=1, key="unfreeze_id")
-                with col_u2:
-                    if st.button("Unfreeze Card"):
-                        try:
-                            uf_response = requests.post(f"{API_BASE_URL}/users/{unfreeze_id}/unfreeze")
-                            if uf_response.status_code == 200:
-                                st.success(f"User {unfreeze_id} card unfrozen successfully!")
-                                st.rerun()
-                            else:
-                                st.error(f"Failed to unfreeze: {uf_response.text}")
-                        except Exception as e:
-                            st.error(f"Error: {e}")
-            else:
-                st.info("No users found.")
+        users = load("users")
+        if users:
+            df = pd.DataFrame(users)
+            
+            # Highlight frozen cards
+            def highlight_frozen(s):
+                return ['background-color: #ffcccc; color: black' if v == 'FROZEN' else '' for v in s]
+            
+            st.dataframe(df.style.apply(highlight_frozen, subset=['card_status']), use_container_width=True)
+            
+            # Unfreeze Action
+            st.subheader("Unfreeze User")
+            col_u1, col_u2 = st.columns([1, 3], vertical_alignment="bottom")
+            with col_u1:
+                unfreeze_id = st.number_input("User ID to Unfreeze", min_value=1, step=1, key="unfreeze_id")
+            with col_u2:
+                if st.button("Unfreeze Card"):
+                    try:
+                        uf_response = client.post(f"/users/{unfreeze_id}/unfreeze")
+                        if uf_response.status_code == 200:
+                            invalidate()
+                            st.success(f"User {unfreeze_id} card unfrozen successfully!")
+                            st.rerun()
+                        else:
+                            st.error(f"Failed to unfreeze: {uf_response.text}")
+                    except Exception as e:
+                        st.error(f"Error: {e}")
         else:
-            st.error(f"Failed to fetch users: {response.status_code}")
-    except requests.exceptions.ConnectionError:
+            st.info("No users found.")
+    except requests.exceptions.HTTPError as e:
+        st.error(f"Failed to fetch users: {e.response.status_code}")
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         st.error("Failed to connect to API. Is it running?")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Request to the API failed: {e}")
 
 # --- Tab 3: Policy Control ---
 with tab3:
@@ -106,57 +161,59 @@ with tab3:
     # List Policies
     st.subheader("Active Policies")
     try:
-        response = requests.get(f"{API_BASE_URL}/policies")
-        if response.status_code == 200:
-            policies = response.json()
-            if policies:
-                for policy in policies:
-                    with st.expander(f"{policy.get('rule_name', 'Policy')} (ID: {policy.get('id')})"):
-                        st.write(f"**Description:** {policy.get('description')}")
-                        
-                        col_edit, col_delete = st.columns(2)
-                        
-                        # Edit Section
-                        with col_edit:
-                            with st.popover("Edit Policy"):
-                                with st.form(f"edit_policy_{policy['id']}"):
-                                    new_name = st.text_input("Name", value=policy.get('rule_name'))
-                                    new_desc = st.text_area("Description", value=policy.get('description'))
-                                    submitted = st.form_submit_button("Update")
-                                    if submitted:
-                                        update_payload = {
-                                            "rule_name": new_name,
-                                            "description": new_desc,
-                                            "is_active": True
-                                        }
-                                        try:
-                                            res = requests.put(f"{API_BASE_URL}/policies/{policy['id']}", json=update_payload)
-                                            if res.status_code == 200:
-                                                st.success("Updated!")
-                                                st.rerun()
-                                            else:
-                                                st.error(f"Error: {res.text}")
-                                        except Exception as e:
-                                            st.error(f"Error: {e}")
-
-                        # Delete Section
-                        with col_delete:
-                            if st.button("Delete Policy", key=f"del_{policy['id']}"):
-                                try:
-                                    res = requests.delete(f"{API_BASE_URL}/policies/{policy['id']}")
-                                    if res.status_code == 200:
-                                        st.success("Deleted!")
-                                        st.rerun()
-                                    else:
-                                        st.error(f"Error: {res.text}")
-                                except Exception as e:
-                                    st.error(f"Error: {e}")
-            else:
-                st.info("No policies found.")
+        policies = load("policies")
+        if policies:
+            for policy in policies:
+                with st.expander(f"{policy.get('rule_name', 'Policy')} (ID: {policy.get('id')})"):
+                    st.write(f"**Description:** {policy.get('description')}")
+                    
+                    col_edit, col_delete = st.columns(2)
+                    
+                    # Edit Section
+                    with col_edit:
+                        with st.popover("Edit Policy"):
+                            with st.form(f"edit_policy_{policy['id']}"):
+                                new_name = st.text_input("Name", value=policy.get('rule_name'))
+                                new_desc = st.text_area("Description", value=policy.get('description'))
+                                submitted = st.form_submit_button("Update")
+                                if submitted:
+                                    update_payload = {
+                                        "rule_name": new_name,
+                                        "description": new_desc,
+                                        "is_active": True
+                                    }
+                                    try:
+                                        res = client.put(f"/policies/{policy['id']}", json=update_payload)
+                                        if res.status_code == 200:
+                                            invalidate()
+                                            st.success("Updated!")
+                                            st.rerun()
+                                        else:
+                                            st.error(f"Error: {res.text}")
+                                    except Exception as e:
+                                        st.error(f"Error: {e}")
+
+                    # Delete Section
+                    with col_delete:
+                        if st.button("Delete Policy", key=f"del_{policy['id']}"):
+                            try:
+                                res = client.delete(f"/policies/{policy['id']}")
+                                if res.status_code == 200:
+                                    invalidate()
+                                    st.success("Deleted!")
+                                    st.rerun()
+                                else:
+                                    st.error(f"Error: {res.text}")
+                            except Exception as e:
+                                st.error(f"Error: {e}")
         else:
-            st.error(f"Failed to fetch policies: {response.status_code}")
-    except requests.exceptions.ConnectionError:
+            st.info("No policies found.")
+    except requests.exceptions.HTTPError as e:
+        st.error(f"Failed to fetch policies: {e.response.status_code}")
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         st.error("Failed to connect to API. Is it running?")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Request to the API failed: {e}")
         
     st.divider()
     
@@ -177,8 +234,9 @@ with tab3:
                     # Add other fields if required by the schema, assuming simple create for now
                 }
                 try:
-                    cp_response = requests.post(f"{API_BASE_URL}/policies", json=payload)
+                    cp_response = client.post("/policies", json=payload)
                     if cp_response.status_code == 200:
+                        invalidate()
                         st.success("Policy created successfully!")
                         st.rerun()
                     else:
@@ -193,43 +251,34 @@ with tab4:
     st.header("Transaction Audit Logs")
     
     if st.button("Refresh Logs"):
+        invalidate()
         st.rerun()
         
     try:
-        # Fetch Transactions
-        t_response = requests.get(f"{API_BASE_URL}/transactions")
-        # Fetch Users for name mapping
-        u_response = requests.get(f"{API_BASE_URL}/users")
+        logs = load("audit_logs")
         
-        if t_response.status_code == 200 and u_response.status_code == 200:
-            transactions = t_response.json()
-            users = u_response.json()
+        if logs:
+            df = pd.DataFrame(logs)
             
-            if transactions:
-                df = pd.DataFrame(transactions)
-                
-                # Map User ID to Name
-                user_map = {u['id']: u['name'] for u in users}
-                df['User Name'] = df['user_id'].map(user_map)
-                
-                # Rename and Select Columns
-                df['Status'] = df['is_violation'].apply(lambda x: 'VIOLATION' if x else 'ALLOWED')
-                df['Reason'] = df['violation_reason']
-                df['Time'] = pd.to_datetime(df['timestamp'])
-                
-                display_df = df[['Time', 'User Name', 'merchant', 'amount', 'Status', 'Reason']].copy()
-                display_df.columns = ['Time', 'User Name', 'Merchant', 'Amount', 'Status', 'Reason']
-                
-                # Styling
-                def highlight_status(row):
-                    bg_color = '#ffcccc' if row['Status'] == 'VIOLATION' else '#ccffcc'
-                    text_color = 'black'
-                    return [f'background-color: {bg_color}; color: {text_color}'] * len(row)
-                
-                st.dataframe(display_df.style.apply(highlight_status, axis=1), use_container_width=False, height=500)
-            else:
-                st.info("No transactions found.")
+            # Rename and Select Columns
+            df['Status'] = df['is_violation'].apply(lambda x: 'VIOLATION' if x else 'ALLOWED')
+            df['Time'] = pd.to_datetime(df['timestamp'])
+            
+            display_df = df[['Time', 'user_name', 'merchant', 'amount', 'Status', 'violation_reason']].copy()
+            display_df.columns = ['Time', 'User Name', 'Merchant', 'Amount', 'Status', 'Reason']
+            
+            # Styling
+            def highlight_status(row):
+                bg_color = '#ffcccc' if row['Status'] == 'VIOLATION' else '#ccffcc'
+                text_color = 'black'
+                return [f'background-color: {bg_color}; color: {text_color}'] * len(row)
+            
+            st.dataframe(display_df.style.apply(highlight_status, axis=1), use_container_width=False, height=500)
         else:
-            st.error("Failed to fetch data.")
-    except requests.exceptions.ConnectionError:
+            st.info("No transactions found.")
+    except requests.exceptions.HTTPError:
+        st.error("Failed to fetch data.")
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         st.error("Failed to connect to API. Is it running?")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Request to the API failed: {e}")
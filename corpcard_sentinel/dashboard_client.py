@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# HTTP client for the dashboard. One keep-alive session is shared by every tab and rerun,
+# so the TLS handshake to the hosted API is paid once per pooled connection instead of
+# once per call, and independent reads are fetched concurrently.
+
+CONNECT_TIMEOUT = float(os.getenv("DASHBOARD_CONNECT_TIMEOUT", "3.05"))
+# Simulations wait for the LLM, so reads get a generous timeout
+READ_TIMEOUT = float(os.getenv("DASHBOARD_READ_TIMEOUT", "30"))
+POOL_SIZE = int(os.getenv("DASHBOARD_POOL_SIZE", "8"))
+
+
+class DashboardClient:
+    def __init__(self, base_url: str, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, pool_size: int = POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # Idempotent reads are retried on connection errors; writes never are
+        retry = Retry(total=2, connect=2, read=0, backoff_factor=0.2, allowed_methods=frozenset({"GET"}))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="dashboard-client")
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", path, **kwargs)
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """GET `path` and decode the body. Raises `requests.HTTPError` on error statuses."""
+        response = self.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_all(self, paths: Dict[str, str]) -> Dict[str, Any]:
+        """GET independent resources concurrently: {name: path} -> {name: decoded body}.
+
+        All requests are in flight together, so the cost is the slowest one rather than
+        the sum. The first failure is raised after the others have finished.
+        """
+        futures = {name: self._executor.submit(self.get_json, path) for name, path in paths.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.session.close()
@@ -13,18 +13,48 @@ if SQLALCHEMY_DATABASE_URL.startswith("mysql://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("mysql://", "mysql+pymysql://")
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Committed objects stay loaded, so handlers can return them without a refresh round trip
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
+# Async mode: the request path awaits the LLM and the database instead of holding a
+# threadpool worker. Requires an async driver (aiomysql for MySQL, aiosqlite for SQLite).
+ASYNC_MODE = os.getenv("ASYNC_MODE", "false").lower() in ("1", "true", "yes")
+
+def to_async_url(url: str) -> str:
+    for sync_prefix, async_prefix in (
+        ("mysql+pymysql://", "mysql+aiomysql://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+_async_session_factory = None
+
+def AsyncSessionLocal():
+    # The async engine is created lazily so the async driver is only needed in async mode
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        async_engine = create_async_engine(ASYNC_DATABASE_URL)
+        # Objects must stay usable after commit: lazy refreshes are not allowed in async code
+        _async_session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return _async_session_factory()
+
 def init_db():
     # Import models here to ensure they are registered with Base
-    from . import models
+    from . import models, migrations
     try:
         # Check connection
         with engine.connect() as connection:
             print("Database connection successful.")
         Base.metadata.create_all(bind=engine)
+        # Bring databases created by older versions up to date
+        migrations.upgrade(engine)
     except Exception as e:
         print(f"CRITICAL: Failed to initialize database: {e}")
         raise
@@ -0,0 +1,134 @@
+import io
+import csv
+import json
+import datetime
+from typing import Any, Dict, Iterator, List
+
+from . import database, models, pagination
+
+# Streaming audit export of transactions. Rows are read through a server-side cursor
+# (`yield_per` + `stream_results`) and encoded partition by partition, so memory stays
+# flat however many rows are exported. Parquet needs the optional `pyarrow` package.
+
+EXPORT_BATCH_SIZE = 1000
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_partitions(fields: List[str], filters: Dict[str, Any], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the matching transactions oldest first, as lists of at most `batch_size` rows.
+
+    The export opens its own session: it outlives the request's dependency scope.
+    """
+    t = models.Transaction
+    db = database.SessionLocal()
+    try:
+        query = db.query(*[getattr(t, f) for f in fields])
+        query = pagination.filter_transactions(query, **filters).order_by(t.timestamp, t.id)
+        result = db.execute(query.statement.execution_options(yield_per=batch_size, stream_results=True))
+        for partition in result.partitions():
+            yield [dict(zip(fields, row)) for row in partition]
+    finally:
+        db.close()
+
+
+def ndjson_stream(partitions: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for rows in partitions:
+        yield "".join(json.dumps({k: _json_value(v) for k, v in row.items()}) + "\n" for row in rows).encode("utf-8")
+
+
+def csv_stream(partitions: Iterator[List[Dict[str, Any]]], fields: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for rows in partitions:
+        writer.writerows({k: _json_value(v) for k, v in row.items()} for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only: nothing matched
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands its bytes to the response as they are produced."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_schema(pa, fields: List[str]):
+    types = {
+        "id": pa.int64(),
+        "user_id": pa.int64(),
+        "merchant": pa.string(),
+        "amount": pa.float64(),
+        "category": pa.string(),
+        "timestamp": pa.timestamp("us"),
+        "is_violation": pa.bool_(),
+        "violation_reason": pa.string(),
+    }
+    return pa.schema([(f, types[f]) for f in fields])
+
+
+def parquet_stream(partitions: Iterator[List[Dict[str, Any]]], fields: List[str]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa, fields)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # One row group per partition
+        for rows in partitions:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_stream(fmt: str, fields: List[str], filters: Dict[str, Any]) -> Iterator[bytes]:
+    partitions = iter_partitions(fields, filters)
+    if fmt == "csv":
+        return csv_stream(partitions, fields)
+    if fmt == "parquet":
+        return parquet_stream(partitions, fields)
+    return ndjson_stream(partitions)
@@ -0,0 +1,153 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from langchain_core.messages import AIMessage
+
+# Deterministic stand-in for ChatGoogleGenerativeAI, for benchmarks and offline runs.
+# The decision for a prompt is derived from a hash of the prompt, so the same
+# transaction gets the same verdict on every run regardless of concurrency.
+# `RecordedLLM` replays responses captured from a real model by `RecordingLLM`.
+
+DEFAULT_DECISION_MIX = {"SAFE": 0.8, "SUSPICIOUS": 0.15, "VIOLATION": 0.05}
+_BATCH_ITEM = re.compile(r'"item": (\d+)')
+
+
+def parse_decision_mix(value: str) -> Dict[str, float]:
+    """Parse "SAFE=0.8,SUSPICIOUS=0.15,VIOLATION=0.05" into a weight mapping."""
+    mix = {}
+    for part in value.split(","):
+        if not part.strip():
+            continue
+        decision, _, weight = part.partition("=")
+        decision = decision.strip().upper()
+        if decision not in DEFAULT_DECISION_MIX:
+            raise ValueError(f"Unknown decision: {decision!r}")
+        mix[decision] = float(weight)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError(f"Invalid decision mix: {value!r}")
+    return mix
+
+
+class FakeLLM:
+    """Answers evaluation prompts (single and batch) after a simulated latency.
+
+    `latency` and `jitter` are in seconds; each call sleeps latency + U(0, jitter).
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0,
+                 decision_mix: Optional[Dict[str, float]] = None, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.decision_mix = decision_mix or DEFAULT_DECISION_MIX
+        self.error_rate = error_rate
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _rng(self, key: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}:{key}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _decision(self, key: str) -> str:
+        rng = self._rng(key)
+        decisions = list(self.decision_mix)
+        return rng.choices(decisions, weights=[self.decision_mix[d] for d in decisions])[0]
+
+    def _delay(self, prompt: str) -> float:
+        return self.latency + (self._rng("delay:" + prompt).uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _respond(self, prompt: str) -> AIMessage:
+        with self._lock:
+            self.calls += 1
+        if self.error_rate and self._rng("error:" + prompt).random() < self.error_rate:
+            raise RuntimeError("Simulated LLM failure")
+
+        items = _BATCH_ITEM.findall(prompt)
+        if items:
+            answers = [
+                {"item": int(i), "decision": self._decision(f"{prompt}:{i}"), "reason": "Simulated verdict"}
+                for i in items
+            ]
+            return AIMessage(content=json.dumps(answers))
+        return AIMessage(content=json.dumps({"decision": self._decision(prompt), "reason": "Simulated verdict"}))
+
+    def invoke(self, prompt, *args, **kwargs) -> AIMessage:
+        prompt = str(prompt)
+        time.sleep(self._delay(prompt))
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt, *args, **kwargs) -> AIMessage:
+        prompt = str(prompt)
+        await asyncio.sleep(self._delay(prompt))
+        return self._respond(prompt)
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def load_recordings(path: str) -> Dict[str, str]:
+    """Read a JSONL file of {"prompt_sha256": ..., "content": ...} lines."""
+    recordings = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings[entry["prompt_sha256"]] = entry["content"]
+    return recordings
+
+
+class RecordedLLM:
+    """Replays responses captured by `RecordingLLM`. Unknown prompts raise KeyError,
+    which the graph turns into MANUAL_REVIEW like any other LLM failure."""
+
+    def __init__(self, recordings: Dict[str, str]):
+        self.recordings = recordings
+        self.calls = 0
+        self.misses = 0
+
+    @classmethod
+    def from_file(cls, path: str) -> "RecordedLLM":
+        return cls(load_recordings(path))
+
+    def invoke(self, prompt, *args, **kwargs) -> AIMessage:
+        self.calls += 1
+        content = self.recordings.get(prompt_key(str(prompt)))
+        if content is None:
+            self.misses += 1
+            raise KeyError("No recorded response for prompt")
+        return AIMessage(content=content)
+
+    async def ainvoke(self, prompt, *args, **kwargs) -> AIMessage:
+        return self.invoke(prompt)
+
+
+class RecordingLLM:
+    """Wraps a real LLM and appends every response to a JSONL file for later replay."""
+
+    def __init__(self, llm, path: str):
+        self.llm = llm
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, prompt: str, response) -> None:
+        line = json.dumps({"prompt_sha256": prompt_key(prompt), "content": response.content}) + "\n"
+        # One write per line in append mode, so concurrent workers do not interleave
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def invoke(self, prompt, *args, **kwargs):
+        response = self.llm.invoke(prompt, *args, **kwargs)
+        self._record(str(prompt), response)
+        return response
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        response = await self.llm.ainvoke(prompt, *args, **kwargs)
+        self._record(str(prompt), response)
+        return response
@@ -0,0 +1,191 @@
+import os
+import json
+import asyncio
+import hashlib
+import datetime
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models, metrics
+
+# Idempotency keys for /simulate_transaction. Card processors retry on timeout, usually
+# while the first attempt is still being evaluated. The first request with a key owns it;
+# concurrent duplicates in the same process wait on its future instead of running the
+# graph again, and later retries (in any process) read the stored result from
+# `idempotency_keys`, which is written in the same commit as the transaction. Across
+# processes the primary key on the table decides the winner.
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# How long a duplicate waits for the evaluation it joined
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "60"))
+MAX_KEY_LENGTH = 255
+
+REQUESTS = metrics.counter("sentinel_idempotent_requests_total", "Requests with an Idempotency-Key by how they were served.", ["result"])
+
+
+class KeyReused(ValueError):
+    """The key was already used for a different request body."""
+
+
+class InFlightFailed(RuntimeError):
+    """The evaluation a duplicate was waiting on failed or did not finish in time."""
+
+
+def fingerprint(payload: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def validate_key(key: str) -> None:
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+
+def _expired(row: models.IdempotencyKey) -> bool:
+    return row.created_at < datetime.datetime.utcnow() - datetime.timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+
+def _check(row: models.IdempotencyKey, request_hash: str) -> int:
+    if row.request_hash != request_hash:
+        raise KeyReused("Idempotency-Key was already used with a different request")
+    return row.transaction_id
+
+
+def lookup(db: Session, key: str, request_hash: str) -> Optional[int]:
+    """Transaction id stored for `key`, or None.
+
+    An expired key is deleted and free again; the delete is staged, not committed, so it
+    lands in the same commit as the key that replaces it.
+    """
+    row = db.get(models.IdempotencyKey, key)
+    if row is None:
+        return None
+    if _expired(row):
+        db.delete(row)
+        return None
+    return _check(row, request_hash)
+
+
+class InFlight:
+    """Keys being evaluated in this process, each with the future its duplicates wait on."""
+
+    def __init__(self):
+        self._futures: Dict[str, Tuple[Future, str]] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, request_hash: str) -> Tuple[Future, bool]:
+        """(future, owner). The owner must `release` the key when done."""
+        with self._lock:
+            entry = self._futures.get(key)
+            if entry is not None:
+                future, owner_hash = entry
+                if owner_hash != request_hash:
+                    raise KeyReused("Idempotency-Key is in use by a different request")
+                return future, False
+            future = Future()
+            self._futures[key] = (future, request_hash)
+            return future, True
+
+    def release(self, key: str, future: Future, transaction_id: Optional[int]) -> None:
+        """Resolve the key's future with the committed transaction id (None: the owner failed)."""
+        with self._lock:
+            self._futures.pop(key, None)
+        future.set_result(transaction_id)
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+
+in_flight = InFlight()
+
+
+def _record(db: Session, key: str, request_hash: str, transaction: models.Transaction) -> None:
+    db.flush()
+    db.add(models.IdempotencyKey(key=key, request_hash=request_hash, transaction_id=transaction.id,
+                                 created_at=datetime.datetime.utcnow()))
+
+
+def _wait_timed_out() -> InFlightFailed:
+    return InFlightFailed("Timed out waiting for the original request with this Idempotency-Key; retry")
+
+
+def _waited(result: Optional[int]) -> int:
+    if result is None:
+        raise InFlightFailed("The original request with this Idempotency-Key did not complete; retry")
+    REQUESTS.inc(result="coalesced")
+    return result
+
+
+def run_once(db: Session, key: str, request_hash: str, work: Callable[[], models.Transaction]) -> models.Transaction:
+    """Run `work` (which must not commit) at most once per key and commit its transaction.
+
+    Returns the transaction created by this call, or the one stored for the key.
+    """
+    future, owner = in_flight.claim(key, request_hash)
+    if not owner:
+        try:
+            result = future.result(timeout=IDEMPOTENCY_WAIT_TIMEOUT)
+        except TimeoutError as e:
+            raise _wait_timed_out() from e
+        # The owner committed before resolving the future
+        return db.get(models.Transaction, _waited(result))
+
+    transaction_id = None
+    try:
+        # Keys are released only after their commit, so a finished duplicate is visible here
+        transaction_id = lookup(db, key, request_hash)
+        if transaction_id is not None:
+            REQUESTS.inc(result="replayed")
+            return db.get(models.Transaction, transaction_id)
+
+        transaction = work()
+        _record(db, key, request_hash, transaction)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another process won the key: its result replaces ours
+            db.rollback()
+            transaction_id = lookup(db, key, request_hash)
+            REQUESTS.inc(result="replayed")
+            return db.get(models.Transaction, transaction_id)
+        transaction_id = transaction.id
+        REQUESTS.inc(result="new")
+        return transaction
+    finally:
+        in_flight.release(key, future, transaction_id)
+
+
+async def arun_once(db, key: str, request_hash: str, work: Callable[[], Awaitable[models.Transaction]]) -> models.Transaction:
+    """`run_once` for an AsyncSession; duplicates await the owner's future on the event loop."""
+    future, owner = in_flight.claim(key, request_hash)
+    if not owner:
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), IDEMPOTENCY_WAIT_TIMEOUT)
+        except TimeoutError as e:
+            raise _wait_timed_out() from e
+        return await db.get(models.Transaction, _waited(result))
+
+    transaction_id = None
+    try:
+        transaction_id = await db.run_sync(lookup, key, request_hash)
+        if transaction_id is not None:
+            REQUESTS.inc(result="replayed")
+            return await db.get(models.Transaction, transaction_id)
+
+        transaction = await work()
+        await db.run_sync(_record, key, request_hash, transaction)
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            transaction_id = await db.run_sync(lookup, key, request_hash)
+            REQUESTS.inc(result="replayed")
+            return await db.get(models.Transaction, transaction_id)
+        transaction_id = transaction.id
+        REQUESTS.inc(result="new")
+        return transaction
+    finally:
+        in_flight.release(key, future, transaction_id)
@@ -0,0 +1,277 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from . import metrics, policy_rules, policy_selection
+
+# Keeps a slow or failing LLM from setting the pace of every decision.
+#
+# - Latency budget: all LLM calls of one transaction (first evaluation and the one after
+#   an investigation) share LLM_LATENCY_BUDGET seconds; past it the call is abandoned.
+# - Hedged retries: if an attempt has not answered after LLM_HEDGE_DELAY, a second one is
+#   started and the first answer wins; a failed attempt is retried after a short backoff.
+#   Both delays are jittered so synchronized clients do not retry in lockstep.
+# - Circuit breaker: over the last LLM_BREAKER_WINDOW calls, too many errors or too many
+#   slow calls open the circuit. While it is open no LLM call is made and transactions go
+#   straight to the deterministic fallback built from the active policies; after
+#   LLM_BREAKER_COOLDOWN one probe call is let through (half-open) to test recovery.
+
+LLM_LATENCY_BUDGET = float(os.getenv("LLM_LATENCY_BUDGET", "20"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "2"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "4"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.2"))
+# Delays are multiplied by a random factor in [1 - JITTER, 1 + JITTER]
+LLM_JITTER = float(os.getenv("LLM_JITTER", "0.2"))
+# Threads for blocking LLM calls, including hedges and abandoned attempts still running
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "32"))
+
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+# Calls at least this slow count towards the slow-call rate
+LLM_BREAKER_SLOW_CALL = float(os.getenv("LLM_BREAKER_SLOW_CALL", "10"))
+LLM_BREAKER_SLOW_RATE = float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.8"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# With the circuit open, approve transactions no active policy is relevant to instead of
+# flagging them for manual review
+LLM_FALLBACK_SAFE_UNMATCHED = os.getenv("LLM_FALLBACK_SAFE_UNMATCHED", "false").lower() in ("1", "true", "yes")
+
+ATTEMPTS = metrics.counter("sentinel_llm_extra_attempts_total", "LLM attempts beyond the first: hedges of slow calls and retries of failed ones.", ["kind"])
+BREAKER_TRANSITIONS = metrics.counter("sentinel_llm_circuit_transitions_total", "Circuit breaker state changes.", ["state"])
+
+
+class CircuitOpen(RuntimeError):
+    """The LLM circuit is open; no call was made."""
+
+
+class BudgetExceeded(TimeoutError):
+    """The transaction's LLM latency budget ran out."""
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, window: int = LLM_BREAKER_WINDOW, min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 error_rate: float = LLM_BREAKER_ERROR_RATE, slow_call: float = LLM_BREAKER_SLOW_CALL,
+                 slow_rate: float = LLM_BREAKER_SLOW_RATE, cooldown: float = LLM_BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self._calls: deque = deque(maxlen=window)  # (failed, slow)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        BREAKER_TRANSITIONS.inc(state=state)
+        if state == self.OPEN:
+            self._opened_at = self.clock()
+        if state != self.HALF_OPEN:
+            self._probing = False
+        self._calls.clear()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. An allowed call must be `record`ed."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if self.clock() - self._opened_at < self.cooldown:
+                    return False
+                self._transition(self.HALF_OPEN)
+            # Half-open: a single probe at a time
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool, duration: float) -> None:
+        slow = duration >= self.slow_call
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._transition(self.CLOSED if ok and not slow else self.OPEN)
+                return
+            if self.state == self.OPEN:
+                # A call that started before the circuit opened
+                return
+            self._calls.append((not ok, slow))
+            if len(self._calls) >= self.min_calls:
+                failed = sum(1 for f, _ in self._calls if f) / len(self._calls)
+                slowed = sum(1 for _, s in self._calls if s) / len(self._calls)
+                if failed >= self.error_rate or slowed >= self.slow_rate:
+                    self._transition(self.OPEN)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._calls.clear()
+            self._probing = False
+
+
+breaker = CircuitBreaker()
+_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+metrics.gauge("sentinel_llm_circuit_state", "LLM circuit breaker state: 0 closed, 1 half-open, 2 open.",
+              lambda: _STATE_VALUES[breaker.state])
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+        return _executor
+
+
+def jittered(delay: float) -> float:
+    return delay * random.uniform(1 - LLM_JITTER, 1 + LLM_JITTER)
+
+
+def deadline_after(budget: float = LLM_LATENCY_BUDGET) -> float:
+    return time.monotonic() + budget
+
+
+def _budget_exceeded(last_error: Optional[BaseException]) -> BudgetExceeded:
+    detail = f" (last error: {last_error!r})" if last_error is not None else ""
+    return BudgetExceeded(f"LLM latency budget exceeded{detail}")
+
+
+def hedged_call(fn: Callable[[], Any], deadline: float) -> Any:
+    """Call `fn` on the LLM pool with hedging and retries until it answers or `deadline` passes.
+
+    Attempts still queued when the call returns are cancelled; those already running
+    finish in the pool and their results are discarded.
+    """
+    pending: set = set()
+    attempts = 0
+    last_error: Optional[BaseException] = None
+    next_attempt = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                raise _budget_exceeded(last_error)
+            if attempts < LLM_MAX_ATTEMPTS and now >= next_attempt:
+                if attempts:
+                    ATTEMPTS.inc(kind="hedge" if pending else "retry")
+                pending.add(_pool().submit(fn))
+                attempts += 1
+                next_attempt = now + jittered(LLM_HEDGE_DELAY)
+            if not pending:
+                if attempts >= LLM_MAX_ATTEMPTS:
+                    raise last_error
+                time.sleep(max(0.0, min(next_attempt, deadline) - now))
+                continue
+
+            wake = deadline if attempts >= LLM_MAX_ATTEMPTS else min(next_attempt, deadline)
+            done, pending = wait(pending, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                last_error = future.exception()
+                next_attempt = min(next_attempt, time.monotonic() + jittered(LLM_RETRY_BACKOFF))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def ahedged_call(fn: Callable[[], Awaitable[Any]], deadline: float) -> Any:
+    """`hedged_call` for coroutines; losing attempts are cancelled."""
+    pending: set = set()
+    attempts = 0
+    last_error: Optional[BaseException] = None
+    next_attempt = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                raise _budget_exceeded(last_error)
+            if attempts < LLM_MAX_ATTEMPTS and now >= next_attempt:
+                if attempts:
+                    ATTEMPTS.inc(kind="hedge" if pending else "retry")
+                pending.add(asyncio.ensure_future(fn()))
+                attempts += 1
+                next_attempt = now + jittered(LLM_HEDGE_DELAY)
+            if not pending:
+                if attempts >= LLM_MAX_ATTEMPTS:
+                    raise last_error
+                await asyncio.sleep(max(0.0, min(next_attempt, deadline) - now))
+                continue
+
+            wake = deadline if attempts >= LLM_MAX_ATTEMPTS else min(next_attempt, deadline)
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, wake - now), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+                next_attempt = min(next_attempt, time.monotonic() + jittered(LLM_RETRY_BACKOFF))
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def call(fn: Callable[[], Any], deadline: float, circuit: Optional[CircuitBreaker] = breaker) -> Any:
+    """One resilient LLM call: refused while the circuit is open, recorded in the breaker.
+
+    With `circuit=None` only the budget, hedging and retries apply.
+    """
+    if circuit is None:
+        return hedged_call(fn, deadline)
+    if not circuit.allow():
+        raise CircuitOpen("LLM circuit is open")
+    started = time.monotonic()
+    ok = False
+    try:
+        result = hedged_call(fn, deadline)
+        ok = True
+        return result
+    finally:
+        circuit.record(ok, time.monotonic() - started)
+
+
+async def acall(fn: Callable[[], Awaitable[Any]], deadline: float, circuit: Optional[CircuitBreaker] = breaker) -> Any:
+    if circuit is None:
+        return await ahedged_call(fn, deadline)
+    if not circuit.allow():
+        raise CircuitOpen("LLM circuit is open")
+    started = time.monotonic()
+    ok = False
+    try:
+        result = await ahedged_call(fn, deadline)
+        ok = True
+        return result
+    finally:
+        circuit.record(ok, time.monotonic() - started)
+
+
+def fallback_verdict(rules: Optional[policy_rules.RuleSet], index: Optional[policy_selection.PolicyIndex],
+                     transaction: Dict[str, Any], velocity=None) -> Tuple[str, str]:
+    """Deterministic decision from the active policies, for when the LLM cannot be asked.
+
+    Structured rules decide what they can. Otherwise the transaction is flagged for manual
+    review with the policies relevant to it (or approved when none is relevant and
+    LLM_FALLBACK_SAFE_UNMATCHED is set).
+    """
+    verdict = rules.check(transaction, velocity) if rules else None
+    if verdict is not None:
+        return verdict
+    relevant = sorted(index.scores(transaction)) if index is not None else None
+    if relevant == [] and LLM_FALLBACK_SAFE_UNMATCHED:
+        return "SAFE", "LLM unavailable; no active policy is relevant to this transaction."
+    if relevant:
+        names = ", ".join(index.names[p] for p in relevant)
+        return "MANUAL_REVIEW", f"MANUAL REVIEW REQUIRED: LLM unavailable; check against {names}."
+    return "MANUAL_REVIEW", "MANUAL REVIEW REQUIRED: LLM unavailable."
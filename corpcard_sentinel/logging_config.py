@@ -0,0 +1,53 @@
+import os
+import json
+import logging
+
+# Leveled, structured logging for the corpcard_sentinel package.
+# Fields passed with `extra={...}` are appended as key=value pairs (text) or emitted as
+# JSON keys (json). Messages below LOG_LEVEL are dropped before any formatting happens.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES}
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={json.dumps(v, default=str)}" for k, v in fields.items())
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(KeyValueFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    # Only the package logger: uvicorn keeps its own logging configuration
+    logger = logging.getLogger("corpcard_sentinel")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
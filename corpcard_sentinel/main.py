@@ -1,7 +1,21 @@
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException
+import io
+import logging
+import contextlib
+from datetime import datetime
+from typing import List, Optional
+from anyio import from_thread
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from . import models, schemas, database
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, database, aggregates, policy_snapshot, metrics, pagination, export, backfill, idempotency, user_locks
+from .logging_config import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -13,10 +27,20 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
 @app.on_event("startup")
 def startup_event():
     database.init_db()
 
+def invalidate_policy_caches():
+    # Other workers notice the bumped policy version on their next snapshot check
+    policy_snapshot.snapshot_cache.invalidate()
+    from . import sentinel_agent
+    sentinel_agent.verdict_cache.clear()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to CorpCard Sentinel"}
@@ -31,8 +55,35 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 @app.get("/users", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = db.query(models.User).offset(skip).limit(limit).all()
+def read_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    card_status: Optional[schemas.CardStatus] = None,
+    db: Session = Depends(get_db),
+):
+    # Pages by id; pass the X-Next-Cursor header of a response as `cursor` to continue
+    if cursor and skip:
+        raise HTTPException(status_code=400, detail="Use either cursor or skip, not both")
+    limit = min(limit, pagination.MAX_PAGE_SIZE)
+
+    query = db.query(models.User).order_by(models.User.id)
+    if card_status is not None:
+        query = query.filter(models.User.card_status == card_status)
+    if cursor:
+        try:
+            query = pagination.users_after(query, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        query = query.offset(skip)
+
+    # One extra row tells whether there is a next page
+    users = query.limit(limit + 1).all()
+    if len(users) > limit:
+        users = users[:limit]
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor([users[-1].id])
     return users
 
 @app.post("/users/{user_id}/unfreeze", response_model=schemas.User)
@@ -48,10 +99,12 @@ def unfreeze_user(user_id: int, db: Session = Depends(get_db)):
 # Policy CRUD
 @app.post("/policies", response_model=schemas.Policy)
 def create_policy(policy: schemas.PolicyCreate, db: Session = Depends(get_db)):
-    db_policy = models.Policy(**policy.dict())
+    db_policy = models.Policy(**policy.model_dump())
     db.add(db_policy)
+    policy_snapshot.bump_version(db)
     db.commit()
     db.refresh(db_policy)
+    invalidate_policy_caches()
     return db_policy
 
 @app.get("/policies", response_model=List[schemas.Policy])
@@ -65,11 +118,13 @@ def update_policy(policy_id: int, policy: schemas.PolicyUpdate, db: Session = De
     if db_policy is None:
         raise HTTPException(status_code=404, detail="Policy not found")
     
-    for key, value in policy.dict().items():
+    for key, value in policy.model_dump().items():
         setattr(db_policy, key, value)
     
+    policy_snapshot.bump_version(db)
     db.commit()
     db.refresh(db_policy)
+    invalidate_policy_caches()
     return db_policy
 
 @app.delete("/policies/{policy_id}")
@@ -78,33 +133,30 @@ def delete_policy(policy_id: int, db: Session = Depends(get_db)):
     if db_policy is None:
         raise HTTPException(status_code=404, detail="Policy not found")
     db.delete(db_policy)
+    policy_snapshot.bump_version(db)
     db.commit()
+    invalidate_policy_caches()
     return {"ok": True}
 
-# Transaction Trigger
-@app.post("/simulate_transaction", response_model=schemas.Transaction)
-def simulate_transaction(transaction: schemas.TransactionCreate, db: Session = Depends(get_db)):
-    # 1. Check User Status First
-    db_user = db.query(models.User).filter(models.User.id == transaction.user_id).first()
-    if db_user and db_user.card_status == models.CardStatus.FROZEN:
-        # Record the attempted transaction as a violation
-        db_transaction = models.Transaction(**transaction.dict())
-        db_transaction.is_violation = True
-        db_transaction.violation_reason = "Card is FROZEN"
-        db.add(db_transaction)
-        db.commit()
-        db.refresh(db_transaction)
-        return db_transaction
+@app.get("/stats/verdict_cache")
+def read_verdict_cache_stats():
+    from . import sentinel_agent
+    return sentinel_agent.verdict_cache.stats()
 
-    # 2. Save transaction first
-    db_transaction = models.Transaction(**transaction.dict())
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    
-    # 2. Run Policy Enforcement Graph
+@app.get("/stats/risk_tiers")
+def read_risk_tier_stats():
+    from . import risk_model
+    return risk_model.stats()
+
+@app.get("/metrics")
+def read_metrics():
+    # Graph metrics are registered when the agent module is first imported
+    from . import sentinel_agent
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def transaction_to_dict(db_transaction: models.Transaction):
     # We convert the ORM model to a dict for the graph
-    transaction_dict = {
+    return {
         "id": db_transaction.id,
         "user_id": db_transaction.user_id,
         "merchant": db_transaction.merchant,
@@ -113,24 +165,380 @@ def simulate_transaction(transaction: schemas.TransactionCreate, db: Session = D
         "timestamp": db_transaction.timestamp,
         "is_violation": db_transaction.is_violation
     }
-    
-    from . import sentinel_agent
-    result = sentinel_agent.run_transaction_check(transaction_dict)
-    
-    # 3. Update transaction if violation found (optional, but good for record keeping)
-    # The agent 'enforce' node already updates the DB, but we should refresh our object to return the latest state
-    # 3. Update transaction with analysis results
+
+# Transaction Trigger
+# One request is one unit of work: the graph receives the request session, nothing is
+# written while the LLM runs, and the transaction row, the card freeze and the
+# aggregate update are flushed together in a single commit at the end.
+# Enforcement is deliberately not handed to a background queue: the audit fields are
+# columns of the row this commit inserts, and the response needs that row's id, so
+# deferring them would add a second write per transaction instead of saving one. The
+# freeze has to be committed before the user lock is released in any case.
+def set_decision(db_transaction: models.Transaction, result) -> None:
     # Always update violation_reason to capture the analysis even if allowed
     db_transaction.is_violation = result.get('is_violation', False)
     db_transaction.violation_reason = result.get('violation_reason')
-    db.commit()
-    db.refresh(db_transaction)
+
+def record_decision(db: Session, db_transaction: models.Transaction, result) -> None:
+    set_decision(db_transaction, result)
+    db.add(db_transaction)
+    # The aggregate's recent entries reference the transaction id, so insert it first
+    db.flush()
+    if not db_transaction.is_violation:
+        aggregates.record_transaction(db, db_transaction)
+
+def evaluate_transaction(transaction: schemas.TransactionCreate, db: Session) -> models.Transaction:
+    """Check the transaction and stage it with its decision. The caller commits."""
+    # 1. Check User Status First (row-locked until the commit in USER_LOCKS=db mode)
+    db_user = next(iter(user_locks.lock_rows(db, [transaction.user_id])), None)
+    if db_user and db_user.card_status == models.CardStatus.FROZEN:
+        # Record the attempted transaction as a violation
+        db_transaction = models.Transaction(**transaction.model_dump())
+        db_transaction.is_violation = True
+        db_transaction.violation_reason = "Card is FROZEN"
+        db.add(db_transaction)
+        return db_transaction
+
+    # 2. Run Policy Enforcement Graph inside this session
+    db_transaction = models.Transaction(**transaction.model_dump())
+    from . import sentinel_agent
+    result = sentinel_agent.run_transaction_check(transaction_to_dict(db_transaction), db=db)
     
-    print(f"DEBUG: Returning transaction: {db_transaction.violation_reason}")
+    # 3. Save the transaction with the analysis results, together with any freeze
+    record_decision(db, db_transaction, result)
+    return db_transaction
+
+async def aevaluate_transaction(transaction: schemas.TransactionCreate, db: AsyncSession) -> models.Transaction:
+    # Same flow as evaluate_transaction, but the LLM and DB calls are awaited
+    # 1. Check User Status First
+    db_user = next(iter(await db.run_sync(user_locks.lock_rows, [transaction.user_id])), None)
+    if db_user and db_user.card_status == models.CardStatus.FROZEN:
+        # Record the attempted transaction as a violation
+        db_transaction = models.Transaction(**transaction.model_dump())
+        db_transaction.is_violation = True
+        db_transaction.violation_reason = "Card is FROZEN"
+        db.add(db_transaction)
+        return db_transaction
+
+    # 2. Run Policy Enforcement Graph inside this session
+    db_transaction = models.Transaction(**transaction.model_dump())
+    from . import sentinel_agent
+    result = await sentinel_agent.arun_transaction_check(transaction_to_dict(db_transaction), db=db)
+
+    # 3. Save the transaction with the analysis results, together with any freeze
+    await db.run_sync(record_decision, db_transaction, result)
     return db_transaction
 
+def idempotency_request(transaction: schemas.TransactionCreate, key: str) -> str:
+    try:
+        idempotency.validate_key(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Only what the client sent: defaults such as the timestamp differ between retries
+    return idempotency.fingerprint(transaction.model_dump(exclude_unset=True))
+
+def idempotency_error(e: Exception) -> HTTPException:
+    if isinstance(e, idempotency.KeyReused):
+        return HTTPException(status_code=422, detail=str(e))
+    return HTTPException(status_code=409, detail=str(e))
+
+# Retries carry the same Idempotency-Key header: concurrent duplicates wait for the
+# first evaluation, later ones get its stored result without running the graph.
+# Decisions for the same cardholder are serialized from the FROZEN check to the commit.
+# The key is claimed before the user lock, so only the request that owns it takes the
+# lock (held until run_once has committed) and duplicates join its in-flight result.
+def simulate_transaction(transaction: schemas.TransactionCreate, db: Session = Depends(get_db),
+                         idempotency_key: Optional[str] = Header(None)):
+    request_hash = idempotency_request(transaction, idempotency_key) if idempotency_key is not None else None
+    try:
+        with contextlib.ExitStack() as held:
+            def locked_evaluation():
+                held.enter_context(user_locks.hold([transaction.user_id]))
+                return evaluate_transaction(transaction, db)
+
+            if request_hash is not None:
+                return idempotency.run_once(db, idempotency_key, request_hash, locked_evaluation)
+            db_transaction = locked_evaluation()
+            db.commit()
+    except (idempotency.KeyReused, idempotency.InFlightFailed) as e:
+        raise idempotency_error(e)
+    except user_locks.LockTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    logger.debug("Returning transaction", extra={"transaction_id": db_transaction.id, "reason": db_transaction.violation_reason})
+    return db_transaction
+
+async def simulate_transaction_async(transaction: schemas.TransactionCreate, db: AsyncSession = Depends(get_async_db),
+                                     idempotency_key: Optional[str] = Header(None)):
+    request_hash = idempotency_request(transaction, idempotency_key) if idempotency_key is not None else None
+    try:
+        async with contextlib.AsyncExitStack() as held:
+            async def locked_evaluation():
+                await held.enter_async_context(user_locks.ahold([transaction.user_id]))
+                return await aevaluate_transaction(transaction, db)
+
+            if request_hash is not None:
+                return await idempotency.arun_once(db, idempotency_key, request_hash, locked_evaluation)
+            db_transaction = await locked_evaluation()
+            await db.commit()
+    except (idempotency.KeyReused, idempotency.InFlightFailed) as e:
+        raise idempotency_error(e)
+    except user_locks.LockTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return db_transaction
+
+# In async mode one worker process can hold many in-flight evaluations
+app.post("/simulate_transaction", response_model=schemas.Transaction)(
+    simulate_transaction_async if database.ASYNC_MODE else simulate_transaction
+)
+
+def simulate_transactions_batch(transactions: List[schemas.TransactionCreate], db: Session = Depends(get_db)):
+    user_ids = {t.user_id for t in transactions}
+    # All users of the batch are locked together, in shard order
+    try:
+        with user_locks.hold(user_ids):
+            return check_batch(transactions, user_ids, db)
+    except user_locks.LockTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def simulate_transactions_batch_async(transactions: List[schemas.TransactionCreate], db: Session = Depends(get_db)):
+    # Single transactions hold the asyncio user locks in async mode, so batches take the
+    # same ones; the batch itself still runs on the sync session in the threadpool
+    user_ids = {t.user_id for t in transactions}
+    try:
+        async with user_locks.ahold(user_ids):
+            return await run_in_threadpool(check_batch, transactions, user_ids, db)
+    except user_locks.LockTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+app.post("/simulate_transactions/batch", response_model=List[schemas.Transaction])(
+    simulate_transactions_batch_async if database.ASYNC_MODE else simulate_transactions_batch
+)
+
+def check_batch(transactions: List[schemas.TransactionCreate], user_ids: set, db: Session) -> List[models.Transaction]:
+    # 1. Check all user statuses with one query
+    frozen_user_ids = {user.id for user in user_locks.lock_rows(db, user_ids) if user.card_status == models.CardStatus.FROZEN}
+
+    # 2. Split off transactions of frozen cards
+    db_transactions = []
+    to_check = []
+    for transaction in transactions:
+        db_transaction = models.Transaction(**transaction.model_dump())
+        if transaction.user_id in frozen_user_ids:
+            db_transaction.is_violation = True
+            db_transaction.violation_reason = "Card is FROZEN"
+            db.add(db_transaction)
+        else:
+            to_check.append(db_transaction)
+        db_transactions.append(db_transaction)
+
+    # 3. Run the batched Policy Enforcement inside this session
+    from . import sentinel_agent
+    results = sentinel_agent.run_batch_check([transaction_to_dict(t) for t in to_check], db=db)
+
+    # 4. Bulk insert everything with the analysis results in one commit. A user's items
+    # are decided in order: once one freezes the card, the rest are frozen-card attempts
+    for db_transaction, result in zip(to_check, results):
+        if db_transaction.user_id in frozen_user_ids:
+            db_transaction.is_violation = True
+            db_transaction.violation_reason = "Card is FROZEN"
+            continue
+        set_decision(db_transaction, result)
+        if result.get('decision') == "VIOLATION":
+            frozen_user_ids.add(db_transaction.user_id)
+    db.add_all(to_check)
+    # One batched INSERT; the aggregates then reference the new ids
+    db.flush()
+    for db_transaction in to_check:
+        if not db_transaction.is_violation:
+            aggregates.record_transaction(db, db_transaction)
+    db.commit()
+
+    return db_transactions
+
 @app.get("/transactions", response_model=List[schemas.Transaction])
-def read_transactions(skip: int = 0, limit: int = 50, db: Session = Depends(get_db)):
-    from sqlalchemy import desc
-    transactions = db.query(models.Transaction).order_by(desc(models.Transaction.timestamp)).offset(skip).limit(limit).all()
-    return transactions
+def read_transactions(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(50, ge=1),
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    is_violation: Optional[bool] = None,
+    category: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    # Newest first, keyset-paginated on (timestamp, id). `skip` still works but scans
+    # and discards rows; pass the X-Next-Cursor header as `cursor` instead.
+    # `fields` (comma-separated) restricts the columns that are read and returned.
+    if cursor and skip:
+        raise HTTPException(status_code=400, detail="Use either cursor or skip, not both")
+    limit = min(limit, pagination.MAX_PAGE_SIZE)
+    try:
+        selected = pagination.parse_fields(fields)
+        # The sort key is always read so the next cursor can be built
+        columns = selected + [c for c in ("timestamp", "id") if c not in selected]
+        query = db.query(*[getattr(models.Transaction, c) for c in columns])
+        query = pagination.filter_transactions(query, user_id, is_violation, category, since, until)
+        if cursor:
+            query = pagination.transactions_after(query, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    query = pagination.newest_first(query)
+    rows = (query if cursor else query.offset(skip)).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.transaction_cursor(rows[-1])
+
+    transactions = [{c: getattr(row, c) for c in selected} for row in rows]
+    if fields:
+        # A partial row does not match the full response model
+        response = JSONResponse(jsonable_encoder(transactions))
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return response if fields else transactions
+
+@app.get("/audit_logs", response_model=List[schemas.AuditLog])
+def read_audit_logs(
+    response: Response,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    user_id: Optional[int] = None,
+    is_violation: Optional[bool] = None,
+    category: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    # Transactions with the user's name joined in, newest first and paged like /transactions
+    limit = min(limit, pagination.MAX_PAGE_SIZE)
+    t = models.Transaction
+    query = db.query(*pagination.TRANSACTION_COLUMNS.values(), models.User.name.label("user_name"))
+    query = query.outerjoin(models.User, models.User.id == t.user_id)
+    query = pagination.filter_transactions(query, user_id, is_violation, category, since, until)
+    if cursor:
+        try:
+            query = pagination.transactions_after(query, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    rows = pagination.newest_first(query).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.transaction_cursor(rows[-1])
+    return [row._asdict() for row in rows]
+
+@app.get("/stats/summary", response_model=schemas.StatsSummary)
+def read_stats_summary(db: Session = Depends(get_db)):
+    # Dashboard headline numbers, computed with GROUP BY in the database
+    t = models.Transaction
+    totals = {False: (0, 0.0), True: (0, 0.0)}
+    for is_violation, count, amount in db.query(t.is_violation, func.count(t.id), func.sum(t.amount)).group_by(t.is_violation):
+        previous = totals[bool(is_violation)]
+        totals[bool(is_violation)] = (previous[0] + count, previous[1] + (amount or 0.0))
+
+    cards = dict(db.query(models.User.card_status, func.count(models.User.id)).group_by(models.User.card_status).all())
+
+    violation_count = func.count(t.id)
+    by_category = (
+        db.query(t.category, violation_count, func.sum(t.amount))
+        .filter(t.is_violation == True)
+        .group_by(t.category)
+        .order_by(violation_count.desc(), t.category)
+        .all()
+    )
+
+    return {
+        "total_transactions": totals[False][0] + totals[True][0],
+        "violations": totals[True][0],
+        "allowed": totals[False][0],
+        "total_amount": totals[False][1] + totals[True][1],
+        "violation_amount": totals[True][1],
+        "users": sum(cards.values()),
+        "active_cards": cards.get(models.CardStatus.ACTIVE, 0),
+        "frozen_cards": cards.get(models.CardStatus.FROZEN, 0),
+        "violations_by_category": [
+            {"category": category, "violations": count, "amount": amount or 0.0}
+            for category, count, amount in by_category
+        ],
+    }
+
+@app.get("/transactions/export")
+def export_transactions(
+    format: str = "ndjson",
+    user_id: Optional[int] = None,
+    is_violation: Optional[bool] = None,
+    category: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = None,
+):
+    # Streams every matching transaction oldest first through a server-side cursor, so
+    # memory stays flat however large the export is. Same filters as /transactions.
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    try:
+        selected = pagination.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters = {"user_id": user_id, "is_violation": is_violation, "category": category, "since": since, "until": until}
+    media_type, extension = export.FORMATS[format]
+    return StreamingResponse(
+        export.export_stream(format, selected, filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{extension}"'},
+    )
+
+class RequestBody(io.RawIOBase):
+    """Blocking reader over an async request body, for the import running in the threadpool.
+
+    Each read pulls the next chunk from the event loop, so the upload is consumed as the
+    import goes instead of being buffered first.
+    """
+
+    def __init__(self, request: Request):
+        self._chunks = request.stream().__aiter__()
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    async def _next_chunk(self) -> Optional[bytes]:
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = from_thread.run(self._next_chunk)
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+def run_import(body, fmt: str):
+    db = database.SessionLocal()
+    try:
+        return backfill.import_transactions(db, io.TextIOWrapper(body, encoding="utf-8", newline=""), fmt)
+    finally:
+        db.close()
+
+@app.post("/transactions/import")
+async def import_transactions(request: Request, format: str = "ndjson"):
+    # Bulk-loads historical transactions without running the agent; the body is the raw
+    # CSV or NDJSON file, streamed into the import. Invalid rows are skipped and reported
+    # with their line numbers.
+    if format not in backfill.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    return await run_in_threadpool(run_import, io.BufferedReader(RequestBody(request)), format)
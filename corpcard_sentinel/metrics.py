@@ -0,0 +1,228 @@
+import time
+import bisect
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Minimal in-process metrics registry rendered in the Prometheus text exposition format.
+# Counters, histograms and callback gauges with labels; enough for /metrics without
+# pulling in an extra dependency. Values are per worker process.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LabelValues = Tuple[str, ...]
+# Cleared by `recording_disabled` for work that shares the process but is not live
+# traffic, such as an in-process backtest
+_recording: ContextVar[bool] = ContextVar("metrics_recording", default=True)
+
+
+@contextmanager
+def recording_disabled():
+    """Counters and histograms ignore updates made in this context."""
+    token = _recording.set(False)
+    try:
+        yield
+    finally:
+        _recording.reset(token)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        if not _recording.get():
+            return
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: (bucket counts, sum, count)
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        if not _recording.get():
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackGauge(Metric):
+    """A gauge whose current values are read from `callback` at scrape time.
+
+    The callback returns {label values tuple: value}, or a plain number without labels.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name: str, documentation: str, callback: Callable, labelnames: Iterable[str] = ()) -> CallbackGauge:
+    return REGISTRY.register(CallbackGauge(name, documentation, callback, labelnames))
+
+
+def timed(metric: Histogram, **labels):
+    """Decorator observing the duration of a (sync or async) function.
+
+    The wrapped signature is preserved, so LangGraph still passes `config` to nodes.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with metric.time(**labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metric.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Sentinel graph metrics
+NODE_DURATION = histogram("sentinel_node_duration_seconds", "Time spent in each Sentinel graph node.", ["node"])
+LLM_LATENCY = histogram("sentinel_llm_latency_seconds", "Latency of LLM evaluation calls.", ["mode", "outcome"])
+DB_DURATION = histogram("sentinel_db_duration_seconds", "Time spent on database work inside graph nodes.", ["node"])
+DECISIONS = counter("sentinel_decisions_total", "Decisions reached by the pre-filter, the verdict cache or the LLM.", ["decision", "source"])
+INVESTIGATIONS = counter("sentinel_investigations_total", "Investigation loops (history lookups after a SUSPICIOUS verdict).")
+MANUAL_REVIEWS = counter("sentinel_manual_reviews_total", "Fallbacks to MANUAL_REVIEW after an evaluation error.", ["mode"])
+HISTORY_PREFETCHES = counter("sentinel_history_prefetch_total", "Speculative history prefetches by outcome.", ["result"])
+POLICIES_SELECTED = histogram("sentinel_policies_selected", "Policies included in an evaluation prompt after relevance selection.", buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+PROMPT_LENGTH = histogram("sentinel_prompt_length_chars", "Length of each LLM evaluation prompt in characters (about 4 per token).", ["mode"], buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
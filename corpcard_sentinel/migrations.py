@@ -0,0 +1,134 @@
+import sys
+import datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Column, Integer, String, DateTime, Table, MetaData, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import database, models
+
+# Versioned, idempotent schema migrations for MySQL and SQLite.
+# Every step checks the live schema before changing it, so it is safe to run against
+# databases created by `create_all`, by older ad-hoc scripts, or half-migrated ones.
+# Applied versions are recorded in `schema_migrations`.
+
+migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def has_column(connection: Connection, table: str, column: str) -> bool:
+    return column in {c["name"] for c in inspect(connection).get_columns(table)}
+
+
+def has_index(connection: Connection, table: str, index: str) -> bool:
+    return index in {i["name"] for i in inspect(connection).get_indexes(table)}
+
+
+def add_column(connection: Connection, table: str, column: str, column_type: str) -> None:
+    if not has_column(connection, table, column):
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def create_index(connection: Connection, table, index_name: str) -> None:
+    if not has_index(connection, table.name, index_name):
+        index = next(i for i in table.indexes if i.name == index_name)
+        index.create(bind=connection)
+
+
+def create_table(connection: Connection, table) -> None:
+    table.create(bind=connection, checkfirst=True)
+
+
+def _add_violation_reason(connection: Connection) -> None:
+    add_column(connection, "transactions", "violation_reason", "TEXT")
+
+
+def _add_policy_conditions(connection: Connection) -> None:
+    add_column(connection, "policies", "category", "VARCHAR(255)")
+    add_column(connection, "policies", "merchant_pattern", "VARCHAR(255)")
+    add_column(connection, "policies", "amount_threshold", "FLOAT")
+    add_column(connection, "policies", "weekdays", "VARCHAR(100)")
+
+
+def _create_aggregate_and_version_tables(connection: Connection) -> None:
+    create_table(connection, models.UserSpendingAggregate.__table__)
+    create_table(connection, models.PolicyVersion.__table__)
+
+
+def _add_transaction_indexes(connection: Connection) -> None:
+    # Investigation history: WHERE user_id = ? AND is_violation = ? ORDER BY timestamp
+    create_index(connection, models.Transaction.__table__, "ix_transactions_user_violation_timestamp")
+    # /transactions listing: ORDER BY timestamp
+    create_index(connection, models.Transaction.__table__, "ix_transactions_timestamp")
+
+
+def _add_policy_velocity_conditions(connection: Connection) -> None:
+    add_column(connection, "policies", "velocity_limit", "INTEGER")
+    add_column(connection, "policies", "velocity_window_minutes", "INTEGER")
+    add_column(connection, "policies", "velocity_per_merchant", "BOOLEAN DEFAULT FALSE")
+
+
+def _create_idempotency_keys(connection: Connection) -> None:
+    create_table(connection, models.IdempotencyKey.__table__)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "add transactions.violation_reason", _add_violation_reason),
+    (2, "add structured policy conditions", _add_policy_conditions),
+    (3, "create user_spending_aggregates and policy_versions", _create_aggregate_and_version_tables),
+    (4, "add hot-path indexes on transactions", _add_transaction_indexes),
+    (5, "add policy velocity conditions", _add_policy_velocity_conditions),
+    (6, "create idempotency_keys", _create_idempotency_keys),
+]
+
+
+def applied_versions(connection: Connection) -> set:
+    schema_migrations.create(bind=connection, checkfirst=True)
+    return {row.version for row in connection.execute(schema_migrations.select())}
+
+
+def current_version(engine: Optional[Engine] = None) -> int:
+    engine = engine or database.engine
+    with engine.begin() as connection:
+        return max(applied_versions(connection), default=0)
+
+
+def upgrade(engine: Optional[Engine] = None, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to `target` (default: latest). Returns applied versions."""
+    engine = engine or database.engine
+    applied = []
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    for version, name, migrate in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        # One transaction per step (MySQL commits DDL implicitly, so steps stay re-runnable)
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.datetime.utcnow()
+            ))
+        print(f"Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        applied = upgrade()
+        if not applied:
+            print("Database schema is up to date.")
+    elif command == "status":
+        version = current_version()
+        print(f"Current schema version: {version} (latest: {MIGRATIONS[-1][0]})")
+    else:
+        print("Usage: python -m corpcard_sentinel.migrations [upgrade|status]")
+        sys.exit(1)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, Enum, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 import enum
@@ -26,6 +26,17 @@ class Policy(Base):
     description = Column(Text)
     is_active = Column(Boolean, default=True)
 
+    # Optional structured conditions, compiled by policy_rules. All set conditions must match.
+    category = Column(String(255), nullable=True)  # Comma-separated categories
+    merchant_pattern = Column(String(255), nullable=True)  # Case-insensitive regex
+    amount_threshold = Column(Float, nullable=True)  # Matches when amount > threshold
+    weekdays = Column(String(100), nullable=True)  # Comma-separated day names, e.g. "Sat,Sun"
+    # Matches when the user made more than velocity_limit transactions within the window
+    # (at this merchant only, with velocity_per_merchant), this one included
+    velocity_limit = Column(Integer, nullable=True)
+    velocity_window_minutes = Column(Integer, nullable=True)
+    velocity_per_merchant = Column(Boolean, default=False)
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
@@ -39,3 +50,38 @@ class Transaction(Base):
     violation_reason = Column(Text, nullable=True)
 
     user = relationship("User", back_populates="transactions")
+
+    __table_args__ = (
+        # Investigation history: WHERE user_id = ? AND is_violation = ? ORDER BY timestamp
+        Index("ix_transactions_user_violation_timestamp", "user_id", "is_violation", "timestamp"),
+        # /transactions listing: ORDER BY timestamp
+        Index("ix_transactions_timestamp", "timestamp"),
+    )
+
+class UserSpendingAggregate(Base):
+    """Running totals over a user's approved transactions, maintained by `aggregates`."""
+    __tablename__ = "user_spending_aggregates"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    transaction_count = Column(Integer, default=0)
+    total_amount = Column(Float, default=0.0)
+    category_counts = Column(JSON, default=dict)  # {category: count}
+    recent_transactions = Column(JSON, default=list)  # Newest first, bounded ring
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class PolicyVersion(Base):
+    """Single-row counter bumped with every policy change, so workers can cheaply detect stale snapshots."""
+    __tablename__ = "policy_versions"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """Transaction created by a request sent with an Idempotency-Key; written in the same commit."""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # sha256 of the request body
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
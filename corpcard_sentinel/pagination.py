@@ -0,0 +1,103 @@
+import json
+import base64
+import binascii
+import datetime
+from typing import Any, List, Optional, Sequence
+
+from sqlalchemy import and_, or_, desc
+from sqlalchemy.orm import Query
+
+from . import models
+
+# Keyset (cursor) pagination. A cursor is the opaque, URL-safe encoding of the sort key
+# of the last row on a page; the next page continues strictly after it, so deep pages
+# cost the same as the first one instead of scanning and discarding `skip` rows.
+
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+TRANSACTION_COLUMNS = {c.key: c for c in models.Transaction.__table__.columns}
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime.datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _cursor_id(value: Any) -> int:
+    # Cursors come back from clients: anything but an integer id is rejected
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+def filter_transactions(query: Query, user_id: Optional[int] = None, is_violation: Optional[bool] = None,
+                        category: Optional[str] = None, since: Optional[datetime.datetime] = None,
+                        until: Optional[datetime.datetime] = None) -> Query:
+    """Server-side filters shared by the listing and export endpoints. `until` is exclusive."""
+    t = models.Transaction
+    if user_id is not None:
+        query = query.filter(t.user_id == user_id)
+    if is_violation is not None:
+        query = query.filter(t.is_violation == is_violation)
+    if category is not None:
+        query = query.filter(t.category == category)
+    if since is not None:
+        query = query.filter(t.timestamp >= since)
+    if until is not None:
+        query = query.filter(t.timestamp < until)
+    return query
+
+
+def newest_first(query: Query) -> Query:
+    t = models.Transaction
+    return query.order_by(desc(t.timestamp), desc(t.id))
+
+
+def transactions_after(query: Query, cursor: str) -> Query:
+    """Rows after the cursor in newest-first (timestamp, id) order. NULL timestamps sort last."""
+    t = models.Transaction
+    timestamp, last_id = decode_cursor(cursor, 2)
+    last_id = _cursor_id(last_id)
+    if timestamp is None:
+        return query.filter(t.timestamp.is_(None), t.id < last_id)
+    try:
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    return query.filter(or_(
+        t.timestamp < timestamp,
+        and_(t.timestamp == timestamp, t.id < last_id),
+        t.timestamp.is_(None),
+    ))
+
+
+def transaction_cursor(row) -> str:
+    return encode_cursor([row.timestamp, row.id])
+
+
+def users_after(query: Query, cursor: str) -> Query:
+    (last_id,) = decode_cursor(cursor, 1)
+    return query.filter(models.User.id > _cursor_id(last_id))
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Validate a comma-separated column list; all transaction columns when empty."""
+    if not fields:
+        return list(TRANSACTION_COLUMNS)
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in TRANSACTION_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return selected
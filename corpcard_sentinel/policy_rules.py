@@ -0,0 +1,179 @@
+import re
+import logging
+import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Policies may carry structured conditions next to their natural-language description.
+# Those conditions are compiled once into plain Python predicates so that clear-cut
+# transactions can be decided without an LLM round trip.
+
+WEEKDAYS = {
+    "mon": 0, "monday": 0,
+    "tue": 1, "tuesday": 1,
+    "wed": 2, "wednesday": 2,
+    "thu": 3, "thursday": 3,
+    "fri": 4, "friday": 4,
+    "sat": 5, "saturday": 5,
+    "sun": 6, "sunday": 6,
+}
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+
+def split_list(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def transaction_time(transaction: Dict[str, Any]) -> Optional[datetime.datetime]:
+    timestamp = transaction.get("timestamp")
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp
+    if isinstance(timestamp, str):
+        try:
+            return datetime.datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+    return None
+
+
+def _category_predicate(value: str) -> Predicate:
+    categories = {c.lower() for c in split_list(value)}
+    if not categories:
+        raise ValueError(f"Empty category condition: {value!r}")
+    return lambda t: str(t.get("category") or "").lower() in categories
+
+
+def _merchant_predicate(pattern: str) -> Predicate:
+    try:
+        regex = re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        # Not a valid regex, match it literally
+        regex = re.compile(re.escape(pattern), re.IGNORECASE)
+    return lambda t: regex.search(str(t.get("merchant") or "")) is not None
+
+
+def _amount_predicate(threshold: float) -> Predicate:
+    return lambda t: float(t.get("amount") or 0) > threshold
+
+
+def _weekday_predicate(value: str) -> Predicate:
+    days = set()
+    for token in split_list(value):
+        day = WEEKDAYS.get(token.lower())
+        if day is None:
+            raise ValueError(f"Unknown weekday: {token!r}")
+        days.add(day)
+    if not days:
+        raise ValueError(f"Empty weekday condition: {value!r}")
+
+    def predicate(t: Dict[str, Any]) -> bool:
+        when = transaction_time(t)
+        return when is not None and when.weekday() in days
+
+    return predicate
+
+
+class VelocityLimit:
+    """More than `limit` transactions by the user (or at one merchant) within `minutes`."""
+
+    def __init__(self, limit: int, minutes: float, per_merchant: bool = False):
+        self.limit = limit
+        self.minutes = minutes
+        self.per_merchant = per_merchant
+
+    def exceeded(self, velocity) -> bool:
+        # Without counters (velocity tracking off) a burst cannot be seen
+        return velocity is not None and velocity.count(self.minutes, self.per_merchant) > self.limit
+
+
+def _velocity_limit(policy: models.Policy) -> VelocityLimit:
+    limit = int(policy.velocity_limit)
+    minutes = policy.velocity_window_minutes
+    if limit < 0:
+        raise ValueError(f"Negative velocity limit: {limit}")
+    if not minutes or minutes <= 0:
+        raise ValueError("A velocity limit needs a positive velocity_window_minutes")
+    return VelocityLimit(limit, float(minutes), bool(policy.velocity_per_merchant))
+
+
+class CompiledRule:
+    """A policy whose structured conditions all have to match (logical AND)."""
+
+    def __init__(self, policy_id: int, rule_name: str, predicates: List[Predicate],
+                 velocity_limit: Optional[VelocityLimit] = None):
+        self.policy_id = policy_id
+        self.rule_name = rule_name
+        self.predicates = tuple(predicates)
+        self.velocity_limit = velocity_limit
+
+    def matches(self, transaction: Dict[str, Any], velocity=None) -> bool:
+        if self.velocity_limit is not None and not self.velocity_limit.exceeded(velocity):
+            return False
+        return all(predicate(transaction) for predicate in self.predicates)
+
+
+def compile_policy(policy: models.Policy) -> Optional[CompiledRule]:
+    """Compile the structured conditions of a policy.
+
+    Returns None when the policy has no structured conditions, or when they cannot be
+    parsed. Such policies are left to the LLM.
+    """
+    predicates = []
+    velocity_limit = None
+    try:
+        if policy.category:
+            predicates.append(_category_predicate(policy.category))
+        if policy.merchant_pattern:
+            predicates.append(_merchant_predicate(policy.merchant_pattern))
+        if policy.amount_threshold is not None:
+            predicates.append(_amount_predicate(float(policy.amount_threshold)))
+        if policy.weekdays:
+            predicates.append(_weekday_predicate(policy.weekdays))
+        if policy.velocity_limit is not None:
+            velocity_limit = _velocity_limit(policy)
+    except ValueError as e:
+        logger.warning("Ignoring structured conditions of policy '%s': %s", policy.rule_name, e)
+        return None
+
+    if not predicates and velocity_limit is None:
+        return None
+    return CompiledRule(policy.id, policy.rule_name, predicates, velocity_limit)
+
+
+class RuleSet:
+    def __init__(self, rules: List[CompiledRule], has_unstructured: bool):
+        self.rules = rules
+        # True when at least one active policy can only be judged by the LLM
+        self.has_unstructured = has_unstructured
+
+    def check(self, transaction: Dict[str, Any], velocity=None) -> Optional[Tuple[str, str]]:
+        """Return (decision, reason) when the rules settle the transaction, else None.
+
+        `velocity` holds the transaction's sliding-window counters (see `velocity.Velocity`).
+        """
+        for rule in self.rules:
+            if rule.matches(transaction, velocity):
+                return "VIOLATION", f"Policy Violation: {rule.rule_name}"
+
+        # Without free-text policies there is nothing left for the LLM to judge
+        if self.rules and not self.has_unstructured:
+            return "SAFE", "No policy conditions matched."
+        return None
+
+
+def compile_policies(policies: Iterable[models.Policy]) -> RuleSet:
+    rules = []
+    has_unstructured = False
+    for policy in policies:
+        rule = compile_policy(policy)
+        if rule is None:
+            has_unstructured = True
+        else:
+            rules.append(rule)
+    return RuleSet(rules, has_unstructured)
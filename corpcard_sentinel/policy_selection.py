@@ -0,0 +1,177 @@
+import os
+import re
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import models, policy_rules
+
+# Relevance-filtered policy context for the evaluation prompt. Each policy snapshot gets an
+# inverted index over policy keywords and structured fields; a transaction is matched
+# against it by merchant, category, weekday and amount, and only the best-scoring policies
+# that fit the token budget are sent to the LLM. The prompt therefore stays the same size
+# as the catalog grows, instead of carrying every active policy on every call.
+
+POLICY_SELECTION = os.getenv("POLICY_SELECTION", "true").lower() in ("1", "true", "yes")
+# Approximate prompt tokens available for policy text
+POLICY_TOKEN_BUDGET = int(os.getenv("POLICY_TOKEN_BUDGET", "1000"))
+# Catalogs up to this size are offered whole (still within the budget): there is little to
+# save, and nothing is lost to a keyword that happens not to match
+POLICY_SELECTION_MIN_POLICIES = int(os.getenv("POLICY_SELECTION_MIN_POLICIES", "10"))
+# An amount limit is relevant once the transaction reaches this fraction of it
+AMOUNT_PROXIMITY = 0.5
+
+STRUCTURED_MATCH_SCORE = 3.0
+AMOUNT_SCORE = 1.0
+
+_WORD = re.compile(r"[a-z0-9]+")
+_DOLLAR_AMOUNT = re.compile(r"\$\s?(\d[\d,]*(?:\.\d+)?)")
+_STOPWORDS = {
+    "the", "and", "for", "are", "not", "any", "all", "with", "without", "from", "into", "than", "that",
+    "this", "will", "must", "may", "can", "cannot", "per", "each", "such", "unless", "only", "over",
+    "under", "above", "below", "result", "strictly", "require", "requires", "required", "allowed",
+    "prohibited", "forbidden", "transaction", "transactions", "expense", "expenses", "policy",
+}
+
+
+def tokens(text: Optional[str]) -> List[str]:
+    """Lowercased keywords with stop words, short tokens and numbers removed; plurals folded."""
+    result = []
+    for word in _WORD.findall((text or "").lower()):
+        if len(word) < 3 or word.isdigit() or word in _STOPWORDS:
+            continue
+        if word.endswith("ies") and len(word) > 4:
+            word = word[:-3] + "y"
+        elif word.endswith("s") and not word.endswith("ss") and len(word) > 4:
+            word = word[:-1]
+        result.append(word)
+    return result
+
+
+def estimate_tokens(text: str) -> int:
+    # The usual ~4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+_DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def _weekday_terms(value: str) -> List[str]:
+    days = [policy_rules.WEEKDAYS.get(d.lower()) for d in policy_rules.split_list(value)]
+    return [_DAY_NAMES[d] for d in days if d is not None]
+
+
+class PolicyIndex:
+    """Inverted index over one policy snapshot. Read-only once built, so it is shared freely."""
+
+    def __init__(self, policies: Iterable[models.Policy]):
+        # Canonical order: by policy id, so the same selection always renders the same prompt
+        policies = sorted(policies, key=lambda p: (p.id is None, p.id or 0))
+        self.ids: List[Optional[int]] = [p.id for p in policies]
+        self.names: List[str] = [p.rule_name for p in policies]
+        self.texts: List[str] = [f"{p.rule_name}: {p.description}" for p in policies]
+        self.costs: List[int] = [estimate_tokens(t) for t in self.texts]
+        self._positions = {policy_id: position for position, policy_id in enumerate(self.ids)}
+
+        self._postings: Dict[str, List[int]] = {}
+        self._categories: Dict[str, List[int]] = {}
+        self._merchant_patterns: List[Tuple[int, re.Pattern]] = []
+        self._amount_limits: List[Tuple[int, float]] = []
+        for position, policy in enumerate(policies):
+            terms = set(tokens(policy.rule_name)) | set(tokens(policy.description))
+            for category in policy_rules.split_list(policy.category):
+                self._categories.setdefault(category.lower(), []).append(position)
+                terms.update(tokens(category))
+            if policy.weekdays:
+                terms.update(_weekday_terms(policy.weekdays))
+            for term in terms:
+                self._postings.setdefault(term, []).append(position)
+
+            if policy.merchant_pattern:
+                try:
+                    pattern = re.compile(policy.merchant_pattern, re.IGNORECASE)
+                except re.error:
+                    pattern = re.compile(re.escape(policy.merchant_pattern), re.IGNORECASE)
+                self._merchant_patterns.append((position, pattern))
+            limits = [float(a.replace(",", "")) for a in _DOLLAR_AMOUNT.findall(policy.description or "")]
+            if policy.amount_threshold is not None:
+                limits.append(float(policy.amount_threshold))
+            self._amount_limits.extend((position, limit) for limit in limits if limit > 0)
+
+        count = len(policies)
+        self._idf = {term: math.log(1.0 + count / len(postings)) for term, postings in self._postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def amount_band(self, amount: float) -> Tuple[int, int, int]:
+        """How many amount limits `amount` is close to, has reached and exceeds.
+
+        Amounts in the same band compare the same way against every limit, for the
+        selection scores as well as the structured amount rules.
+        """
+        near = reached = exceeded = 0
+        for _, limit in self._amount_limits:
+            near += amount >= limit * AMOUNT_PROXIMITY
+            reached += amount >= limit
+            exceeded += amount > limit
+        return near, reached, exceeded
+
+    def _query_terms(self, transaction: Dict[str, Any]) -> List[str]:
+        terms = tokens(transaction.get("merchant")) + tokens(transaction.get("category"))
+        timestamp = policy_rules.transaction_time(transaction)
+        if timestamp is not None:
+            terms.append(_DAY_NAMES[timestamp.weekday()])
+            if timestamp.weekday() >= 5:
+                terms.append("weekend")
+        return terms
+
+    def scores(self, transaction: Dict[str, Any]) -> Dict[int, float]:
+        """Relevance of each policy position that matches the transaction at all."""
+        scores: Dict[int, float] = {}
+        for term in set(self._query_terms(transaction)):
+            for position in self._postings.get(term, ()):
+                scores[position] = scores.get(position, 0.0) + self._idf[term]
+
+        category = str(transaction.get("category") or "").strip().lower()
+        for position in self._categories.get(category, ()):
+            scores[position] = scores.get(position, 0.0) + STRUCTURED_MATCH_SCORE
+        merchant = str(transaction.get("merchant") or "")
+        for position, pattern in self._merchant_patterns:
+            if pattern.search(merchant):
+                scores[position] = scores.get(position, 0.0) + STRUCTURED_MATCH_SCORE
+
+        amount = float(transaction.get("amount") or 0)
+        for position, limit in self._amount_limits:
+            if amount >= limit * AMOUNT_PROXIMITY:
+                scores[position] = scores.get(position, 0.0) + AMOUNT_SCORE * (2 if amount > limit else 1)
+        return scores
+
+    def select(self, transaction: Dict[str, Any], budget: int = POLICY_TOKEN_BUDGET,
+               min_policies: int = POLICY_SELECTION_MIN_POLICIES) -> List[int]:
+        """Positions of the policies to include, in canonical order.
+
+        The most relevant policies are taken first until the token budget is spent;
+        policies that do not fit are skipped in favour of smaller, less relevant ones.
+        """
+        scores = self.scores(transaction)
+        if len(self) <= min_policies:
+            candidates = range(len(self))
+        else:
+            candidates = scores
+        ranked = sorted(candidates, key=lambda p: (-scores.get(p, 0.0), p))
+
+        selected, spent = [], 0
+        for position in ranked:
+            if spent + self.costs[position] <= budget:
+                selected.append(position)
+                spent += self.costs[position]
+        return sorted(selected)
+
+    def render(self, positions: Iterable[int]) -> Tuple[List[Optional[int]], List[str]]:
+        """(policy ids, policy texts) for the given positions, in canonical order."""
+        positions = sorted(set(positions))
+        return [self.ids[p] for p in positions], [self.texts[p] for p in positions]
+
+    def render_ids(self, policy_ids: Iterable[Optional[int]]) -> List[str]:
+        """Texts of the given policies in canonical order, e.g. for a union of selections."""
+        return self.render(self._positions[i] for i in policy_ids if i in self._positions)[1]
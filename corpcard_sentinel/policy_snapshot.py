@@ -0,0 +1,144 @@
+import os
+import time
+import hashlib
+import threading
+from typing import List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import models, database, policy_rules, policy_selection, metrics
+
+# In-process snapshot of the active policies (rendered strings + compiled rules).
+# It is rebuilt only when the policy version changes: immediately after a local
+# /policies write, or when the periodic version check sees another worker's write.
+
+POLICY_VERSION_ROW_ID = 1
+# How often (seconds) a worker re-reads the version row to catch other workers' changes
+POLICY_SNAPSHOT_CHECK_INTERVAL = float(os.getenv("POLICY_SNAPSHOT_CHECK_INTERVAL", "5"))
+
+
+def fetch_active_policies(db: Session) -> List[models.Policy]:
+    return db.query(models.Policy).filter(models.Policy.is_active == True).all()
+
+
+def format_policy(policy: models.Policy) -> str:
+    return f"{policy.rule_name}: {policy.description}"
+
+
+def policy_set_hash(policies: List[str]) -> str:
+    return hashlib.sha256("\n".join(policies).encode("utf-8")).hexdigest()
+
+
+class PolicySnapshot:
+    def __init__(self, version: int, policies: List[str], rules: policy_rules.RuleSet,
+                 index: Optional[policy_selection.PolicyIndex] = None):
+        self.version = version
+        self.policies = policies
+        self.rules = rules
+        # Picks the policies relevant to a transaction for the LLM prompt
+        self.index = index
+        self.policy_hash = policy_set_hash(policies)
+
+
+def read_version(db: Session) -> int:
+    version = db.query(models.PolicyVersion.version).filter(models.PolicyVersion.id == POLICY_VERSION_ROW_ID).scalar()
+    return version or 0
+
+
+def bump_version(db: Session) -> None:
+    """Increment the policy version inside the caller's transaction. Caller commits."""
+    result = db.execute(
+        update(models.PolicyVersion)
+        .where(models.PolicyVersion.id == POLICY_VERSION_ROW_ID)
+        .values(version=models.PolicyVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.add(models.PolicyVersion(id=POLICY_VERSION_ROW_ID, version=1))
+
+
+def load_snapshot(db: Session) -> PolicySnapshot:
+    version = read_version(db)
+    active_policies = fetch_active_policies(db)
+    return PolicySnapshot(
+        version,
+        [format_policy(p) for p in active_policies],
+        policy_rules.compile_policies(active_policies),
+        policy_selection.PolicyIndex(active_policies),
+    )
+
+
+class PolicySnapshotCache:
+    def __init__(self, check_interval: float = POLICY_SNAPSHOT_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._snapshot: Optional[PolicySnapshot] = None
+        self._checked_at = 0.0
+        # Bumped by invalidate(), so a load that started before it is not installed
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    @property
+    def version(self) -> Optional[int]:
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def _fresh(self) -> Optional[PolicySnapshot]:
+        if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._snapshot
+        return None
+
+    def refresh(self, db: Session) -> PolicySnapshot:
+        """Validate (and if needed rebuild) the snapshot using an open session."""
+        # No lock around the queries: under `run_sync` they yield to the event loop,
+        # and another request blocking on a thread lock there would deadlock the loop
+        with self._lock:
+            snapshot, generation = self._snapshot, self._generation
+        if snapshot is None or read_version(db) != snapshot.version:
+            snapshot = load_snapshot(db)
+            with self._lock:
+                if generation == self._generation:
+                    self._snapshot = snapshot
+                    self._checked_at = time.monotonic()
+                self.reloads += 1
+            return snapshot
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+        return snapshot
+
+    def get(self, db: Optional[Session] = None) -> PolicySnapshot:
+        snapshot = self._fresh()
+        if snapshot is not None:
+            # Hot path: no connection checkout, no query
+            return snapshot
+
+        if db is not None:
+            # Reuse the caller's connection rather than checking out a second one
+            return self.refresh(db)
+        db = database.SessionLocal()
+        try:
+            return self.refresh(db)
+        finally:
+            db.close()
+
+    async def aget(self, db=None) -> PolicySnapshot:
+        snapshot = self._fresh()
+        if snapshot is not None:
+            return snapshot
+
+        if db is not None:
+            return await db.run_sync(self.refresh)
+        async with database.AsyncSessionLocal() as db:
+            return await db.run_sync(self.refresh)
+
+
+snapshot_cache = PolicySnapshotCache()
+metrics.gauge("sentinel_policy_snapshot_version", "Policy version of this worker's snapshot (-1 when not loaded).",
+              lambda: snapshot_cache.version if snapshot_cache.version is not None else -1)
+metrics.gauge("sentinel_policy_snapshot_reloads", "Policy snapshot rebuilds since start.", lambda: snapshot_cache.reloads)
@@ -0,0 +1,74 @@
+import os
+import json
+from typing import Any, Dict, List, Optional
+
+from .cache import TTLCache
+from .policy_snapshot import policy_set_hash
+
+# Evaluation prompts are laid out for provider-side context caching: the system role,
+# the instructions and the policy block form a prefix that is byte-identical for every
+# transaction evaluated against the same policies, and everything that varies per call
+# (transaction details, history) comes after it. The prefix is rendered once per policy
+# set (snapshot version and selection) and reused from a small LRU.
+
+PROMPT_PREFIX_CACHE_SIZE = int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "256"))
+
+SYSTEM_ROLE = "You are a Visa Security Officer."
+NO_POLICIES = "No specific policies defined."
+NO_HISTORY = "No history available yet."
+
+DECISIONS = """Output one of three decisions{per_item}:
+- "SAFE": Approve immediately.
+- "VIOLATION": Freeze immediately (clear policy violation).
+- "SUSPICIOUS": If the transaction is weird but not clearly forbidden (e.g., high amount but valid category), and you need more context."""
+
+SINGLE_INSTRUCTIONS = f"""Analyze if the transaction below violates ANY policy.
+
+{DECISIONS.format(per_item="")}
+
+Return ONLY a JSON object: {{"decision": "SAFE" | "VIOLATION" | "SUSPICIOUS", "reason": "short explanation"}}"""
+
+BATCH_INSTRUCTIONS = f"""Analyze EACH transaction below independently and decide if it violates ANY policy.
+
+{DECISIONS.format(per_item=" per transaction")}
+
+Return ONLY a JSON array with one object per transaction: [{{"item": <item number>, "decision": "SAFE" | "VIOLATION" | "SUSPICIOUS", "reason": "short explanation"}}]"""
+
+
+def policy_block(policies: List[str]) -> str:
+    return "\n".join(policies) if policies else NO_POLICIES
+
+
+class PromptRenderer:
+    def __init__(self, maxsize: int = PROMPT_PREFIX_CACHE_SIZE):
+        self._prefixes = TTLCache(maxsize=maxsize, ttl=float("inf"))
+
+    def prefix(self, policies: List[str], policy_hash: Optional[str] = None, batch: bool = False) -> str:
+        """The stable part of the prompt for a policy set. Pass the set's hash when it is known."""
+        key = ("batch" if batch else "single", policy_hash or policy_set_hash(policies))
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            instructions = BATCH_INSTRUCTIONS if batch else SINGLE_INSTRUCTIONS
+            prefix = f"{SYSTEM_ROLE}\n\nPolicies:\n{policy_block(policies)}\n\n{instructions}\n"
+            self._prefixes.set(key, prefix)
+        return prefix
+
+    def evaluation(self, transaction: Dict[str, Any], policies: List[str], history: Optional[str],
+                   policy_hash: Optional[str] = None, velocity: Optional[str] = None) -> str:
+        prompt = (
+            self.prefix(policies, policy_hash)
+            + f"\nTransaction: {json.dumps(transaction, default=str)}\nUser History: {history or NO_HISTORY}\n"
+        )
+        if velocity:
+            prompt += f"Recent Velocity: {velocity}\n"
+        return prompt
+
+    def batch(self, transactions: List[Dict[str, Any]], policies: List[str], policy_hash: Optional[str] = None) -> str:
+        items = [{"item": i, **transaction} for i, transaction in enumerate(transactions)]
+        return self.prefix(policies, policy_hash, batch=True) + f"\nTransactions: {json.dumps(items, default=str)}\n"
+
+    def stats(self) -> Dict[str, Any]:
+        return self._prefixes.stats()
+
+
+renderer = PromptRenderer()
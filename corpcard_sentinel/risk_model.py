@@ -0,0 +1,177 @@
+import os
+import json
+import math
+import logging
+import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from . import metrics, policy_rules
+
+logger = logging.getLogger(__name__)
+
+# First-tier local risk scoring. A logistic model over cheap features (amount, category,
+# merchant and category novelty for the user, time of day, the user's spending profile and
+# velocity) scores each transaction the rules could not settle, in microseconds and
+# without a network call. Scores below RISK_LOW_THRESHOLD are approved, scores at or
+# above RISK_HIGH_THRESHOLD are violations, and only the band in between goes to the LLM.
+#
+# The model is a JSON file ({"bias": ..., "weights": {feature: weight}}) trained offline
+# from labelled transaction history with `python -m corpcard_sentinel.train_risk_model`;
+# a hand-tuned scorecard in the same format works as well. Without RISK_MODEL every
+# transaction goes to the LLM, as before.
+
+RISK_MODEL = os.getenv("RISK_MODEL")
+RISK_LOW_THRESHOLD = float(os.getenv("RISK_LOW_THRESHOLD", "0.02"))
+RISK_HIGH_THRESHOLD = float(os.getenv("RISK_HIGH_THRESHOLD", "0.98"))
+
+TIERS = ("low", "uncertain", "high")
+
+TIER_DECISIONS = metrics.counter("sentinel_risk_tier_total", "Transactions scored by the local risk model, by tier.", ["tier"])
+SCORES = metrics.histogram("sentinel_risk_score", "Local risk model scores.",
+                           buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99))
+
+
+class UserProfile:
+    """The parts of a user's approved spending history the model looks at."""
+
+    __slots__ = ("count", "total", "categories", "merchants")
+
+    def __init__(self, count: int = 0, total: float = 0.0, categories: Optional[Dict[str, int]] = None,
+                 merchants: Iterable[Optional[str]] = ()):
+        self.count = count
+        self.total = total
+        self.categories = categories or {}
+        # Recently used merchants, normalized
+        self.merchants = frozenset(_normalize(m) for m in merchants)
+
+    @classmethod
+    def from_aggregate(cls, aggregate) -> "UserProfile":
+        return cls(aggregate.transaction_count or 0, aggregate.total_amount or 0.0, aggregate.category_counts,
+                   (e.get("merchant") for e in aggregate.recent_transactions or []))
+
+
+def _normalize(value: Optional[str]) -> str:
+    return str(value or "").strip().lower()
+
+
+def features(transaction: Dict[str, Any], profile: UserProfile, velocity=None) -> Dict[str, float]:
+    """Sparse feature vector of one transaction, given the user's history before it."""
+    amount = max(float(transaction.get("amount") or 0.0), 0.0)
+    category = transaction.get("category")
+    result = {
+        "log_amount": math.log1p(amount),
+        "log_history": math.log1p(profile.count),
+        f"category={_normalize(category)}": 1.0,
+    }
+    if profile.count:
+        mean = profile.total / profile.count
+        result["amount_vs_mean"] = math.log((amount + 1.0) / (mean + 1.0))
+        result["category_share"] = profile.categories.get(category, 0) / profile.count
+        result["new_category"] = float(category not in profile.categories)
+        result["new_merchant"] = float(_normalize(transaction.get("merchant")) not in profile.merchants)
+    else:
+        result["new_user"] = 1.0
+
+    at = policy_rules.transaction_time(transaction) or datetime.datetime.utcnow()
+    if at.hour < 6:
+        result["night"] = 1.0
+    if at.weekday() >= 5:
+        result["weekend"] = 1.0
+
+    if velocity is not None:
+        result["velocity_5m"] = math.log1p(velocity.count(5))
+        result["velocity_60m"] = math.log1p(velocity.count(60))
+        result["merchant_velocity_60m"] = math.log1p(velocity.count(60, per_merchant=True))
+    return result
+
+
+def sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class RiskModel:
+    """Logistic scorer: P(violation) = sigmoid(bias + sum of weight * feature)."""
+
+    def __init__(self, bias: float, weights: Dict[str, float], metadata: Optional[Dict[str, Any]] = None):
+        self.bias = bias
+        self.weights = weights
+        self.metadata = metadata or {}
+
+    def score_features(self, values: Dict[str, float]) -> float:
+        weights = self.weights
+        return sigmoid(self.bias + sum(weights.get(name, 0.0) * value for name, value in values.items()))
+
+    def score(self, transaction: Dict[str, Any], profile: UserProfile, velocity=None) -> float:
+        return self.score_features(features(transaction, profile, velocity))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": 1, "bias": self.bias, "weights": self.weights, **self.metadata}
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RiskModel":
+        metadata = {k: v for k, v in data.items() if k not in ("version", "bias", "weights")}
+        return cls(float(data.get("bias", 0.0)), {k: float(v) for k, v in data["weights"].items()}, metadata)
+
+    @classmethod
+    def load(cls, path: str) -> "RiskModel":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def tier(score: float, low: Optional[float] = None, high: Optional[float] = None) -> str:
+    low = RISK_LOW_THRESHOLD if low is None else low
+    high = RISK_HIGH_THRESHOLD if high is None else high
+    if score < low:
+        return "low"
+    if score >= high:
+        return "high"
+    return "uncertain"
+
+
+def _load_configured() -> Optional[RiskModel]:
+    if not RISK_MODEL:
+        return None
+    try:
+        return RiskModel.load(RISK_MODEL)
+    except (OSError, ValueError, KeyError) as e:
+        # Scoring is an optimization: without a usable model everything goes to the LLM
+        logger.error("Could not load risk model %s, tiered scoring disabled: %r", RISK_MODEL, e)
+        return None
+
+
+model: Optional[RiskModel] = _load_configured()
+
+
+def observe(score: float) -> str:
+    result = tier(score)
+    SCORES.observe(score)
+    TIER_DECISIONS.inc(tier=result)
+    return result
+
+
+def tier_rates() -> Dict[tuple, float]:
+    counts = {t: TIER_DECISIONS.value(tier=t) for t in TIERS}
+    total = sum(counts.values())
+    return {(t,): counts[t] / total if total else 0.0 for t in TIERS}
+
+
+metrics.gauge("sentinel_risk_tier_rate", "Share of scored transactions per risk tier since start.", tier_rates, ["tier"])
+
+
+def stats() -> Dict[str, Any]:
+    rates = tier_rates()
+    return {
+        "enabled": model is not None,
+        "low_threshold": RISK_LOW_THRESHOLD,
+        "high_threshold": RISK_HIGH_THRESHOLD,
+        "tiers": {t: {"count": int(TIER_DECISIONS.value(tier=t)), "rate": rates[(t,)]} for t in TIERS},
+    }
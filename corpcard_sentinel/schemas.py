@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -27,6 +27,13 @@ class PolicyBase(BaseModel):
     rule_name: str
     description: Optional[str] = None
     is_active: bool = True
+    category: Optional[str] = None
+    merchant_pattern: Optional[str] = None
+    amount_threshold: Optional[float] = None
+    weekdays: Optional[str] = None
+    velocity_limit: Optional[int] = None
+    velocity_window_minutes: Optional[int] = None
+    velocity_per_merchant: Optional[bool] = False
 
 class PolicyCreate(PolicyBase):
     pass
@@ -58,3 +65,23 @@ class Transaction(TransactionBase):
 
     class Config:
         orm_mode = True
+
+# Dashboard Schemas
+class AuditLog(Transaction):
+    user_name: Optional[str] = None
+
+class CategoryViolations(BaseModel):
+    category: Optional[str] = None
+    violations: int
+    amount: float
+
+class StatsSummary(BaseModel):
+    total_transactions: int
+    violations: int
+    allowed: int
+    total_amount: float
+    violation_amount: float
+    users: int
+    active_cards: int
+    frozen_cards: int
+    violations_by_category: List[CategoryViolations]
@@ -9,7 +9,13 @@ def seed_data():
         policies = [
             {
                 "rule_name": "No Gambling", 
-                "description": "Transactions at casinos, betting sites, or lottery merchants are strictly prohibited and will result in immediate card freeze."
+                "description": "Transactions at casinos, betting sites, or lottery merchants are strictly prohibited and will result in immediate card freeze.",
+                "category": "Gambling"
+            },
+            {
+                "rule_name": "High Value Transactions",
+                "description": "Any single transaction above $5000 is blocked pending finance review.",
+                "amount_threshold": 5000
             },
             {
                 "rule_name": "Travel Meal Limit", 
@@ -37,7 +43,7 @@ def seed_data():
         for p_data in policies:
             exists = db.query(models.Policy).filter_by(rule_name=p_data["rule_name"]).first()
             if not exists:
-                policy = models.Policy(rule_name=p_data["rule_name"], description=p_data["description"], is_active=True)
+                policy = models.Policy(is_active=True, **p_data)
                 db.add(policy)
                 print(f"✅ Added policy: {p_data['rule_name']}")
             else:
@@ -1,25 +1,63 @@
 import os
 import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypedDict, List, Dict, Any, Optional, Literal
 from langgraph.graph import StateGraph, END
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
 
-from . import models, database
+from . import models, database, policy_rules, policy_selection, prompts, aggregates, metrics, velocity, llm_resilience, risk_model
+from .policy_snapshot import PolicySnapshot, snapshot_cache, fetch_active_policies, format_policy, policy_set_hash
+from .cache import TTLCache
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize LLM
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
-    print("WARNING: GOOGLE_API_KEY not found in environment variables.")
+    logger.warning("GOOGLE_API_KEY not found in environment variables.")
 
 LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
 llm = ChatGoogleGenerativeAI(model=LLM_MODEL, google_api_key=GOOGLE_API_KEY)
+# Breaker guarding `llm`; None calls it without one (offline replays swap both)
+llm_circuit: Optional[llm_resilience.CircuitBreaker] = llm_resilience.breaker
+
+# Verdict cache: repeat transactions (same user, merchant, category, similar amount on
+# the same side of every policy limit, same weekday and hour, same history and policy
+# set) reuse the previous LLM decision.
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "10000"))
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "3600"))
+# Amounts within the same geometric bucket (5% wide by default) share a cache entry
+VERDICT_CACHE_AMOUNT_STEP = float(os.getenv("VERDICT_CACHE_AMOUNT_STEP", "0.05"))
+verdict_cache = TTLCache(maxsize=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL)
+metrics.gauge("sentinel_verdict_cache_entries", "Entries in the verdict cache.", lambda: verdict_cache.stats()["size"])
+metrics.gauge("sentinel_verdict_cache_hits", "Verdict cache hits since start.", lambda: verdict_cache.stats()["hits"])
+metrics.gauge("sentinel_verdict_cache_misses", "Verdict cache misses since start.", lambda: verdict_cache.stats()["misses"])
+metrics.gauge("sentinel_verdict_cache_evictions", "Verdict cache LRU evictions since start.", lambda: verdict_cache.stats()["evictions"])
+
+# Number of transactions packed into a single batch evaluation prompt
+BATCH_EVAL_SIZE = int(os.getenv("BATCH_EVAL_SIZE", "10"))
+
+# Speculative history prefetch: when the rules cannot settle a transaction, the spending
+# history is loaded in the background while the first LLM evaluation runs, so a
+# SUSPICIOUS verdict does not wait for the database before investigating.
+HISTORY_PREFETCH = os.getenv("HISTORY_PREFETCH", "false").lower() in ("1", "true", "yes")
+HISTORY_PREFETCH_WORKERS = int(os.getenv("HISTORY_PREFETCH_WORKERS", "8"))
+# The prefetch needs a second pooled connection; if it is not done by then (e.g. the
+# pool is exhausted), investigate reads on the request's own session instead
+HISTORY_PREFETCH_TIMEOUT = float(os.getenv("HISTORY_PREFETCH_TIMEOUT", "1.0"))
+_prefetch_executor: Optional[ThreadPoolExecutor] = None
 
 class AgentState(TypedDict):
     transaction: Dict[str, Any]
@@ -29,140 +67,539 @@ class AgentState(TypedDict):
     investigation_count: int
     spending_history: Optional[str]
     decision: Optional[Literal["SAFE", "VIOLATION", "SUSPICIOUS", "MANUAL_REVIEW"]]
+    rules: Optional[policy_rules.RuleSet]
+    policy_hash: Optional[str]
+    policy_index: Optional[policy_selection.PolicyIndex]
+    # Policies included in the evaluation prompt (None: all active policies)
+    policy_ids: Optional[List[int]]
+    # Sliding-window counters as of this transaction (None: velocity tracking off)
+    velocity: Optional[velocity.Velocity]
+    # Monotonic time by which every LLM call for this transaction must have answered
+    llm_deadline: Optional[float]
 
 def fetch_policies(db: Session) -> List[str]:
-    policies = db.query(models.Policy).filter(models.Policy.is_active == True).all()
-    return [f"{p.rule_name}: {p.description}" for p in policies]
-
-from sqlalchemy import func
+    return [format_policy(p) for p in fetch_active_policies(db)]
 
 def get_user_spending_history(db: Session, user_id: int) -> str:
-    # Fetch all past transactions for this user (excluding current one ideally, but simple query is fine)
-    transactions = db.query(models.Transaction).filter(
-        models.Transaction.user_id == user_id,
-        models.Transaction.is_violation == False # Only look at approved history
-    ).order_by(models.Transaction.timestamp.desc()).all()
-    
-    if not transactions:
-        return "No previous approved spending history."
-    
-    total_spent = sum(t.amount for t in transactions)
-    count = len(transactions)
-    avg_spend = total_spent / count if count > 0 else 0
-    
-    # Top categories
-    categories = {}
-    for t in transactions:
-        categories[t.category] = categories.get(t.category, 0) + 1
-    top_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:3]
-    top_cats_str = ", ".join([f"{c} ({n})" for c, n in top_categories])
-    
-    # Last 3 transactions
-    last_3 = transactions[:3]
-    last_3_str = "; ".join([f"{t.timestamp.date()}: ${t.amount} at {t.merchant} ({t.category})" for t in last_3])
-    
-    summary = (
-        f"User has {count} approved transactions totaling ${total_spent:.2f}. "
-        f"Average spend: ${avg_spend:.2f}. "
-        f"Top categories: {top_cats_str}. "
-        f"Recent activity: {last_3_str}."
+    # O(1): built from the maintained per-user aggregate instead of a history scan
+    return aggregates.summarize(aggregates.get_aggregate(db, user_id))
+
+def _digest(text: Optional[str]) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+def amount_bucket(amount: float) -> int:
+    if amount <= 0:
+        return -1
+    return math.floor(math.log(amount) / math.log1p(VERDICT_CACHE_AMOUNT_STEP))
+
+def amount_key(amount: float, index: Optional[policy_selection.PolicyIndex]) -> tuple:
+    if index is None:
+        # Without the index the policy limits are unknown: only the exact amount is safe
+        return (round(amount, 2),)
+    # Geometric buckets are cut at every policy limit, so $99 and $101 never share a
+    # verdict under a $100 policy
+    return (amount_bucket(amount), index.amount_band(amount))
+
+def verdict_cache_key(state: AgentState) -> tuple:
+    transaction = state['transaction']
+    # Weekday and hour rules and prompts make the time part of the verdict
+    at = policy_rules.transaction_time(transaction)
+    return (
+        transaction.get('user_id'),
+        str(transaction.get('merchant') or "").strip().lower(),
+        str(transaction.get('category') or "").strip().lower(),
+        amount_key(float(transaction.get('amount') or 0), state.get('policy_index')),
+        (at.weekday(), at.hour) if at else None,
+        _digest(state.get('spending_history')),
+        state.get('policy_hash') or policy_set_hash(state['policies']),
+        state['velocity'].cache_key() if state.get('velocity') else None,
     )
-    return summary
 
+def parse_llm_decision(content: str):
+    content = content.strip()
+
+    # Clean up potential markdown code blocks
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.endswith("```"):
+        content = content[:-3]
+
+    result = json.loads(content.strip())
+    decision = result.get("decision", "VIOLATION").upper()
+    reason = result.get("reason", "No reason provided.")
+    return decision, reason
+
+def build_evaluation_prompt(transaction: Dict[str, Any], policies: List[str], history: Optional[str],
+                            policy_hash: Optional[str] = None, velocity_summary: Optional[str] = None) -> str:
+    # Stable prefix (role, instructions, policies) first, per-transaction details last
+    return prompts.renderer.evaluation(transaction, policies, history, policy_hash, velocity_summary)
+
+def request_session(config: Optional[RunnableConfig]):
+    """The caller's session when the graph runs inside its unit of work, else None."""
+    return ((config or {}).get("configurable") or {}).get("db")
+
+def is_dry_run(config: Optional[RunnableConfig]) -> bool:
+    """Backtests replay the graph without enforcing anything."""
+    return bool(((config or {}).get("configurable") or {}).get("dry_run"))
+
+def history_prefetch(config: Optional[RunnableConfig]):
+    return ((config or {}).get("configurable") or {}).get("history_prefetch")
+
+def known_profile(config: Optional[RunnableConfig]) -> Optional[risk_model.UserProfile]:
+    """The user's profile when the caller already has it (backtests replay it from history)."""
+    return ((config or {}).get("configurable") or {}).get("user_profile")
+
+def prefetch_spending_history(user_id: int) -> str:
+    # Own session, read only. Nothing is written before the request's final commit,
+    # so this sees the same history the request session would.
+    db = database.SessionLocal()
+    try:
+        return get_user_spending_history(db, user_id)
+    finally:
+        db.close()
+
+async def aprefetch_spending_history(user_id: int) -> str:
+    async with database.AsyncSessionLocal() as db:
+        return await db.run_sync(get_user_spending_history, user_id)
+
+def _prefetch_pool() -> ThreadPoolExecutor:
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(max_workers=HISTORY_PREFETCH_WORKERS, thread_name_prefix="history-prefetch")
+    return _prefetch_executor
+
+class HistoryPrefetch:
+    """Spending history loaded on a worker thread while the first evaluation runs."""
+
+    def __init__(self):
+        self.future = None
+
+    def start(self, user_id: int) -> None:
+        if self.future is None:
+            self.future = _prefetch_pool().submit(prefetch_spending_history, user_id)
+
+    def result(self) -> Optional[str]:
+        """The prefetched history, or None when it was never started or failed."""
+        if self.future is None:
+            return None
+        try:
+            return self.future.result(timeout=HISTORY_PREFETCH_TIMEOUT)
+        except Exception as e:
+            logger.warning("History prefetch failed, reading synchronously: %r", e)
+            return None
+
+    def cancel(self) -> None:
+        # A load that already started runs to completion and is discarded
+        if self.future is not None:
+            self.future.cancel()
+
+class AsyncHistoryPrefetch:
+    """Spending history loaded as an event loop task while the first evaluation runs."""
+
+    def __init__(self):
+        self.task = None
+
+    def start(self, user_id: int) -> None:
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(aprefetch_spending_history(user_id))
+
+    async def result(self) -> Optional[str]:
+        if self.task is None:
+            return None
+        try:
+            # Shielded: a timeout must not cancel the query while its session is open
+            return await asyncio.wait_for(asyncio.shield(self.task), HISTORY_PREFETCH_TIMEOUT)
+        except Exception as e:
+            logger.warning("History prefetch failed, reading synchronously: %r", e)
+            return None
+
+    def cancel(self) -> None:
+        # Never cancelled mid-query (that leaves the async session open): a load that
+        # already started runs to completion, closes its session and is discarded
+        if self.task is not None and not self.task.done():
+            _abandoned_prefetches.add(self.task)
+            self.task.add_done_callback(_discard_prefetch)
+
+# The event loop only keeps weak references to tasks
+_abandoned_prefetches: set = set()
+
+def _discard_prefetch(task: asyncio.Task) -> None:
+    _abandoned_prefetches.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("Discarded history prefetch failed: %r", task.exception())
+
+@metrics.timed(metrics.NODE_DURATION, node="monitor")
 def monitor(state: AgentState) -> AgentState:
-    print(f"Monitoring transaction: {state['transaction']}")
+    logger.debug("Monitoring transaction", extra={"transaction": state['transaction']})
     return state
 
-def evaluate(state: AgentState) -> AgentState:
-    transaction = state['transaction']
-    policies = state['policies']
-    history = state.get('spending_history', "No history available yet.")
+def select_policies(state: AgentState) -> AgentState:
+    """Narrow the prompt's policies to those relevant to the transaction, within the token budget."""
+    index = state.get('policy_index')
+    if index is None or not policy_selection.POLICY_SELECTION:
+        return state
+    policy_ids, policies = index.render(index.select(state['transaction']))
+    metrics.POLICIES_SELECTED.observe(len(policy_ids))
+    logger.debug("Selected policies", extra={"transaction_id": state['transaction'].get('id'), "policy_ids": policy_ids})
+    return {**state, "policies": policies, "policy_ids": policy_ids, "policy_hash": policy_set_hash(policies)}
+
+def _count_decision(state: AgentState, source: str) -> AgentState:
+    metrics.DECISIONS.inc(decision=state['decision'], source=source)
+    return state
+
+@metrics.timed(metrics.NODE_DURATION, node="precheck")
+def precheck(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    # Deterministic policy rules settle clear-cut cases without calling the LLM
+    rules = state.get('rules')
+    verdict = rules.check(state['transaction'], state.get('velocity')) if rules else None
+    if verdict is None:
+        # The LLM has to look at it: start loading the history it may ask for
+        prefetch = history_prefetch(config)
+        if prefetch is not None:
+            prefetch.start(state['transaction']['user_id'])
+        return select_policies(state)
+
+    decision, reason = verdict
+    return _count_decision({
+        **state,
+        "is_violation": decision == "VIOLATION",
+        "violation_reason": reason,
+        "decision": decision
+    }, "rules")
+
+def get_user_profile(db: Session, user_id: int) -> risk_model.UserProfile:
+    return risk_model.UserProfile.from_aggregate(aggregates.get_aggregate(db, user_id))
+
+def _tier_decision(state: AgentState, risk_score: float) -> AgentState:
+    tier = risk_model.observe(risk_score)
+    if tier == "low":
+        decision, reason = "SAFE", f"Low risk score ({risk_score:.3f}) from the local risk model."
+    elif tier == "high":
+        decision, reason = "VIOLATION", f"Policy Violation: high risk score ({risk_score:.3f}) from the local risk model."
+    else:
+        # The uncertain band is left to the LLM
+        return state
+    return _count_decision({
+        **state,
+        "is_violation": decision == "VIOLATION",
+        "violation_reason": reason,
+        "decision": decision
+    }, "risk_model")
+
+@metrics.timed(metrics.NODE_DURATION, node="score")
+def score(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    # Local first tier: clearly routine or clearly risky transactions skip the LLM
+    model = risk_model.model
+    if model is None:
+        return state
+    profile = known_profile(config)
+    if profile is None:
+        user_id = state['transaction']['user_id']
+        with metrics.DB_DURATION.time(node="score"):
+            db = request_session(config)
+            if db is not None:
+                profile = get_user_profile(db, user_id)
+            else:
+                db = database.SessionLocal()
+                try:
+                    profile = get_user_profile(db, user_id)
+                finally:
+                    db.close()
+    return _tier_decision(state, model.score(state['transaction'], profile, state.get('velocity')))
+
+@metrics.timed(metrics.NODE_DURATION, node="score")
+async def ascore(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    model = risk_model.model
+    if model is None:
+        return state
+    profile = known_profile(config)
+    if profile is None:
+        user_id = state['transaction']['user_id']
+        with metrics.DB_DURATION.time(node="score"):
+            db = request_session(config)
+            if db is not None:
+                profile = await db.run_sync(get_user_profile, user_id)
+            else:
+                async with database.AsyncSessionLocal() as db:
+                    profile = await db.run_sync(get_user_profile, user_id)
+    return _tier_decision(state, model.score(state['transaction'], profile, state.get('velocity')))
+
+def apply_decision(state: AgentState, decision: str, reason: str) -> AgentState:
+    # Logic for handling decisions
+    is_violation = False
     
-    # Construct Prompt
-    prompt_template = PromptTemplate.from_template(
-        """You are a Visa Security Officer. 
-        
-        Transaction: {transaction_details} 
-        Policies: {active_policy_list} 
-        User History: {user_history}
-        
-        Analyze if this transaction violates ANY policy.
-        
-        Output one of three decisions:
-        - "SAFE": Approve immediately.
-        - "VIOLATION": Freeze immediately (clear policy violation).
-        - "SUSPICIOUS": If the transaction is weird but not clearly forbidden (e.g., high amount but valid category), and you need more context.
-        
-        Return ONLY a JSON object: {{"decision": "SAFE" | "VIOLATION" | "SUSPICIOUS", "reason": "short explanation"}}
-        """
-    )
+    if decision == "VIOLATION":
+        is_violation = True
+    elif decision == "SUSPICIOUS":
+        if state['investigation_count'] >= 1:
+            # Loop limit reached, fail closed
+            decision = "VIOLATION"
+            is_violation = True
+            reason = f"Suspicious activity confirmed after investigation. {reason}"
+        else:
+            # Keep as suspicious to trigger investigation
+            is_violation = False 
+    else:
+        # SAFE
+        is_violation = False
+
+    return {
+        **state,
+        "is_violation": is_violation,
+        "violation_reason": reason,
+        "decision": decision
+    }
+
+def manual_review(state: AgentState, error: Exception, mode: str = "single") -> AgentState:
+    # Fail-Open but Flag: Allow transaction but mark for manual review
+    metrics.MANUAL_REVIEWS.inc(mode=mode)
+    return _count_decision({
+        **state,
+        "is_violation": False,
+        "violation_reason": f"MANUAL REVIEW REQUIRED: System Error ({str(error)})",
+        "decision": "MANUAL_REVIEW"
+    }, "fallback")
+
+def rules_fallback(state: AgentState) -> AgentState:
+    # The LLM circuit is open: decide from the active policies alone
+    decision, reason = llm_resilience.fallback_verdict(state.get('rules'), state.get('policy_index'),
+                                                       state['transaction'], state.get('velocity'))
+    return _count_decision(apply_decision(state, decision, reason), "circuit_open")
+
+def _with_llm_deadline(state: AgentState) -> AgentState:
+    # The budget starts at the first evaluation and also covers the one after investigating
+    if state.get('llm_deadline') is not None:
+        return state
+    return {**state, "llm_deadline": llm_resilience.deadline_after()}
+
+def _velocity_summary(state: AgentState) -> Optional[str]:
+    return state['velocity'].summary() if state.get('velocity') else None
+
+def _evaluation_prompt(state: AgentState) -> str:
+    prompt = build_evaluation_prompt(state['transaction'], state['policies'], state.get('spending_history'),
+                                     state.get('policy_hash'), _velocity_summary(state))
     
-    prompt = prompt_template.format(
-        transaction_details=json.dumps(transaction, default=str),
-        active_policy_list="\n".join(policies) if policies else "No specific policies defined.",
-        user_history=history
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM prompt", extra={"transaction_id": state['transaction'].get('id'), "prompt": prompt, "prompt_chars": len(prompt)})
+    return prompt
+
+def _record_llm_verdict(cache_key: tuple, response) -> tuple:
+    content = response.content.strip()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("LLM response", extra={"response": content})
     
-    print(f"DEBUG: LLM Prompt:\n{prompt}")
+    verdict = parse_llm_decision(content)
+    verdict_cache.set(cache_key, verdict)
+    return verdict
+
+def invoke_llm(prompt: str, mode: str = "single", deadline: Optional[float] = None):
+    """Call the LLM by `deadline` (default: a fresh latency budget), hedged and behind the circuit breaker.
+
+    Raises llm_resilience.CircuitOpen, without calling the LLM, while the circuit is open.
+    """
+    metrics.PROMPT_LENGTH.observe(len(prompt), mode=mode)
+    started = time.perf_counter()
+    outcome = None
+    try:
+        response = llm_resilience.call(lambda: llm.invoke(prompt), deadline or llm_resilience.deadline_after(), llm_circuit)
+        outcome = "ok"
+        return response
+    except llm_resilience.CircuitOpen:
+        raise
+    except llm_resilience.BudgetExceeded:
+        outcome = "timeout"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        if outcome is not None:
+            metrics.LLM_LATENCY.observe(time.perf_counter() - started, mode=mode, outcome=outcome)
+
+async def ainvoke_llm(prompt: str, mode: str = "single", deadline: Optional[float] = None):
+    metrics.PROMPT_LENGTH.observe(len(prompt), mode=mode)
+    started = time.perf_counter()
+    outcome = None
+    try:
+        response = await llm_resilience.acall(lambda: llm.ainvoke(prompt), deadline or llm_resilience.deadline_after(), llm_circuit)
+        outcome = "ok"
+        return response
+    except llm_resilience.CircuitOpen:
+        raise
+    except llm_resilience.BudgetExceeded:
+        outcome = "timeout"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        if outcome is not None:
+            metrics.LLM_LATENCY.observe(time.perf_counter() - started, mode=mode, outcome=outcome)
+
+@metrics.timed(metrics.NODE_DURATION, node="evaluate")
+def evaluate(state: AgentState) -> AgentState:
+    state = _with_llm_deadline(state)
+    cache_key = verdict_cache_key(state)
     
     try:
-        response = llm.invoke(prompt)
-        content = response.content.strip()
-        print(f"DEBUG: LLM Response:\n{content}")
+        verdict = verdict_cache.get(cache_key)
+        source = "cache"
+        if verdict is None:
+            response = invoke_llm(_evaluation_prompt(state), deadline=state['llm_deadline'])
+            verdict = _record_llm_verdict(cache_key, response)
+            source = "llm"
         
-        # Clean up potential markdown code blocks
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.endswith("```"):
-            content = content[:-3]
+        return _count_decision(apply_decision(state, *verdict), source)
+    except llm_resilience.CircuitOpen:
+        return rules_fallback(state)
+    except Exception as e:
+        logger.error("LLM evaluation failed: %r", e, extra={"transaction_id": state['transaction'].get('id')})
+        return manual_review(state, e)
+
+@metrics.timed(metrics.NODE_DURATION, node="evaluate")
+async def aevaluate(state: AgentState) -> AgentState:
+    state = _with_llm_deadline(state)
+    cache_key = verdict_cache_key(state)
+    
+    try:
+        verdict = verdict_cache.get(cache_key)
+        source = "cache"
+        if verdict is None:
+            response = await ainvoke_llm(_evaluation_prompt(state), deadline=state['llm_deadline'])
+            verdict = _record_llm_verdict(cache_key, response)
+            source = "llm"
         
-        result = json.loads(content.strip())
+        return _count_decision(apply_decision(state, *verdict), source)
+    except llm_resilience.CircuitOpen:
+        return rules_fallback(state)
+    except Exception as e:
+        logger.error("LLM evaluation failed: %r", e, extra={"transaction_id": state['transaction'].get('id')})
+        return manual_review(state, e)
+
+def build_batch_evaluation_prompt(transactions: List[Dict[str, Any]], policies: List[str],
+                                  policy_hash: Optional[str] = None) -> str:
+    return prompts.renderer.batch(transactions, policies, policy_hash)
+
+def parse_batch_decisions(content: str) -> Dict[int, tuple]:
+    content = content.strip()
+
+    # Clean up potential markdown code blocks
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.endswith("```"):
+        content = content[:-3]
+
+    decisions = {}
+    for result in json.loads(content.strip()):
         decision = result.get("decision", "VIOLATION").upper()
         reason = result.get("reason", "No reason provided.")
+        decisions[int(result["item"])] = (decision, reason)
+    return decisions
+
+def _batch_policies(states: List[AgentState]) -> List[str]:
+    # A batch prompt carries the union of its items' selected policies
+    index = states[0].get('policy_index')
+    if index is None or any(state.get('policy_ids') is None for state in states):
+        return states[0]['policies']
+    return index.render_ids(set().union(*(state['policy_ids'] for state in states)))
+
+def _batch_item(state: AgentState) -> Dict[str, Any]:
+    summary = _velocity_summary(state)
+    return {**state['transaction'], "velocity": summary} if summary else state['transaction']
+
+def evaluate_batch(states: List[AgentState]) -> List[AgentState]:
+    """First-pass evaluation of several transactions with one LLM call per chunk.
+
+    Items the LLM does not answer for, or whose chunk fails, go to manual review
+    exactly like a failed single evaluation; while the LLM circuit is open they get
+    the rule-based fallback. Each chunk has its own latency budget.
+    """
+    results: List[Optional[AgentState]] = [None] * len(states)
+    pending = []
+    for i, state in enumerate(states):
+        cached = verdict_cache.get(verdict_cache_key(state))
+        if cached is not None:
+            results[i] = _count_decision(apply_decision(state, *cached), "cache")
+        else:
+            pending.append(i)
+
+    for start in range(0, len(pending), BATCH_EVAL_SIZE):
+        chunk = pending[start:start + BATCH_EVAL_SIZE]
+        prompt = build_batch_evaluation_prompt([_batch_item(states[i]) for i in chunk], _batch_policies([states[i] for i in chunk]))
         
-        # Logic for handling decisions
-        is_violation = False
-        
-        if decision == "VIOLATION":
-            is_violation = True
-        elif decision == "SUSPICIOUS":
-            if state['investigation_count'] >= 1:
-                # Loop limit reached, fail closed
-                decision = "VIOLATION"
-                is_violation = True
-                reason = f"Suspicious activity confirmed after investigation. {reason}"
+        try:
+            response = invoke_llm(prompt, mode="batch")
+            decisions = parse_batch_decisions(response.content)
+        except llm_resilience.CircuitOpen:
+            for i in chunk:
+                results[i] = rules_fallback(states[i])
+            continue
+        except Exception as e:
+            logger.error("Batch LLM evaluation failed: %r", e, extra={"batch_size": len(chunk)})
+            for i in chunk:
+                results[i] = manual_review(states[i], e, mode="batch")
+            continue
+
+        for position, i in enumerate(chunk):
+            if position not in decisions:
+                results[i] = manual_review(states[i], ValueError("No decision returned for transaction in batch"), mode="batch")
+                continue
+            decision, reason = decisions[position]
+            verdict_cache.set(verdict_cache_key(states[i]), (decision, reason))
+            results[i] = _count_decision(apply_decision(states[i], decision, reason), "llm")
+
+    return results
+
+def _count_prefetch(prefetch, history: Optional[str]) -> None:
+    if prefetch is not None:
+        metrics.HISTORY_PREFETCHES.inc(result="used" if history is not None else "fallback")
+
+@metrics.timed(metrics.NODE_DURATION, node="investigate")
+def investigate(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    user_id = state['transaction']['user_id']
+    logger.info("Investigating user %s", user_id, extra={"user_id": user_id})
+    metrics.INVESTIGATIONS.inc()
+    
+    # Usually already loaded in the background during the first evaluation
+    prefetch = history_prefetch(config)
+    history = prefetch.result() if prefetch is not None else None
+    _count_prefetch(prefetch, history)
+    if history is None:
+        with metrics.DB_DURATION.time(node="investigate"):
+            db = request_session(config)
+            if db is not None:
+                # Read inside the caller's transaction; it commits once at the end
+                history = get_user_spending_history(db, user_id)
             else:
-                # Keep as suspicious to trigger investigation
-                is_violation = False 
-        else:
-            # SAFE
-            is_violation = False
-
-        return {
-            **state,
-            "is_violation": is_violation,
-            "violation_reason": reason,
-            "decision": decision
-        }
-    except Exception as e:
-        print(f"CRITICAL ERROR in LLM evaluation: {e}")
-        # Fail-Open but Flag: Allow transaction but mark for manual review
-        return {
-            **state,
-            "is_violation": False,
-            "violation_reason": f"MANUAL REVIEW REQUIRED: System Error ({str(e)})",
-            "decision": "MANUAL_REVIEW"
-        }
+                db = database.SessionLocal()
+                try:
+                    history = get_user_spending_history(db, user_id)
+                finally:
+                    db.close()
+    
+    return {
+        **state,
+        "spending_history": history,
+        "investigation_count": state['investigation_count'] + 1
+    }
 
-def investigate(state: AgentState) -> AgentState:
+@metrics.timed(metrics.NODE_DURATION, node="investigate")
+async def ainvestigate(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
     user_id = state['transaction']['user_id']
-    print(f"🕵️ Investigating User {user_id}...")
+    logger.info("Investigating user %s", user_id, extra={"user_id": user_id})
+    metrics.INVESTIGATIONS.inc()
     
-    db = database.SessionLocal()
-    try:
-        history = get_user_spending_history(db, user_id)
-    finally:
-        db.close()
+    prefetch = history_prefetch(config)
+    history = await prefetch.result() if prefetch is not None else None
+    _count_prefetch(prefetch, history)
+    if history is None:
+        with metrics.DB_DURATION.time(node="investigate"):
+            db = request_session(config)
+            if db is not None:
+                history = await db.run_sync(get_user_spending_history, user_id)
+            else:
+                async with database.AsyncSessionLocal() as db:
+                    history = await db.run_sync(get_user_spending_history, user_id)
     
     return {
         **state,
@@ -170,46 +607,98 @@ def investigate(state: AgentState) -> AgentState:
         "investigation_count": state['investigation_count'] + 1
     }
 
-def enforce(state: AgentState) -> AgentState:
+def freeze_card(db: Session, user_id: int) -> None:
+    # Within a unit of work the user was loaded by the caller: identity map hit, no SELECT
+    user = db.get(models.User, user_id)
+    if user:
+        user.card_status = models.CardStatus.FROZEN
+
+def apply_enforcement(db: Session, state: AgentState) -> None:
+    user_id = state['transaction']['user_id']
+    reason = state['violation_reason']
+    decision = state.get('decision')
+    
+    try:
+        # Only Freeze if it is a rigid VIOLATION
+        if decision == "VIOLATION":
+            user = db.query(models.User).filter(models.User.id == user_id).first()
+            if user:
+                user.card_status = models.CardStatus.FROZEN
+                db.add(user)
+        
+        # Update Transaction with Reason (for both Violation and Manual Review)
+        trans_id = state['transaction'].get('id')
+        if trans_id:
+            trans = db.query(models.Transaction).filter(models.Transaction.id == trans_id).first()
+            if trans:
+                trans.violation_reason = reason
+                # Manual review is NOT a violation yet, just a flag
+                aggregates.set_violation(db, trans, decision == "VIOLATION")
+                db.add(trans)
+        
+        db.commit()
+    except SQLAlchemyError as e:
+        logger.error("Database error enforcing policy: %r", e, extra={"user_id": user_id})
+        db.rollback()
+    except Exception as e:
+        logger.exception("Unexpected error enforcing policy", extra={"user_id": user_id})
+        db.rollback()
+
+def _log_enforcement(state: AgentState) -> None:
     user_id = state['transaction']['user_id']
     reason = state['violation_reason']
     decision = state.get('decision')
     
     if decision == "VIOLATION":
-        print(f"Enforcing penalty on user {user_id}: Freezing card. Reason: {reason}")
+        logger.warning("Enforcing penalty on user %s: Freezing card.", user_id, extra={"user_id": user_id, "reason": reason})
     elif decision == "MANUAL_REVIEW":
-        print(f"Flagging transaction for user {user_id} for MANUAL REVIEW. Reason: {reason}")
+        logger.warning("Flagging transaction for user %s for MANUAL REVIEW.", user_id, extra={"user_id": user_id, "reason": reason})
+
+@metrics.timed(metrics.NODE_DURATION, node="enforce")
+def enforce(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    if is_dry_run(config):
+        return state
+    _log_enforcement(state)
+    decision = state.get('decision')
+    
+    db = request_session(config)
+    if db is not None:
+        # Part of the caller's unit of work: the caller records the decision on the
+        # transaction and flushes it together with the freeze in a single commit
+        if decision == "VIOLATION":
+            with metrics.DB_DURATION.time(node="enforce"):
+                freeze_card(db, state['transaction']['user_id'])
+        return state
     
     # DB Operations for Violation OR Manual Review
     if decision in ["VIOLATION", "MANUAL_REVIEW"]:
-        db = database.SessionLocal()
-        try:
-            # Only Freeze if it is a rigid VIOLATION
-            if decision == "VIOLATION":
-                user = db.query(models.User).filter(models.User.id == user_id).first()
-                if user:
-                    user.card_status = models.CardStatus.FROZEN
-                    db.add(user)
-            
-            # Update Transaction with Reason (for both Violation and Manual Review)
-            trans_id = state['transaction'].get('id')
-            if trans_id:
-                trans = db.query(models.Transaction).filter(models.Transaction.id == trans_id).first()
-                if trans:
-                    trans.violation_reason = reason
-                    # Manual review is NOT a violation yet, just a flag
-                    trans.is_violation = (decision == "VIOLATION") 
-                    db.add(trans)
+        with metrics.DB_DURATION.time(node="enforce"):
+            db = database.SessionLocal()
+            try:
+                apply_enforcement(db, state)
+            finally:
+                db.close()
             
-            db.commit()
-        except SQLAlchemyError as e:
-            print(f"CRITICAL DATABASE ERROR enforcing policy: {e}")
-            db.rollback()
-        except Exception as e:
-            print(f"Unexpected error enforcing policy: {e}")
-            db.rollback()
-        finally:
-            db.close()
+    return state
+
+@metrics.timed(metrics.NODE_DURATION, node="enforce")
+async def aenforce(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    if is_dry_run(config):
+        return state
+    _log_enforcement(state)
+    decision = state.get('decision')
+    
+    db = request_session(config)
+    if db is not None:
+        if decision == "VIOLATION":
+            with metrics.DB_DURATION.time(node="enforce"):
+                await db.run_sync(freeze_card, state['transaction']['user_id'])
+        return state
+    
+    if decision in ["VIOLATION", "MANUAL_REVIEW"]:
+        with metrics.DB_DURATION.time(node="enforce"):
+            async with database.AsyncSessionLocal() as db:
+                await db.run_sync(apply_enforcement, state)
             
     return state
 
@@ -223,49 +712,154 @@ def decide_next_step(state: AgentState):
     else:
         return END
 
+def decide_after_precheck(state: AgentState):
+    if state.get("decision") is None:
+        return "score"
+    return decide_next_step(state)
+
+def decide_after_score(state: AgentState):
+    if state.get("decision") is None:
+        return "evaluate"
+    return decide_next_step(state)
+
+async def amonitor(state: AgentState) -> AgentState:
+    return monitor(state)
+
+async def aprecheck(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
+    return precheck(state, config)
+
 # Build the graph
-workflow = StateGraph(AgentState)
-
-workflow.add_node("monitor", monitor)
-workflow.add_node("evaluate", evaluate)
-workflow.add_node("investigate", investigate)
-workflow.add_node("enforce", enforce)
-
-workflow.set_entry_point("monitor")
-workflow.add_edge("monitor", "evaluate")
-
-workflow.add_conditional_edges(
-    "evaluate",
-    decide_next_step,
-    {
-        "enforce": "enforce",
-        "investigate": "investigate",
-        END: END
-    }
-)
+def build_graph(entry_point: str = "monitor", use_async: bool = False):
+    workflow = StateGraph(AgentState)
 
-workflow.add_edge("investigate", "evaluate") # Loop back
-workflow.add_edge("enforce", END)
+    # Async nodes await the LLM and the database; CPU-only nodes get thin coroutine
+    # wrappers so they run inline on the event loop instead of in an executor
+    workflow.add_node("monitor", amonitor if use_async else monitor)
+    workflow.add_node("precheck", aprecheck if use_async else precheck)
+    workflow.add_node("score", ascore if use_async else score)
+    workflow.add_node("evaluate", aevaluate if use_async else evaluate)
+    workflow.add_node("investigate", ainvestigate if use_async else investigate)
+    workflow.add_node("enforce", aenforce if use_async else enforce)
 
-app = workflow.compile()
+    workflow.set_entry_point(entry_point)
+    workflow.add_edge("monitor", "precheck")
 
-def run_transaction_check(transaction_dict: Dict[str, Any]):
-    # Fetch policies first to pass into state
-    db = database.SessionLocal()
-    try:
-        policies = fetch_policies(db)
-    finally:
-        db.close()
+    workflow.add_conditional_edges(
+        "precheck",
+        decide_after_precheck,
+        {
+            "score": "score",
+            "enforce": "enforce",
+            END: END
+        }
+    )
+
+    workflow.add_conditional_edges(
+        "score",
+        decide_after_score,
+        {
+            "evaluate": "evaluate",
+            "enforce": "enforce",
+            END: END
+        }
+    )
+
+    workflow.add_conditional_edges(
+        "evaluate",
+        decide_next_step,
+        {
+            "enforce": "enforce",
+            "investigate": "investigate",
+            END: END
+        }
+    )
+
+    workflow.add_edge("investigate", "evaluate") # Loop back
+    workflow.add_edge("enforce", END)
+
+    return workflow.compile()
 
-    initial_state = AgentState(
+app = build_graph()
+# Resumes a transaction that a batch evaluation flagged as SUSPICIOUS
+investigation_app = build_graph(entry_point="investigate")
+async_app = build_graph(use_async=True)
+
+def initial_state(transaction_dict: Dict[str, Any], snapshot: PolicySnapshot,
+                  features: Optional[velocity.Velocity] = None) -> AgentState:
+    return AgentState(
         transaction=transaction_dict,
-        policies=policies,
+        policies=snapshot.policies,
         violation_reason=None,
         is_violation=False,
         investigation_count=0,
         spending_history=None,
-        decision=None
+        decision=None,
+        rules=snapshot.rules,
+        policy_hash=snapshot.policy_hash,
+        policy_index=snapshot.index,
+        policy_ids=None,
+        velocity=features,
+        llm_deadline=None
     )
+
+def unit_of_work(db, prefetch=None) -> Optional[RunnableConfig]:
+    # Nodes reuse the caller's session instead of opening and committing their own
+    configurable = {}
+    if db is not None:
+        configurable["db"] = db
+    if prefetch is not None:
+        configurable["history_prefetch"] = prefetch
+    return {"configurable": configurable} if configurable else None
+
+def run_transaction_check(transaction_dict: Dict[str, Any], db: Optional[Session] = None):
+    # Policies come from the in-process snapshot; the database is only hit when it is stale
+    snapshot = snapshot_cache.get(db)
     
-    result = app.invoke(initial_state)
+    prefetch = HistoryPrefetch() if HISTORY_PREFETCH else None
+    try:
+        result = app.invoke(initial_state(transaction_dict, snapshot, velocity.observe(transaction_dict)), config=unit_of_work(db, prefetch))
+    finally:
+        # Not needed (SAFE / VIOLATION without investigation) or already consumed
+        if prefetch is not None:
+            prefetch.cancel()
+    return result
+
+async def arun_transaction_check(transaction_dict: Dict[str, Any], db=None):
+    snapshot = await snapshot_cache.aget(db)
+    
+    prefetch = AsyncHistoryPrefetch() if HISTORY_PREFETCH else None
+    try:
+        result = await async_app.ainvoke(initial_state(transaction_dict, snapshot, velocity.observe(transaction_dict)), config=unit_of_work(db, prefetch))
+    finally:
+        if prefetch is not None:
+            prefetch.cancel()
     return result
+
+def run_batch_check(transaction_dicts: List[Dict[str, Any]], db: Optional[Session] = None) -> List[AgentState]:
+    # Policies are loaded once for the whole batch
+    snapshot = snapshot_cache.get(db)
+
+    # Histories of undecided items load in the background during the batch LLM call
+    configs = [unit_of_work(db, HistoryPrefetch() if HISTORY_PREFETCH else None) for _ in transaction_dicts]
+    try:
+        states = [precheck(monitor(initial_state(t, snapshot, velocity.observe(t))), config) for t, config in zip(transaction_dicts, configs)]
+        states = [score(state, config) if state['decision'] is None else state for state, config in zip(states, configs)]
+        undecided = [i for i, state in enumerate(states) if state['decision'] is None]
+        for i, state in zip(undecided, evaluate_batch([states[i] for i in undecided])):
+            states[i] = state
+
+        results = []
+        for state, config in zip(states, configs):
+            next_step = decide_next_step(state)
+            if next_step == "enforce":
+                state = enforce(state, config)
+            elif next_step == "investigate":
+                # Suspicious items are investigated one by one through the regular graph
+                state = investigation_app.invoke(state, config=config)
+            results.append(state)
+    finally:
+        for config in configs:
+            prefetch = history_prefetch(config)
+            if prefetch is not None:
+                prefetch.cancel()
+    return results
@@ -0,0 +1,125 @@
+import sys
+import math
+import random
+import argparse
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import backtest, risk_model
+from .database import SessionLocal
+
+# Offline training of the local risk model from labelled transaction history. Rows stream
+# oldest first through the same time-correct replay as the backtest, so each example only
+# sees the user's profile and velocity from before it. Stored decisions are the labels:
+# violations are positive, approved transactions negative; manual reviews and attempts on
+# frozen cards carry no verdict and are skipped. The newest --holdout share is kept out of
+# training and used to report how the thresholds would split traffic into tiers.
+#
+#   python -m corpcard_sentinel.train_risk_model --output risk_model.json
+#   RISK_MODEL=risk_model.json RISK_LOW_THRESHOLD=0.02 RISK_HIGH_THRESHOLD=0.98 uvicorn ...
+
+LABELS = {"SAFE": 0, "VIOLATION": 1}
+# Keeps AdaGrad steps finite while a feature's accumulated gradient is still zero
+EPSILON = 1e-8
+
+Example = Tuple[Dict[str, float], int]
+
+
+def load_examples(db: Session, since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None,
+                  limit: Optional[int] = None) -> List[Example]:
+    examples = []
+    for task in backtest.iter_tasks(db, since=since, until=until):
+        label = LABELS.get(task["baseline"])
+        if label is None:
+            continue
+        examples.append((risk_model.features(task["transaction"], task["profile"], task["velocity"]), label))
+        if limit is not None and len(examples) >= limit:
+            break
+    return examples
+
+
+def train(examples: List[Example], epochs: int = 10, learning_rate: float = 0.1, l2: float = 1e-4,
+          seed: int = 0) -> risk_model.RiskModel:
+    """L2-regularized logistic regression fitted with AdaGrad over sparse features."""
+    weights: Dict[str, float] = {}
+    squared: Dict[str, float] = {}
+    bias, bias_squared = 0.0, 0.0
+    order = list(range(len(examples)))
+    rng = random.Random(seed)
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for i in order:
+            values, label = examples[i]
+            z = bias + sum(weights.get(name, 0.0) * value for name, value in values.items())
+            error = risk_model.sigmoid(z) - label
+            bias_squared += error * error
+            bias -= learning_rate * error / (math.sqrt(bias_squared) + EPSILON)
+            for name, value in values.items():
+                gradient = error * value + l2 * weights.get(name, 0.0)
+                squared[name] = squared.get(name, 0.0) + gradient * gradient
+                weights[name] = weights.get(name, 0.0) - learning_rate * gradient / (math.sqrt(squared[name]) + EPSILON)
+    return risk_model.RiskModel(bias, {name: round(w, 6) for name, w in sorted(weights.items())})
+
+
+def tier_report(model: risk_model.RiskModel, examples: List[Example], low: float, high: float) -> Dict[str, Any]:
+    """How the thresholds split `examples`: share of traffic per tier and the violations in each."""
+    tiers = {t: {"count": 0, "violations": 0} for t in risk_model.TIERS}
+    for values, label in examples:
+        entry = tiers[risk_model.tier(model.score_features(values), low, high)]
+        entry["count"] += 1
+        entry["violations"] += label
+    total = len(examples)
+    for entry in tiers.values():
+        entry["rate"] = entry["count"] / total if total else 0.0
+        entry["violation_rate"] = entry["violations"] / entry["count"] if entry["count"] else 0.0
+    return {"examples": total, "low_threshold": low, "high_threshold": high, "tiers": tiers}
+
+
+def format_tier_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"Holdout: {report['examples']} transactions, thresholds low < {report['low_threshold']} <= uncertain < {report['high_threshold']} <= high",
+        f"{'tier':<12}{'count':>10}{'rate':>10}{'violations':>12}{'viol. rate':>12}",
+    ]
+    for name, entry in report["tiers"].items():
+        lines.append(f"{name:<12}{entry['count']:>10}{entry['rate']:>10.2%}{entry['violations']:>12}{entry['violation_rate']:>12.2%}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local risk model from labelled transaction history.")
+    parser.add_argument("--output", default="risk_model.json")
+    parser.add_argument("--since", type=backtest._parse_datetime)
+    parser.add_argument("--until", type=backtest._parse_datetime)
+    parser.add_argument("--limit", type=int, help="Use at most this many labelled transactions")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Newest share of examples kept for the tier report")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--learning-rate", type=float, default=0.1)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--low", type=float, default=risk_model.RISK_LOW_THRESHOLD)
+    parser.add_argument("--high", type=float, default=risk_model.RISK_HIGH_THRESHOLD)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        examples = load_examples(db, args.since, args.until, args.limit)
+    finally:
+        db.close()
+    if not examples:
+        parser.error("No labelled transactions to train on")
+
+    split = int(len(examples) * (1 - args.holdout))
+    training, holdout = examples[:split], examples[split:]
+    model = train(training, args.epochs, args.learning_rate, args.l2, args.seed)
+    report = tier_report(model, holdout, args.low, args.high)
+    model.metadata = {
+        "trained_at": datetime.datetime.utcnow().isoformat(),
+        "training_examples": len(training),
+        "holdout": report,
+    }
+    model.save(args.output)
+
+    print(format_tier_report(report))
+    print(f"Wrote {args.output}", file=sys.stderr)
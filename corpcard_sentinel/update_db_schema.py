@@ -1,14 +1,9 @@
-from sqlalchemy import create_engine, text
-from corpcard_sentinel.database import SQLALCHEMY_DATABASE_URL
+from corpcard_sentinel import migrations
 
-def add_violation_reason_column():
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
-    with engine.connect() as connection:
-        try:
-            connection.execute(text("ALTER TABLE transactions ADD COLUMN violation_reason TEXT;"))
-            print("Successfully added 'violation_reason' column to 'transactions' table.")
-        except Exception as e:
-            print(f"Error adding column (it might already exist): {e}")
+# Kept for existing deployment scripts: schema changes now live in `migrations`.
+# Equivalent to `python -m corpcard_sentinel.migrations upgrade`.
 
 if __name__ == "__main__":
-    add_violation_reason_column()
+    applied = migrations.upgrade()
+    if not applied:
+        print("Database schema is up to date.")
@@ -0,0 +1,115 @@
+import os
+import time
+import asyncio
+import threading
+import contextlib
+from typing import Iterable, Iterator, AsyncIterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, metrics
+
+# Per-cardholder serialization. Decisions for the same user run one at a time, from the
+# FROZEN check to the commit, so a second transaction cannot slip past a freeze that is
+# still being written; different users run in parallel. Locks are sharded by user id
+# (a fixed pool, no per-user allocation); several users are always locked in shard
+# order, so batches cannot deadlock against each other.
+#
+# USER_LOCKS=process  in-process locks (default; enough for a single worker process)
+# USER_LOCKS=db       additionally lock the users' rows with SELECT ... FOR UPDATE for
+#                     multi-worker deployments (held until the request commits)
+# USER_LOCKS=off      no locking
+
+USER_LOCKS = os.getenv("USER_LOCKS", "process").lower()
+USER_LOCK_SHARDS = int(os.getenv("USER_LOCK_SHARDS", "1024"))
+# Upper bound on waiting for another decision of the same user
+USER_LOCK_TIMEOUT = float(os.getenv("USER_LOCK_TIMEOUT", "60"))
+
+LOCK_WAIT = metrics.histogram("sentinel_user_lock_wait_seconds", "Time spent waiting for per-user decision locks.", ["mode"])
+
+
+class LockTimeout(TimeoutError):
+    """Another decision for the same user held the lock for longer than the timeout."""
+
+
+class ShardedLocks:
+    def __init__(self, shards: int = USER_LOCK_SHARDS, timeout: float = USER_LOCK_TIMEOUT):
+        self.timeout = timeout
+        self._locks = [threading.Lock() for _ in range(shards)]
+        # asyncio locks are created on first use, inside the running event loop
+        self._async_locks: Optional[List[asyncio.Lock]] = None
+
+    def shards(self, user_ids: Iterable[int]) -> List[int]:
+        """Shard indexes for `user_ids`, deduplicated and in acquisition order."""
+        return sorted({hash(user_id) % len(self._locks) for user_id in user_ids})
+
+    @contextlib.contextmanager
+    def hold(self, user_ids: Iterable[int]) -> Iterator[None]:
+        acquired = []
+        started = time.perf_counter()
+        try:
+            for shard in self.shards(user_ids):
+                if not self._locks[shard].acquire(timeout=self.timeout):
+                    raise LockTimeout(f"Timed out waiting for the user lock after {self.timeout}s")
+                acquired.append(self._locks[shard])
+            LOCK_WAIT.observe(time.perf_counter() - started, mode="process")
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    @contextlib.asynccontextmanager
+    async def ahold(self, user_ids: Iterable[int]) -> AsyncIterator[None]:
+        if self._async_locks is None:
+            self._async_locks = [asyncio.Lock() for _ in range(len(self._locks))]
+        acquired = []
+        started = time.perf_counter()
+        try:
+            for shard in self.shards(user_ids):
+                lock = self._async_locks[shard]
+                try:
+                    await asyncio.wait_for(lock.acquire(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise LockTimeout(f"Timed out waiting for the user lock after {self.timeout}s")
+                acquired.append(lock)
+            LOCK_WAIT.observe(time.perf_counter() - started, mode="process")
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+
+locks = ShardedLocks()
+
+
+@contextlib.contextmanager
+def hold(user_ids: Iterable[int]) -> Iterator[None]:
+    """Serialize with other decisions for the same users in this process."""
+    if USER_LOCKS == "off":
+        yield
+        return
+    with locks.hold(user_ids):
+        yield
+
+
+@contextlib.asynccontextmanager
+async def ahold(user_ids: Iterable[int]) -> AsyncIterator[None]:
+    if USER_LOCKS == "off":
+        yield
+        return
+    async with locks.ahold(user_ids):
+        yield
+
+
+def lock_rows(db: Session, user_ids: Iterable[int]) -> List[models.User]:
+    """Load the users, row-locked until the caller commits when USER_LOCKS=db.
+
+    Rows are locked in id order, the same order every caller uses.
+    """
+    query = db.query(models.User).filter(models.User.id.in_(sorted(set(user_ids)))).order_by(models.User.id)
+    if USER_LOCKS != "db":
+        return query.all()
+    started = time.perf_counter()
+    users = query.with_for_update().all()
+    LOCK_WAIT.observe(time.perf_counter() - started, mode="db")
+    return users
@@ -0,0 +1,189 @@
+import os
+import math
+import time
+import datetime
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from . import metrics
+
+# Sliding-window transaction counters for burst detection (card testing, split purchases).
+# Every user, and every user x merchant pair, has a ring of fixed-width time buckets
+# holding a count and an amount. Recording a transaction touches one bucket; reading the
+# last N minutes walks at most the ring, whose size is fixed by configuration, so both
+# are O(1) per transaction regardless of how much history a user has. Counters are kept
+# in process memory and bounded by an LRU over keys: the least recently active
+# users/merchants are evicted first. Each process counts the traffic it has seen.
+
+VELOCITY = os.getenv("VELOCITY", "true").lower() in ("1", "true", "yes")
+VELOCITY_BUCKET_SECONDS = int(os.getenv("VELOCITY_BUCKET_SECONDS", "60"))
+# Longest window a policy or the prompt can ask about
+VELOCITY_WINDOW_MINUTES = int(os.getenv("VELOCITY_WINDOW_MINUTES", "60"))
+# Memory budget: a key costs roughly 24 bytes per bucket plus ~300 bytes of overhead
+# (about 1.7 KB at the default 60 buckets, so ~35 MB for 20000 keys)
+VELOCITY_MAX_KEYS = int(os.getenv("VELOCITY_MAX_KEYS", "20000"))
+# Windows summarized in the evaluation prompt
+PROMPT_WINDOWS_MINUTES = (5, 60)
+
+
+class _Ring:
+    """Count and amount per time bucket; a slot is reused once its bucket has left the window."""
+
+    __slots__ = ("epochs", "counts", "amounts")
+
+    def __init__(self, size: int):
+        self.epochs = array("q", [-1]) * size
+        self.counts = array("l", [0]) * size
+        self.amounts = array("d", [0.0]) * size
+
+    def add(self, epoch: int, amount: float) -> None:
+        slot = epoch % len(self.epochs)
+        if self.epochs[slot] != epoch:
+            if self.epochs[slot] > epoch:
+                # Older than everything the ring still covers
+                return
+            self.epochs[slot] = epoch
+            self.counts[slot] = 0
+            self.amounts[slot] = 0.0
+        self.counts[slot] += 1
+        self.amounts[slot] += amount
+
+    def cumulative(self, epoch: int) -> Tuple[List[int], List[float]]:
+        """Totals over the last 1..size buckets ending at `epoch`."""
+        size = len(self.epochs)
+        counts, amounts = [0] * size, [0.0] * size
+        count, amount = 0, 0.0
+        for age in range(size):
+            slot = (epoch - age) % size
+            if self.epochs[slot] == epoch - age:
+                count += self.counts[slot]
+                amount += self.amounts[slot]
+            counts[age] = count
+            amounts[age] = amount
+        return counts, amounts
+
+
+class Velocity:
+    """Velocity features of one transaction, including the transaction itself."""
+
+    __slots__ = ("bucket_seconds", "user_counts", "user_amounts", "merchant_counts")
+
+    def __init__(self, bucket_seconds: int, user_counts: List[int], user_amounts: List[float], merchant_counts: List[int]):
+        self.bucket_seconds = bucket_seconds
+        self.user_counts = user_counts
+        self.user_amounts = user_amounts
+        self.merchant_counts = merchant_counts
+
+    def _age(self, minutes: float) -> int:
+        # The current, partly elapsed bucket counts as one
+        buckets = math.ceil(minutes * 60 / self.bucket_seconds)
+        return min(max(buckets, 1), len(self.user_counts)) - 1
+
+    def count(self, minutes: float, per_merchant: bool = False) -> int:
+        counts = self.merchant_counts if per_merchant else self.user_counts
+        return counts[self._age(minutes)]
+
+    def amount(self, minutes: float) -> float:
+        return self.user_amounts[self._age(minutes)]
+
+    def summary(self) -> str:
+        parts = [
+            f"{self.count(m)} transactions (${self.amount(m):.2f}) in the last {m} min, "
+            f"{self.count(m, per_merchant=True)} at this merchant"
+            for m in PROMPT_WINDOWS_MINUTES
+        ]
+        return "; ".join(parts) + "."
+
+    def cache_key(self) -> tuple:
+        # Coarse burst level, so repeat transactions still share verdicts outside bursts
+        return tuple(_level(self.count(m, per_merchant)) for m in PROMPT_WINDOWS_MINUTES for per_merchant in (False, True))
+
+
+def _level(count: int) -> int:
+    return count.bit_length() - 1 if count > 1 else 0
+
+
+def _epoch_seconds(at: Any) -> Optional[float]:
+    if isinstance(at, (int, float)):
+        return float(at)
+    if isinstance(at, datetime.datetime):
+        # Naive timestamps are UTC, as stored by the API
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=datetime.timezone.utc)
+        return at.timestamp()
+    return None
+
+
+class VelocityStore:
+    """Thread-safe, memory-bounded sliding-window counters per user and per user x merchant."""
+
+    def __init__(self, bucket_seconds: int = VELOCITY_BUCKET_SECONDS, window_minutes: int = VELOCITY_WINDOW_MINUTES,
+                 max_keys: int = VELOCITY_MAX_KEYS):
+        self.bucket_seconds = bucket_seconds
+        self.size = max(1, math.ceil(window_minutes * 60 / bucket_seconds))
+        self.max_keys = max_keys
+        self._rings: "OrderedDict[Hashable, _Ring]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _ring(self, key: Hashable) -> _Ring:
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = _Ring(self.size)
+            while len(self._rings) > self.max_keys:
+                self._rings.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._rings.move_to_end(key)
+        return ring
+
+    def observe(self, user_id: Any, merchant: Optional[str], amount: float, at: Any = None) -> Velocity:
+        """Record a transaction and return the velocity as of that transaction.
+
+        `at` (epoch seconds or datetime) defaults to now; replays pass the stored timestamp.
+        """
+        seconds = _epoch_seconds(at)
+        epoch = int((time.time() if seconds is None else seconds) // self.bucket_seconds)
+        merchant_key = (user_id, str(merchant or "").strip().lower())
+        with self._lock:
+            user_ring = self._ring(("user", user_id))
+            merchant_ring = self._ring(("merchant",) + merchant_key)
+            user_ring.add(epoch, float(amount or 0))
+            merchant_ring.add(epoch, float(amount or 0))
+            user_counts, user_amounts = user_ring.cumulative(epoch)
+            merchant_counts, _ = merchant_ring.cumulative(epoch)
+        return Velocity(self.bucket_seconds, user_counts, user_amounts, merchant_counts)
+
+    def observe_transaction(self, transaction: Dict[str, Any], at: Any = None) -> Velocity:
+        return self.observe(transaction.get("user_id"), transaction.get("merchant"), transaction.get("amount"), at)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rings.clear()
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": len(self._rings),
+                "max_keys": self.max_keys,
+                "buckets": self.size,
+                "bucket_seconds": self.bucket_seconds,
+                "evictions": self.evictions,
+            }
+
+
+store = VelocityStore()
+metrics.gauge("sentinel_velocity_keys", "User and user x merchant keys with velocity counters.", lambda: len(store))
+metrics.gauge("sentinel_velocity_evictions", "Velocity counter keys evicted to stay within VELOCITY_MAX_KEYS.", lambda: store.evictions)
+
+
+def observe(transaction: Dict[str, Any]) -> Optional[Velocity]:
+    """Live traffic: count the transaction now. None when velocity tracking is off."""
+    if not VELOCITY:
+        return None
+    return store.observe_transaction(transaction)
@@ -40,3 +40,35 @@ def sample_policy(db_session):
     db_session.commit()
     db_session.refresh(policy)
     return policy
+
+@pytest.fixture(autouse=True)
+def clear_policy_caches():
+    # Verdicts, policy snapshots, velocity counters and the LLM circuit from one test must not leak into the next
+    from corpcard_sentinel import sentinel_agent, velocity, llm_resilience
+    sentinel_agent.verdict_cache.clear()
+    sentinel_agent.snapshot_cache.invalidate()
+    velocity.store.clear()
+    llm_resilience.breaker.reset()
+    yield
+
+@pytest.fixture
+def api_db(mocker):
+    """Point the API and the agent at a shared in-memory SQLite database."""
+    from sqlalchemy.pool import StaticPool
+    from corpcard_sentinel import database
+
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+    mocker.patch.object(database, "engine", engine)
+    mocker.patch.object(database, "SessionLocal", SessionLocal)
+    try:
+        yield SessionLocal
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def client(api_db):
+    from fastapi.testclient import TestClient
+    from corpcard_sentinel.main import app
+    return TestClient(app)
@@ -0,0 +1,111 @@
+import datetime
+from corpcard_sentinel import aggregates
+from corpcard_sentinel.models import Transaction, UserSpendingAggregate
+
+def add_transaction(db, user, amount, category, merchant="Shop", day=1, is_violation=False):
+    tx = Transaction(
+        user_id=user.id,
+        merchant=merchant,
+        amount=amount,
+        category=category,
+        timestamp=datetime.datetime(2024, 1, day, 12, 0),
+        is_violation=is_violation
+    )
+    db.add(tx)
+    db.flush()
+    return tx
+
+def test_no_history(db_session, sample_user):
+    aggregate = aggregates.get_aggregate(db_session, sample_user.id)
+    assert aggregates.summarize(aggregate) == "No previous approved spending history."
+
+def test_backfill_matches_history_scan(db_session, sample_user):
+    add_transaction(db_session, sample_user, 10.0, "Food", "Cafe", day=1)
+    add_transaction(db_session, sample_user, 20.0, "Food", "Deli", day=2)
+    add_transaction(db_session, sample_user, 30.0, "Travel", "Uber", day=3)
+    add_transaction(db_session, sample_user, 999.0, "Gambling", "Casino", day=4, is_violation=True)
+
+    summary = aggregates.summarize(aggregates.get_aggregate(db_session, sample_user.id))
+
+    assert summary == (
+        "User has 3 approved transactions totaling $60.00. "
+        "Average spend: $20.00. "
+        "Top categories: Food (2), Travel (1). "
+        "Recent activity: 2024-01-03: $30.0 at Uber (Travel); 2024-01-02: $20.0 at Deli (Food); 2024-01-01: $10.0 at Cafe (Food)."
+    )
+
+def test_record_transaction_is_incremental(db_session, sample_user):
+    add_transaction(db_session, sample_user, 10.0, "Food", day=1)
+    aggregates.build_aggregate(db_session, sample_user.id)
+    db_session.commit()
+
+    tx = add_transaction(db_session, sample_user, 50.0, "Travel", "Hotel", day=5)
+    aggregates.record_transaction(db_session, tx)
+    db_session.commit()
+
+    aggregate = db_session.get(UserSpendingAggregate, sample_user.id)
+    assert aggregate.transaction_count == 2
+    assert aggregate.total_amount == 60.0
+    assert aggregate.category_counts == {"Food": 1, "Travel": 1}
+    assert aggregate.recent_transactions[0]["id"] == tx.id
+
+def test_reading_does_not_persist_backfill(db_session, sample_user):
+    add_transaction(db_session, sample_user, 10.0, "Food", day=1)
+
+    assert aggregates.get_aggregate(db_session, sample_user.id).transaction_count == 1
+    assert db_session.get(UserSpendingAggregate, sample_user.id) is None
+
+def test_first_record_backfills_without_double_counting(db_session, sample_user):
+    add_transaction(db_session, sample_user, 10.0, "Food", day=1)
+    tx = add_transaction(db_session, sample_user, 50.0, "Travel", day=2)
+
+    aggregates.record_transaction(db_session, tx)
+
+    aggregate = db_session.get(UserSpendingAggregate, sample_user.id)
+    assert aggregate.transaction_count == 2
+
+def test_set_violation_removes_and_refills_recent(db_session, sample_user, monkeypatch):
+    monkeypatch.setattr(aggregates, "RECENT_TRANSACTIONS_LIMIT", 2)
+    add_transaction(db_session, sample_user, 10.0, "Food", day=1)
+    add_transaction(db_session, sample_user, 20.0, "Food", day=2)
+    tx = add_transaction(db_session, sample_user, 30.0, "Travel", day=3)
+    aggregates.build_aggregate(db_session, sample_user.id)
+    db_session.commit()
+
+    aggregates.set_violation(db_session, tx, True)
+    db_session.commit()
+
+    aggregate = db_session.get(UserSpendingAggregate, sample_user.id)
+    assert tx.is_violation is True
+    assert aggregate.transaction_count == 2
+    assert aggregate.total_amount == 30.0
+    assert aggregate.category_counts == {"Food": 2}
+    assert [e["amount"] for e in aggregate.recent_transactions] == [20.0, 10.0]
+
+def test_set_violation_unchanged_flag_is_noop(db_session, sample_user):
+    tx = add_transaction(db_session, sample_user, 10.0, "Food", day=1)
+    aggregates.build_aggregate(db_session, sample_user.id)
+
+    aggregates.set_violation(db_session, tx, False)
+
+    assert db_session.get(UserSpendingAggregate, sample_user.id).transaction_count == 1
+
+def test_record_transaction_after_losing_backfill_race(db_session, sample_user, mocker):
+    add_transaction(db_session, sample_user, 10.0, "Food", day=1)
+    aggregates.build_aggregate(db_session, sample_user.id)
+    db_session.commit()
+
+    # A concurrent request committed the aggregate after this one looked for it
+    user_id = sample_user.id
+    db_session.expunge(db_session.get(UserSpendingAggregate, user_id))
+    real_get = db_session.get
+    lookups = [None]
+    mocker.patch.object(db_session, "get", side_effect=lambda *args, **kwargs: lookups.pop() if lookups else real_get(*args, **kwargs))
+
+    tx = add_transaction(db_session, sample_user, 50.0, "Travel", day=2)
+    aggregates.record_transaction(db_session, tx)
+    db_session.commit()
+
+    aggregate = real_get(UserSpendingAggregate, user_id)
+    assert aggregate.transaction_count == 2
+    assert aggregate.total_amount == 60.0
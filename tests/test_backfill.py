@@ -0,0 +1,82 @@
+import io
+import json
+from corpcard_sentinel import aggregates, backfill
+from corpcard_sentinel.models import Transaction, User, UserSpendingAggregate, CardStatus
+
+CSV = """user_id,merchant,amount,category,timestamp,is_violation
+1,Cafe,10.5,Food,2024-01-01T08:00:00,false
+1,Airline,400,Travel,2024-01-02T09:00:00,
+2,Casino,900,Gambling,2024-01-03T22:00:00,true
+1,Cafe,4.5,Food,2024-01-04T08:00:00,false
+"""
+
+def add_users(db, *user_ids):
+    for user_id in user_ids:
+        db.add(User(id=user_id, name=f"User {user_id}", email=f"user{user_id}@example.com", card_status=CardStatus.ACTIVE))
+    db.commit()
+
+def test_csv_import_builds_aggregates(db_session):
+    add_users(db_session, 1, 2)
+    report = backfill.import_transactions(db_session, io.StringIO(CSV), "csv", batch_size=2)
+
+    assert report == {"imported": 4, "rejected": 0, "users": 2, "errors": []}
+    assert db_session.query(Transaction).count() == 4
+    aggregate = db_session.get(UserSpendingAggregate, 1)
+    assert aggregate.transaction_count == 3
+    assert aggregate.total_amount == 415.0
+    assert aggregate.category_counts == {"Food": 2, "Travel": 1}
+    assert [e["merchant"] for e in aggregate.recent_transactions] == ["Cafe", "Airline", "Cafe"]
+    # Violations are stored but not counted as spending
+    assert db_session.get(UserSpendingAggregate, 2).transaction_count == 0
+
+def test_import_extends_existing_history(db_session):
+    add_users(db_session, 1, 2)
+    db_session.add(Transaction(user_id=1, merchant="Old", amount=100.0, category="Retail", is_violation=False))
+    db_session.commit()
+    aggregates.build_aggregate(db_session, 1)
+    db_session.commit()
+
+    backfill.import_transactions(db_session, io.StringIO(CSV), "csv")
+
+    aggregate = db_session.get(UserSpendingAggregate, 1)
+    assert aggregate.transaction_count == 4
+    assert aggregate.category_counts == {"Food": 2, "Travel": 1, "Retail": 1}
+
+def test_ndjson_invalid_rows_are_reported(db_session):
+    add_users(db_session, 1)
+    lines = [
+        json.dumps({"user_id": 1, "merchant": "Cafe", "amount": 3, "category": "Food"}),
+        "",
+        json.dumps({"user_id": 1, "merchant": "Cafe", "amount": "lots", "category": "Food"}),
+        "{not json",
+        json.dumps([1, 2]),
+    ]
+
+    report = backfill.import_transactions(db_session, io.StringIO("\n".join(lines)), "ndjson")
+
+    assert (report["imported"], report["rejected"]) == (1, 3)
+    assert [e["line"] for e in report["errors"]] == [3, 4, 5]
+
+def test_unknown_users_are_rejected(db_session):
+    add_users(db_session, 1)
+    lines = [json.dumps({"user_id": user_id, "merchant": "Cafe", "amount": 3, "category": "Food"}) for user_id in (1, 99, 1, 98)]
+
+    report = backfill.import_transactions(db_session, io.StringIO("\n".join(lines)), "ndjson", batch_size=3)
+
+    assert (report["imported"], report["rejected"], report["users"]) == (2, 2, 1)
+    assert report["errors"] == [{"line": 2, "error": "Unknown user_id"}, {"line": 4, "error": "Unknown user_id"}]
+    assert db_session.query(Transaction).count() == 2
+    assert db_session.get(UserSpendingAggregate, 99) is None
+
+def test_import_endpoint(client, api_db):
+    add_users(api_db(), 7)
+    body = "\n".join(json.dumps({"user_id": 7, "merchant": f"Shop {i}", "amount": i, "category": "Food"}) for i in range(5))
+    # Chunks split records mid-line, as a streamed upload would
+    chunks = [body[i:i + 7].encode() for i in range(0, len(body), 7)]
+
+    response = client.post("/transactions/import", params={"format": "ndjson"}, content=iter(chunks))
+
+    assert response.status_code == 200
+    assert response.json()["imported"] == 5
+    assert api_db().get(UserSpendingAggregate, 7).total_amount == 10.0
+    assert client.post("/transactions/import", params={"format": "xml"}, content=body).status_code == 400
@@ -0,0 +1,137 @@
+import datetime
+import json
+from unittest.mock import MagicMock
+import pytest
+from corpcard_sentinel import backtest, llm_resilience, metrics, sentinel_agent
+from corpcard_sentinel.models import Transaction, User, CardStatus
+
+CANDIDATE_POLICIES = [
+    {"rule_name": "No Gambling", "description": "Casinos are prohibited.", "category": "Gambling"},
+    {"rule_name": "Meals", "description": "Meals up to $75."},
+]
+ALWAYS_SAFE = {"backend": "fake", "decision_mix": {"SAFE": 1}}
+
+def add_history(db):
+    db.add(User(id=1, name="Alice", email="alice@example.com", card_status=CardStatus.ACTIVE))
+    start = datetime.datetime(2024, 1, 1)
+    rows = [("Cafe", "Food", 10.0, False), ("Casino", "Gambling", 500.0, False), ("Cafe", "Food", 20.0, True),
+            ("Airline", "Travel", 300.0, False), ("Casino", "Gambling", 50.0, False)]
+    for i, (merchant, category, amount, is_violation) in enumerate(rows):
+        db.add(Transaction(user_id=1, merchant=merchant, category=category, amount=amount,
+                           timestamp=start + datetime.timedelta(days=i), is_violation=is_violation))
+    db.commit()
+
+def test_history_only_includes_earlier_approved_transactions(db_session):
+    add_history(db_session)
+
+    tasks = list(backtest.iter_tasks(db_session))
+
+    assert [t["transaction"]["merchant"] for t in tasks] == ["Cafe", "Casino", "Cafe", "Airline", "Casino"]
+    assert tasks[0]["history"] == "No previous approved spending history."
+    assert tasks[1]["history"].startswith("User has 1 approved transactions totaling $10.00")
+    # The flagged meal is not part of anyone's approved history
+    assert tasks[3]["history"].startswith("User has 2 approved transactions totaling $510.00")
+    assert tasks[2]["baseline"] == "VIOLATION"
+
+def test_since_still_builds_earlier_history(db_session):
+    add_history(db_session)
+
+    tasks = list(backtest.iter_tasks(db_session, since=datetime.datetime(2024, 1, 4)))
+
+    assert [t["transaction"]["merchant"] for t in tasks] == ["Airline", "Casino"]
+    assert tasks[0]["history"].startswith("User has 2 approved transactions")
+
+def test_report_diffs_decisions_without_writing(db_session):
+    add_history(db_session)
+
+    report = backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE)
+
+    assert report["transactions"] == 5
+    assert report["baseline"] == {"SAFE": 4, "VIOLATION": 1}
+    assert report["replay"] == {"SAFE": 3, "VIOLATION": 2}
+    assert report["transitions"] == {"SAFE->VIOLATION": 2, "VIOLATION->SAFE": 1}
+    assert {c["merchant"] for c in report["changes"] if c["replay"] == "VIOLATION"} == {"Casino"}
+    assert report["throughput_per_second"] > 0
+    # Dry run: no freeze, no rewritten transactions, and the real LLM is back in place
+    db_session.expire_all()
+    assert db_session.get(User, 1).card_status == CardStatus.ACTIVE
+    assert db_session.query(Transaction).filter(Transaction.is_violation == True).count() == 1
+    assert not isinstance(sentinel_agent.llm, backtest.FakeLLM)
+
+def test_frozen_card_attempts_are_not_compared(db_session):
+    add_history(db_session)
+    db_session.add(Transaction(user_id=1, merchant="Cafe", category="Food", amount=5.0, timestamp=datetime.datetime(2024, 2, 1),
+                               is_violation=True, violation_reason="Card is FROZEN"))
+    db_session.commit()
+
+    report = backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE)
+
+    assert (report["transactions"], report["frozen"]) == (6, 1)
+    assert "FROZEN" not in report["baseline"] and sum(report["replay"].values()) == 5
+    assert report["transitions"] == {"SAFE->VIOLATION": 2, "VIOLATION->SAFE": 1}
+    assert "Attempts on frozen cards (not compared): 1" in backtest.format_report(report)
+
+def test_investigation_sees_time_correct_history(mocker):
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    llm.invoke.side_effect = [MagicMock(content='{"decision": "SUSPICIOUS", "reason": "Odd"}'),
+                              MagicMock(content='{"decision": "SAFE", "reason": "Usual"}')]
+    task = {"transaction": {"id": 1, "user_id": 1, "merchant": "Shop", "amount": 5.0, "category": "Food", "timestamp": None},
+            "history": "User has 7 approved transactions.", "baseline": "SAFE"}
+
+    result = backtest.replay(task, backtest.build_snapshot(CANDIDATE_POLICIES))
+
+    assert result["investigated"] and result["replay"] == "SAFE"
+    assert "User has 7 approved transactions." in llm.invoke.call_args_list[1].args[0]
+
+def test_resume_from_checkpoint(db_session, tmp_path):
+    add_history(db_session)
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    partial = backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE, chunk_size=2, checkpoint=checkpoint, limit=2)
+    assert partial["transactions"] == 2
+    assert json.load(open(checkpoint))["position"][1] == 2
+
+    resumed = backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE, chunk_size=2, checkpoint=checkpoint)
+    full = backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE)
+    assert resumed["transactions"] == 5
+    assert (resumed["replay"], resumed["transitions"]) == (full["replay"], full["transitions"])
+
+def test_checkpoint_from_another_llm_configuration_is_refused(db_session, tmp_path):
+    add_history(db_session)
+    checkpoint = str(tmp_path / "checkpoint.json")
+    backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE, chunk_size=2, checkpoint=checkpoint, limit=2)
+
+    with pytest.raises(ValueError, match="LLM configuration"):
+        backtest.run_backtest(db_session, CANDIDATE_POLICIES, {"backend": "fake", "seed": 3}, checkpoint=checkpoint)
+
+def test_inline_run_leaves_live_metrics_alone(db_session):
+    add_history(db_session)
+    before = metrics.REGISTRY.render()
+
+    backtest.run_backtest(db_session, CANDIDATE_POLICIES, ALWAYS_SAFE)
+
+    assert metrics.REGISTRY.render() == before
+
+def test_process_pool_matches_inline_run(db_session):
+    add_history(db_session)
+    llm_spec = {"backend": "fake", "seed": 3}
+
+    inline = backtest.run_backtest(db_session, CANDIDATE_POLICIES, llm_spec)
+    pooled = backtest.run_backtest(db_session, CANDIDATE_POLICIES, llm_spec, workers=2, chunk_size=2)
+
+    assert pooled["replay"] == inline["replay"]
+    assert [c["id"] for c in pooled["changes"]] == [c["id"] for c in inline["changes"]]
+
+def test_recording_misses_do_not_open_the_circuit(db_session, tmp_path, mocker):
+    add_history(db_session)
+    recordings = tmp_path / "responses.jsonl"
+    recordings.write_text("")
+    mocker.patch.object(llm_resilience, "LLM_MAX_ATTEMPTS", 1)
+    mocker.patch.object(llm_resilience.breaker, "min_calls", 2)
+
+    report = backtest.run_backtest(db_session, CANDIDATE_POLICIES, {"backend": "recorded", "recordings": str(recordings)})
+
+    # Every miss is a manual review; none of them counts against the live breaker
+    assert report["replay"].get("MANUAL_REVIEW", 0) >= 3
+    assert llm_resilience.breaker.state == llm_resilience.CircuitBreaker.CLOSED
+    assert sentinel_agent.llm_circuit is llm_resilience.breaker
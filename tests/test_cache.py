@@ -0,0 +1,39 @@
+from corpcard_sentinel.cache import TTLCache
+
+def test_hit_and_miss_counters():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry(mocker):
+    clock = mocker.patch("corpcard_sentinel.cache.time.monotonic", return_value=100.0)
+    cache = TTLCache(maxsize=10, ttl=5)
+    cache.set("a", 1)
+
+    clock.return_value = 104.0
+    assert cache.get("a") == 1
+    clock.return_value = 106.0
+    assert cache.get("a") is None
+
+def test_zero_size_disables_cache():
+    cache = TTLCache(maxsize=0, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
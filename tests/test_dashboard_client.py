@@ -0,0 +1,43 @@
+import json
+import time
+import pytest
+import requests
+from corpcard_sentinel.dashboard_client import DashboardClient
+
+def fake_response(status_code=200, body=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode()
+    return response
+
+@pytest.fixture
+def client():
+    client = DashboardClient("http://api.test/", connect_timeout=1, read_timeout=2)
+    yield client
+    client.close()
+
+def test_requests_share_one_session_with_timeouts(client, mocker):
+    request = mocker.patch.object(client.session, "request", return_value=fake_response(body={"ok": True}))
+
+    assert client.get_json("/users", params={"limit": 5}) == {"ok": True}
+    client.post("/policies", json={"rule_name": "x"})
+
+    request.assert_any_call("GET", "http://api.test/users", params={"limit": 5}, timeout=(1, 2))
+    request.assert_any_call("POST", "http://api.test/policies", json={"rule_name": "x"}, timeout=(1, 2))
+
+def test_get_json_raises_on_error_status(client, mocker):
+    mocker.patch.object(client.session, "request", return_value=fake_response(500, {"detail": "boom"}))
+    with pytest.raises(requests.HTTPError):
+        client.get_json("/users")
+
+def test_fetch_all_runs_concurrently(client, mocker):
+    def slow_request(method, url, **kwargs):
+        time.sleep(0.2)
+        return fake_response(body=url.rsplit("/", 1)[-1])
+    mocker.patch.object(client.session, "request", side_effect=slow_request)
+
+    started = time.perf_counter()
+    data = client.fetch_all({"users": "/users", "policies": "/policies", "logs": "/audit_logs"})
+
+    assert data == {"users": "users", "policies": "policies", "logs": "audit_logs"}
+    assert time.perf_counter() - started < 0.5
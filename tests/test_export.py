@@ -0,0 +1,56 @@
+import io
+import csv
+import json
+import pytest
+from corpcard_sentinel import export
+from tests.test_pagination import add_transactions
+
+def test_ndjson_export_streams_filtered_rows_oldest_first(client, api_db):
+    db = api_db()
+    add_transactions(db, 6, user_id=1)
+    add_transactions(db, 3, user_id=2, category="Travel")
+
+    response = client.get("/transactions/export", params={"user_id": 1, "since": "2024-01-01T01:00:00"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert "attachment" in response.headers["content-disposition"]
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["merchant"] for r in rows] == ["Shop 1", "Shop 2", "Shop 3", "Shop 4", "Shop 5"]
+    assert rows[0]["timestamp"] == "2024-01-01T01:00:00"
+
+def test_csv_export_with_fields(client, api_db):
+    add_transactions(api_db(), 3)
+
+    response = client.get("/transactions/export", params={"format": "csv", "fields": "id,amount"})
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert rows[0].keys() == {"id", "amount"}
+    assert [r["amount"] for r in rows] == ["10.0", "11.0", "12.0"]
+
+def test_csv_export_without_rows_has_header(client, api_db):
+    response = client.get("/transactions/export", params={"format": "csv", "fields": "id,merchant"})
+    assert response.text.strip() == "id,merchant"
+
+def test_parquet_export(client, api_db):
+    pq = pytest.importorskip("pyarrow.parquet")
+    add_transactions(api_db(), 5)
+
+    response = client.get("/transactions/export", params={"format": "parquet"})
+
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 5
+    assert table.column("merchant").to_pylist() == [f"Shop {i}" for i in range(5)]
+
+def test_export_reads_in_partitions(api_db):
+    add_transactions(api_db(), 5)
+    partitions = list(export.iter_partitions(["id"], {}, batch_size=2))
+    assert [len(p) for p in partitions] == [2, 2, 1]
+
+def test_export_rejects_bad_requests(client, api_db, mocker):
+    assert client.get("/transactions/export", params={"format": "xml"}).status_code == 400
+    assert client.get("/transactions/export", params={"fields": "password"}).status_code == 400
+    mocker.patch.object(export, "parquet_available", return_value=False)
+    assert client.get("/transactions/export", params={"format": "parquet"}).status_code == 501
@@ -0,0 +1,50 @@
+import json
+import asyncio
+import pytest
+from corpcard_sentinel.fake_llm import FakeLLM, RecordedLLM, RecordingLLM, parse_decision_mix
+from corpcard_sentinel.sentinel_agent import build_evaluation_prompt, build_batch_evaluation_prompt, parse_llm_decision, parse_batch_decisions
+
+def test_decisions_are_deterministic():
+    prompt = build_evaluation_prompt({"id": 1, "amount": 100}, ["Rule 1"], None)
+
+    first = FakeLLM(latency=0, seed=1).invoke(prompt)
+    second = asyncio.run(FakeLLM(latency=0, seed=1).ainvoke(prompt))
+
+    assert first.content == second.content
+    assert parse_llm_decision(first.content)[0] in ("SAFE", "SUSPICIOUS", "VIOLATION")
+
+def test_decision_mix():
+    llm = FakeLLM(latency=0, decision_mix={"VIOLATION": 1})
+    prompt = build_evaluation_prompt({"id": 1, "amount": 100}, [], None)
+    assert json.loads(llm.invoke(prompt).content)["decision"] == "VIOLATION"
+
+def test_answers_every_batch_item():
+    llm = FakeLLM(latency=0)
+    prompt = build_batch_evaluation_prompt([{"id": i} for i in range(3)], ["Rule 1"])
+
+    decisions = parse_batch_decisions(llm.invoke(prompt).content)
+
+    assert sorted(decisions) == [0, 1, 2]
+    assert llm.calls == 1
+
+def test_error_rate():
+    with pytest.raises(RuntimeError):
+        FakeLLM(latency=0, error_rate=1).invoke("prompt")
+
+def test_parse_decision_mix():
+    assert parse_decision_mix("safe=0.9, VIOLATION=0.1") == {"SAFE": 0.9, "VIOLATION": 0.1}
+    with pytest.raises(ValueError):
+        parse_decision_mix("MAYBE=1")
+
+def test_recorded_responses_replay(tmp_path):
+    path = str(tmp_path / "responses.jsonl")
+    prompts = [build_evaluation_prompt({"id": i, "amount": 100}, ["Rule 1"], None) for i in range(3)]
+    recording = RecordingLLM(FakeLLM(latency=0), path)
+    live = [recording.invoke(p).content for p in prompts]
+
+    recorded = RecordedLLM.from_file(path)
+
+    assert [recorded.invoke(p).content for p in prompts] == live
+    with pytest.raises(KeyError):
+        recorded.invoke("unseen prompt")
+    assert recorded.misses == 1
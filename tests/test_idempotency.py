@@ -0,0 +1,118 @@
+import datetime
+import threading
+from unittest.mock import MagicMock
+from corpcard_sentinel import idempotency
+from corpcard_sentinel.models import User, Transaction, IdempotencyKey, CardStatus
+
+PAYLOAD = {"merchant": "Cafe", "amount": 5, "category": "Food"}
+
+def setup_user(client, mocker):
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    llm.invoke.side_effect = [MagicMock(content='{"decision": "SAFE", "reason": "Fine"}')]
+    user = client.post("/users", json={"name": "Alice", "email": "alice@example.com", "card_status": "ACTIVE"}).json()
+    client.post("/policies", json={"rule_name": "Meals", "description": "Meals up to $75."})
+    return user, llm
+
+def test_retry_returns_stored_result_without_running_the_graph(client, api_db, mocker):
+    user, llm = setup_user(client, mocker)
+    body = {"user_id": user["id"], **PAYLOAD}
+
+    first = client.post("/simulate_transaction", json=body, headers={"Idempotency-Key": "abc"})
+    retry = client.post("/simulate_transaction", json=body, headers={"Idempotency-Key": "abc"})
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert llm.invoke.call_count == 1
+    assert api_db().query(Transaction).count() == 1
+
+def test_key_reused_with_different_body(client, mocker):
+    user, _ = setup_user(client, mocker)
+    client.post("/simulate_transaction", json={"user_id": user["id"], **PAYLOAD}, headers={"Idempotency-Key": "abc"})
+
+    response = client.post("/simulate_transaction", json={"user_id": user["id"], **PAYLOAD, "amount": 6}, headers={"Idempotency-Key": "abc"})
+
+    assert response.status_code == 422
+
+def test_concurrent_duplicate_waits_for_the_first(api_db):
+    db = api_db()
+    db.add(User(id=1, name="Alice", email="alice@example.com", card_status=CardStatus.ACTIVE))
+    db.add(Transaction(id=7, user_id=1, merchant="Cafe", amount=5, category="Food"))
+    db.commit()
+
+    # The first request is still being evaluated
+    future, owner = idempotency.in_flight.claim("abc", "hash")
+    assert owner
+    work = MagicMock()
+    results = []
+    duplicate = threading.Thread(target=lambda: results.append(idempotency.run_once(api_db(), "abc", "hash", work)))
+    duplicate.start()
+
+    idempotency.in_flight.release("abc", future, 7)
+    duplicate.join(timeout=5)
+
+    assert results[0].id == 7
+    work.assert_not_called()
+
+def test_lookup_does_not_commit_the_expired_key_delete(api_db):
+    db = api_db()
+    db.add(IdempotencyKey(key="abc", request_hash="hash", transaction_id=7,
+                          created_at=datetime.datetime.utcnow() - datetime.timedelta(hours=idempotency.IDEMPOTENCY_TTL_HOURS + 1)))
+    db.commit()
+
+    assert idempotency.lookup(db, "abc", "hash") is None
+    # The request failed before its commit: the old key is still there
+    db.rollback()
+    assert api_db().get(IdempotencyKey, "abc") is not None
+
+def test_expired_key_is_evaluated_again(api_db):
+    db = api_db()
+    db.add(User(id=1, name="Alice", email="alice@example.com", card_status=CardStatus.ACTIVE))
+    db.add(Transaction(id=7, user_id=1, merchant="Cafe", amount=5, category="Food"))
+    db.add(IdempotencyKey(key="abc", request_hash="hash", transaction_id=7,
+                          created_at=datetime.datetime.utcnow() - datetime.timedelta(hours=idempotency.IDEMPOTENCY_TTL_HOURS + 1)))
+    db.commit()
+
+    def work():
+        transaction = Transaction(user_id=1, merchant="Cafe", amount=5, category="Food")
+        db.add(transaction)
+        return transaction
+
+    result = idempotency.run_once(db, "abc", "hash", work)
+
+    assert result.id != 7
+    assert api_db().get(IdempotencyKey, "abc").transaction_id == result.id
+
+def test_concurrent_same_key_requests_run_one_evaluation(client, mocker):
+    user, llm = setup_user(client, mocker)
+    body = {"user_id": user["id"], **PAYLOAD}
+    joined = threading.Event()
+    claim = idempotency.in_flight.claim
+
+    def watch_claim(key, request_hash):
+        future, owner = claim(key, request_hash)
+        if not owner:
+            joined.set()
+        return future, owner
+
+    def slow_invoke(prompt):
+        # The duplicate arrives while the first request is still with the LLM
+        duplicate.start()
+        joined.wait(5)
+        return MagicMock(content='{"decision": "SAFE", "reason": "Fine"}')
+
+    mocker.patch.object(idempotency.in_flight, "claim", watch_claim)
+    llm.invoke.side_effect = slow_invoke
+    responses = []
+    duplicate = threading.Thread(target=lambda: responses.append(
+        client.post("/simulate_transaction", json=body, headers={"Idempotency-Key": "abc"})))
+    before = idempotency.REQUESTS.value(result="coalesced")
+
+    first = client.post("/simulate_transaction", json=body, headers={"Idempotency-Key": "abc"})
+    duplicate.join(timeout=5)
+
+    # The duplicate joined the in-flight evaluation instead of queueing on the user lock
+    assert joined.is_set()
+    assert idempotency.REQUESTS.value(result="coalesced") == before + 1
+    assert llm.invoke.call_count == 1
+    assert responses[0].status_code == 200
+    assert responses[0].json()["id"] == first.json()["id"]
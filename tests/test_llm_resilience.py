@@ -0,0 +1,191 @@
+import time
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from corpcard_sentinel import llm_resilience, metrics
+from corpcard_sentinel.llm_resilience import CircuitBreaker, BudgetExceeded
+from corpcard_sentinel.policy_rules import compile_policies
+from corpcard_sentinel.policy_selection import PolicyIndex
+from corpcard_sentinel.models import Policy
+from corpcard_sentinel.sentinel_agent import evaluate, evaluate_batch, AgentState
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_on_errors_and_recovers_through_half_open():
+    clock = Clock()
+    breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5, slow_call=10, slow_rate=1.0, cooldown=30, clock=clock)
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 31
+    # One probe at a time while half-open
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 62
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_opens_on_slow_calls():
+    breaker = CircuitBreaker(window=3, min_calls=3, error_rate=1.0, slow_call=5, slow_rate=0.6, cooldown=30, clock=Clock())
+    for duration in (6, 1, 7):
+        breaker.record(True, duration)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_hedge_returns_the_faster_attempt(mocker):
+    mocker.patch.object(llm_resilience, "LLM_HEDGE_DELAY", 0.05)
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    before = llm_resilience.ATTEMPTS.value(kind="hedge")
+    try:
+        assert llm_resilience.hedged_call(fn, llm_resilience.deadline_after(5)) == "fast"
+    finally:
+        release.set()
+    assert llm_resilience.ATTEMPTS.value(kind="hedge") == before + 1
+
+
+def test_failed_attempt_is_retried_and_budget_is_enforced(mocker):
+    mocker.patch.object(llm_resilience, "LLM_RETRY_BACKOFF", 0.01)
+    fn = MagicMock(side_effect=[RuntimeError("503"), "ok"])
+    assert llm_resilience.hedged_call(fn, llm_resilience.deadline_after(5)) == "ok"
+    assert fn.call_count == 2
+
+    release = threading.Event()
+    started = time.monotonic()
+    try:
+        with pytest.raises(BudgetExceeded):
+            llm_resilience.hedged_call(lambda: release.wait(5), llm_resilience.deadline_after(0.1))
+    finally:
+        release.set()
+    assert time.monotonic() - started < 1
+
+
+def test_async_hedge_cancels_the_loser(mocker):
+    mocker.patch.object(llm_resilience, "LLM_HEDGE_DELAY", 0.05)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fast():
+        return "fast"
+
+    attempts = iter([slow, fast])
+
+    async def run():
+        result = await llm_resilience.ahedged_call(lambda: next(attempts)(), llm_resilience.deadline_after(5))
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "fast"
+    assert cancelled == [True]
+
+
+def _state(transaction, policies):
+    snapshot_policies = [Policy(id=i + 1, is_active=True, **p) for i, p in enumerate(policies)]
+    return AgentState(
+        transaction=transaction,
+        policies=[f"{p.rule_name}: {p.description}" for p in snapshot_policies],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None,
+        rules=compile_policies(snapshot_policies),
+        policy_index=PolicyIndex(snapshot_policies),
+    )
+
+
+def test_open_circuit_uses_rule_fallback_without_calling_llm(mocker):
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mocker.patch.object(llm_resilience.breaker, "allow", return_value=False)
+    policies = [
+        {"rule_name": "Gambling Ban", "description": "No gambling.", "category": "Gambling"},
+        {"rule_name": "Travel Review", "description": "Hotels over $500 need a receipt."},
+    ]
+    before = metrics.DECISIONS.value(decision="VIOLATION", source="circuit_open")
+
+    blocked = evaluate(_state({"id": 1, "user_id": 1, "merchant": "Casino", "category": "Gambling", "amount": 50}, policies))
+    assert blocked["decision"] == "VIOLATION"
+    assert metrics.DECISIONS.value(decision="VIOLATION", source="circuit_open") == before + 1
+
+    hotel = evaluate(_state({"id": 2, "user_id": 1, "merchant": "Hotel", "category": "Travel", "amount": 800}, policies))
+    assert hotel["decision"] == "MANUAL_REVIEW"
+    assert hotel["violation_reason"].startswith("MANUAL REVIEW REQUIRED")
+    assert "Travel Review" in hotel["violation_reason"]
+
+    batch = evaluate_batch([_state({"id": 3, "user_id": 2, "merchant": "Hotel", "category": "Travel", "amount": 900}, policies)])
+    assert batch[0]["decision"] == "MANUAL_REVIEW"
+    llm.invoke.assert_not_called()
+
+
+def test_fallback_can_approve_transactions_no_policy_covers(mocker):
+    mocker.patch.object(llm_resilience, "LLM_FALLBACK_SAFE_UNMATCHED", True)
+    state = _state({"id": 1, "user_id": 1, "merchant": "Cafe", "category": "Food", "amount": 5},
+                   [{"rule_name": "Gambling Ban", "description": "No gambling or casinos."}])
+    decision, _ = llm_resilience.fallback_verdict(state["rules"], state["policy_index"], state["transaction"])
+    assert decision == "SAFE"
+
+
+def test_llm_failures_open_the_circuit(mocker):
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    llm.invoke.side_effect = RuntimeError("API Down")
+    mocker.patch.object(llm_resilience, "LLM_MAX_ATTEMPTS", 1)
+    mocker.patch.object(llm_resilience.breaker, "min_calls", 2)
+
+    state = _state({"id": 1, "user_id": 1, "merchant": "Cafe", "category": "Food", "amount": 5}, [])
+    assert "System Error" in evaluate(state)["violation_reason"]
+    assert "System Error" in evaluate(state)["violation_reason"]
+    assert llm_resilience.breaker.state == CircuitBreaker.OPEN
+    assert "sentinel_llm_circuit_state 2.0" in metrics.REGISTRY.render()
+
+    assert "LLM unavailable" in evaluate(state)["violation_reason"]
+    assert llm.invoke.call_count == 2
+
+
+def test_budget_exceeded_cancels_queued_attempts(mocker):
+    mocker.patch.object(llm_resilience, "LLM_HEDGE_DELAY", 0.01)
+    pool = llm_resilience.ThreadPoolExecutor(max_workers=1)
+    mocker.patch.object(llm_resilience, "_pool", return_value=pool)
+    release = threading.Event()
+    fn = MagicMock(side_effect=lambda: release.wait(5))
+
+    try:
+        with pytest.raises(BudgetExceeded):
+            llm_resilience.hedged_call(fn, llm_resilience.deadline_after(0.1))
+    finally:
+        release.set()
+        pool.shutdown(wait=True)
+    # The hedge was still queued behind the stuck attempt and never ran
+    assert fn.call_count == 1
@@ -0,0 +1,188 @@
+import asyncio
+from unittest.mock import MagicMock
+from sqlalchemy import event
+from corpcard_sentinel import database
+from corpcard_sentinel.models import User, Transaction, UserSpendingAggregate, CardStatus
+
+def create_user(client, name="Alice"):
+    return client.post("/users", json={"name": name, "email": f"{name.lower()}@example.com", "card_status": "ACTIVE"}).json()
+
+def create_policy(client, **fields):
+    payload = {"rule_name": "Meals", "description": "Meals up to $75."}
+    payload.update(fields)
+    return client.post("/policies", json=payload).json()
+
+def mock_llm(mocker, *contents):
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    llm.invoke.side_effect = [MagicMock(content=c) for c in contents]
+    return llm
+
+def test_simulate_safe_transaction(client, api_db, mocker):
+    mock_llm(mocker, '{"decision": "SAFE", "reason": "Fine"}')
+    user = create_user(client)
+    create_policy(client)
+
+    response = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Cafe", "amount": 5, "category": "Food"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["id"] is not None
+    assert body["is_violation"] is False
+    assert body["violation_reason"] == "Fine"
+
+    db = api_db()
+    assert db.get(UserSpendingAggregate, user["id"]).transaction_count == 1
+
+def test_aggregate_records_transaction_ids(client, api_db, mocker):
+    mock_llm(mocker, '{"decision": "SAFE", "reason": "Fine"}', '{"decision": "SAFE", "reason": "Fine"}')
+    user = create_user(client)
+    create_policy(client)
+
+    first = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Cafe", "amount": 5, "category": "Food"}).json()
+    second = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Deli", "amount": 7, "category": "Food"}).json()
+
+    recent = api_db().get(UserSpendingAggregate, user["id"]).recent_transactions
+    assert sorted(e["id"] for e in recent) == [first["id"], second["id"]]
+
+def test_violation_is_written_in_a_single_commit(client, api_db, mocker):
+    mock_llm(mocker, '{"decision": "VIOLATION", "reason": "Personal purchase"}')
+    user = create_user(client)
+    create_policy(client)
+
+    commits = []
+    event.listen(database.engine, "commit", lambda conn: commits.append(conn))
+    response = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Casino", "amount": 50, "category": "Retail"})
+
+    assert response.json()["is_violation"] is True
+    assert len(commits) == 1
+
+    db = api_db()
+    assert db.get(User, user["id"]).card_status == CardStatus.FROZEN
+    transaction = db.query(Transaction).one()
+    assert transaction.is_violation is True
+    assert transaction.violation_reason == "Personal purchase"
+    assert db.get(UserSpendingAggregate, user["id"]) is None
+
+def test_frozen_card_skips_agent(client, mocker):
+    llm = mock_llm(mocker)
+    user = create_user(client)
+    create_policy(client, rule_name="No Gambling", category="Gambling")
+
+    client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Casino", "amount": 5, "category": "Gambling"})
+    response = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Cafe", "amount": 5, "category": "Food"})
+
+    assert response.json()["violation_reason"] == "Card is FROZEN"
+    llm.invoke.assert_not_called()
+
+def test_velocity_policy_freezes_on_burst(client, mocker):
+    llm = mock_llm(mocker)
+    user = create_user(client)
+    create_policy(client, rule_name="Card Testing", velocity_limit=2, velocity_window_minutes=10, velocity_per_merchant=True)
+
+    responses = [
+        client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Gift Cards", "amount": 1, "category": "Retail"}).json()
+        for _ in range(3)
+    ]
+
+    assert [r["is_violation"] for r in responses] == [False, False, True]
+    assert responses[2]["violation_reason"] == "Policy Violation: Card Testing"
+    llm.invoke.assert_not_called()
+
+def test_batch_uses_one_llm_call(client, mocker):
+    llm = mock_llm(mocker, '[{"item": 0, "decision": "SAFE", "reason": "Fine"}, {"item": 1, "decision": "VIOLATION", "reason": "Bad"}]')
+    alice = create_user(client, "Alice")
+    bob = create_user(client, "Bob")
+    create_policy(client)
+
+    response = client.post("/simulate_transactions/batch", json=[
+        {"user_id": alice["id"], "merchant": "Cafe", "amount": 5, "category": "Food"},
+        {"user_id": bob["id"], "merchant": "Bar", "amount": 500, "category": "Food"},
+    ])
+
+    assert [t["is_violation"] for t in response.json()] == [False, True]
+    assert all(t["id"] is not None for t in response.json())
+    assert llm.invoke.call_count == 1
+    users = {u["id"]: u["card_status"] for u in client.get("/users").json()}
+    assert users == {alice["id"]: "ACTIVE", bob["id"]: "FROZEN"}
+
+def test_batch_stops_approving_after_a_freeze(client, mocker):
+    mock_llm(mocker, '[{"item": 0, "decision": "VIOLATION", "reason": "No Gambling"}, {"item": 1, "decision": "SAFE", "reason": "ok"}]')
+    alice = create_user(client, "Alice")
+    create_policy(client)
+
+    response = client.post("/simulate_transactions/batch", json=[
+        {"user_id": alice["id"], "merchant": "Casino", "amount": 50, "category": "Gambling"},
+        {"user_id": alice["id"], "merchant": "Cafe", "amount": 5, "category": "Food"},
+    ])
+
+    assert [(t["is_violation"], t["violation_reason"]) for t in response.json()] == [
+        (True, "No Gambling"), (True, "Card is FROZEN")]
+    assert client.get("/users").json()[0]["card_status"] == "FROZEN"
+
+def test_async_batch_waits_for_single_decisions_of_its_users(mocker):
+    from corpcard_sentinel import main, user_locks
+    mocker.patch.object(user_locks, "locks", user_locks.ShardedLocks(shards=64))
+    check_batch = mocker.patch.object(main, "check_batch", return_value=[])
+    transactions = [main.schemas.TransactionCreate(user_id=1, merchant="Cafe", amount=5, category="Food")]
+
+    async def run():
+        # A single decision for user 1 is in progress in async mode
+        async with user_locks.ahold([1]):
+            batch = asyncio.ensure_future(main.simulate_transactions_batch_async(transactions, db=MagicMock()))
+            await asyncio.sleep(0.05)
+            assert not batch.done()
+            check_batch.assert_not_called()
+        return await batch
+
+    assert asyncio.run(run()) == []
+    check_batch.assert_called_once()
+
+def test_metrics_endpoint(client, mocker):
+    from corpcard_sentinel import metrics
+    before = metrics.DECISIONS.value(decision="SAFE", source="llm")
+    mock_llm(mocker, '{"decision": "SAFE", "reason": "Fine"}')
+    user = create_user(client)
+    create_policy(client)
+    client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Cafe", "amount": 5, "category": "Food"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert metrics.DECISIONS.value(decision="SAFE", source="llm") == before + 1
+    assert 'sentinel_node_duration_seconds_count{node="evaluate"}' in response.text
+    assert 'sentinel_llm_latency_seconds_bucket{mode="single",outcome="ok",le="+Inf"}' in response.text
+    assert "sentinel_verdict_cache_entries 1.0" in response.text
+
+def add_transactions(api_db, *rows):
+    db = api_db()
+    for user_id, category, amount, is_violation in rows:
+        db.add(Transaction(user_id=user_id, merchant="Shop", amount=amount, category=category, is_violation=is_violation))
+    db.commit()
+
+def test_audit_logs_include_user_name(client, api_db):
+    alice = create_user(client, "Alice")
+    add_transactions(api_db, (alice["id"], "Food", 10.0, False), (alice["id"], "Travel", 900.0, True), (999, "Food", 5.0, False))
+
+    logs = client.get("/audit_logs").json()
+    assert {(log["user_name"], log["category"]) for log in logs} == {("Alice", "Food"), ("Alice", "Travel"), (None, "Food")}
+
+    violations = client.get("/audit_logs", params={"is_violation": True}).json()
+    assert [log["amount"] for log in violations] == [900.0]
+
+def test_stats_summary(client, api_db):
+    alice = create_user(client, "Alice")
+    bob = create_user(client, "Bob")
+    add_transactions(api_db, (alice["id"], "Food", 10.0, False), (alice["id"], "Travel", 900.0, True),
+                     (bob["id"], "Travel", 100.0, True), (bob["id"], "Gambling", 50.0, True))
+    db = api_db()
+    db.get(User, bob["id"]).card_status = CardStatus.FROZEN
+    db.commit()
+
+    stats = client.get("/stats/summary").json()
+
+    assert stats["total_transactions"] == 4
+    assert (stats["violations"], stats["allowed"]) == (3, 1)
+    assert (stats["total_amount"], stats["violation_amount"]) == (1060.0, 1050.0)
+    assert (stats["users"], stats["active_cards"], stats["frozen_cards"]) == (2, 1, 1)
+    assert stats["violations_by_category"][0] == {"category": "Travel", "violations": 2, "amount": 1000.0}
@@ -0,0 +1,59 @@
+import asyncio
+import inspect
+import logging
+import json
+from corpcard_sentinel.metrics import Counter, Histogram, CallbackGauge, Registry, timed
+from corpcard_sentinel.logging_config import JSONFormatter, KeyValueFormatter
+
+def test_counter_renders_labels():
+    counter = Counter("decisions_total", "Decisions.", ["decision"])
+    counter.inc(decision="SAFE")
+    counter.inc(2, decision="VIOLATION")
+
+    assert counter.render() == (
+        "# HELP decisions_total Decisions.\n"
+        "# TYPE decisions_total counter\n"
+        'decisions_total{decision="SAFE"} 1.0\n'
+        'decisions_total{decision="VIOLATION"} 2.0'
+    )
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = histogram.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+
+def test_registry_renders_callback_gauges():
+    registry = Registry()
+    registry.register(CallbackGauge("cache_entries", "Entries.", lambda: 7))
+    assert "cache_entries 7.0" in registry.render()
+
+def test_timed_keeps_signature_for_langgraph():
+    histogram = Histogram("node_seconds", "Node time.", ["node"])
+
+    @timed(histogram, node="sync")
+    def node(state, config=None):
+        return state
+
+    @timed(histogram, node="async")
+    async def anode(state, config=None):
+        return state
+
+    assert "config" in inspect.signature(node).parameters
+    assert node({"a": 1}) == {"a": 1}
+    assert asyncio.run(anode({"a": 1})) == {"a": 1}
+    assert histogram.count(node="sync") == 1
+    assert histogram.count(node="async") == 1
+
+def test_log_formatters_include_extra_fields():
+    record = logging.makeLogRecord({"name": "corpcard_sentinel", "levelname": "INFO", "msg": "Investigating user %s", "args": (7,), "user_id": 7})
+
+    assert json.loads(JSONFormatter().format(record))["user_id"] == 7
+    assert KeyValueFormatter("%(message)s").format(record) == "Investigating user 7 user_id=7"
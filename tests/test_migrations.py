@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, inspect, text
+from corpcard_sentinel import migrations
+from corpcard_sentinel.database import Base
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(100), card_status VARCHAR(6), email VARCHAR(100))",
+    "CREATE TABLE policies (id INTEGER PRIMARY KEY, rule_name VARCHAR(255), description TEXT, is_active BOOLEAN)",
+    "CREATE TABLE transactions (id INTEGER PRIMARY KEY, user_id INTEGER, merchant VARCHAR(255), amount FLOAT, "
+    "category VARCHAR(100), timestamp DATETIME, is_violation BOOLEAN)",
+]
+
+def legacy_engine():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+    return engine
+
+def test_upgrade_legacy_database():
+    engine = legacy_engine()
+
+    applied = migrations.upgrade(engine)
+
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    inspector = inspect(engine)
+    assert "violation_reason" in {c["name"] for c in inspector.get_columns("transactions")}
+    assert "merchant_pattern" in {c["name"] for c in inspector.get_columns("policies")}
+    assert {"user_spending_aggregates", "policy_versions"} <= set(inspector.get_table_names())
+    assert {"ix_transactions_user_violation_timestamp", "ix_transactions_timestamp"} <= {
+        i["name"] for i in inspector.get_indexes("transactions")
+    }
+
+def test_upgrade_is_idempotent():
+    engine = legacy_engine()
+    migrations.upgrade(engine)
+
+    assert migrations.upgrade(engine) == []
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1][0]
+
+def test_upgrade_database_created_from_models():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+
+    # Every step finds its change already in place and is only recorded
+    assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1][0]
+
+def test_upgrade_to_target():
+    engine = legacy_engine()
+
+    assert migrations.upgrade(engine, target=2) == [1, 2]
+    assert "ix_transactions_timestamp" not in {i["name"] for i in inspect(engine).get_indexes("transactions")}
+    assert migrations.upgrade(engine) == [3, 4, 5, 6]
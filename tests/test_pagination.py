@@ -0,0 +1,86 @@
+import datetime
+import pytest
+from corpcard_sentinel import pagination
+from corpcard_sentinel.models import User, Transaction, CardStatus
+
+def add_transactions(db, count, user_id=1, category="Food", same_timestamp=False):
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(count):
+        timestamp = start if same_timestamp else start + datetime.timedelta(hours=i)
+        db.add(Transaction(user_id=user_id, merchant=f"Shop {i}", amount=10.0 + i, category=category,
+                           timestamp=timestamp, is_violation=i % 5 == 0))
+    db.commit()
+
+def read_all_pages(client, **params):
+    pages, cursor = [], None
+    while True:
+        response = client.get("/transactions", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+        if not cursor:
+            return pages
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor([datetime.datetime(2024, 1, 1, 12), 42])
+    assert pagination.decode_cursor(cursor, 2) == ["2024-01-01T12:00:00", 42]
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        pagination.decode_cursor("not-a-cursor", 2)
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(pagination.encode_cursor([1]), 2)
+
+def test_cursor_ids_must_be_integers(client):
+    for cursor in (pagination.encode_cursor(["2024-01-01T12:00:00", "1 OR 1=1"]), pagination.encode_cursor([None, [3]])):
+        assert client.get("/transactions", params={"cursor": cursor}).status_code == 400
+        assert client.get("/audit_logs", params={"cursor": cursor}).status_code == 400
+    for cursor in (pagination.encode_cursor(["7"]), pagination.encode_cursor([True]), pagination.encode_cursor([1.5])):
+        assert client.get("/users", params={"cursor": cursor}).status_code == 400
+
+def test_cursor_pages_cover_everything_once(client, api_db):
+    db = api_db()
+    add_transactions(db, 7)
+    # Ties on timestamp are broken by id
+    add_transactions(db, 5, same_timestamp=True)
+
+    pages = read_all_pages(client, limit=5)
+
+    assert [len(p) for p in pages] == [5, 5, 2]
+    ids = [t["id"] for page in pages for t in page]
+    assert len(set(ids)) == 12
+    keys = [(t["timestamp"], t["id"]) for page in pages for t in page]
+    assert keys == sorted(keys, reverse=True)
+
+def test_filters(client, api_db):
+    db = api_db()
+    add_transactions(db, 10, user_id=1)
+    add_transactions(db, 4, user_id=2, category="Travel")
+
+    assert len(client.get("/transactions", params={"user_id": 2}).json()) == 4
+    assert len(client.get("/transactions", params={"category": "Travel", "is_violation": True}).json()) == 1
+    in_range = client.get("/transactions", params={"user_id": 1, "since": "2024-01-01T02:00:00", "until": "2024-01-01T05:00:00"}).json()
+    assert [t["merchant"] for t in in_range] == ["Shop 4", "Shop 3", "Shop 2"]
+
+def test_fields_and_legacy_offset(client, api_db):
+    add_transactions(api_db(), 3)
+
+    partial = client.get("/transactions", params={"fields": "id,amount"}).json()
+    assert partial[0].keys() == {"id", "amount"}
+    assert [t["merchant"] for t in client.get("/transactions", params={"skip": 1, "limit": 1}).json()] == ["Shop 1"]
+
+    assert client.get("/transactions", params={"fields": "password"}).status_code == 400
+    assert client.get("/transactions", params={"cursor": "garbage"}).status_code == 400
+
+def test_users_cursor_and_status_filter(client, api_db):
+    db = api_db()
+    for i in range(5):
+        db.add(User(name=f"User {i}", email=f"user{i}@example.com", card_status=CardStatus.FROZEN if i % 2 else CardStatus.ACTIVE))
+    db.commit()
+
+    first = client.get("/users", params={"limit": 3})
+    second = client.get("/users", params={"limit": 3, "cursor": first.headers[pagination.NEXT_CURSOR_HEADER]})
+
+    assert [u["name"] for u in first.json() + second.json()] == [f"User {i}" for i in range(5)]
+    assert pagination.NEXT_CURSOR_HEADER not in second.headers
+    assert [u["name"] for u in client.get("/users", params={"card_status": "FROZEN"}).json()] == ["User 1", "User 3"]
@@ -0,0 +1,82 @@
+import datetime
+from corpcard_sentinel.models import Policy
+from corpcard_sentinel.policy_rules import compile_policy, compile_policies
+
+SATURDAY = datetime.datetime(2024, 6, 1, 12, 0)
+MONDAY = datetime.datetime(2024, 6, 3, 12, 0)
+
+def test_unstructured_policy_is_not_compiled():
+    policy = Policy(id=1, rule_name="Meals", description="Meals up to $75.")
+    assert compile_policy(policy) is None
+
+def test_category_and_amount_conditions_are_combined():
+    rule = compile_policy(Policy(id=1, rule_name="Big Tech", category="Electronics, Software", amount_threshold=500))
+
+    assert rule.matches({"category": "electronics", "amount": 900})
+    assert not rule.matches({"category": "Electronics", "amount": 100})
+    assert not rule.matches({"category": "Food", "amount": 900})
+
+def test_merchant_pattern():
+    rule = compile_policy(Policy(id=1, rule_name="Premium Rides", merchant_pattern=r"uber black|lyft lux"))
+
+    assert rule.matches({"merchant": "UBER BLACK NYC"})
+    assert not rule.matches({"merchant": "Uber"})
+
+def test_invalid_merchant_regex_matches_literally():
+    rule = compile_policy(Policy(id=1, rule_name="Odd", merchant_pattern="Shop (Main"))
+    assert rule.matches({"merchant": "The Shop (Main Street)"})
+
+def test_weekday_condition():
+    rule = compile_policy(Policy(id=1, rule_name="Weekend", weekdays="Sat,Sun"))
+
+    assert rule.matches({"timestamp": SATURDAY})
+    assert rule.matches({"timestamp": SATURDAY.isoformat()})
+    assert not rule.matches({"timestamp": MONDAY})
+
+def test_unknown_weekday_leaves_policy_to_llm():
+    assert compile_policy(Policy(id=1, rule_name="Typo", weekdays="Funday")) is None
+
+def test_ruleset_violation():
+    rules = compile_policies([
+        Policy(id=1, rule_name="No Gambling", category="Gambling"),
+        Policy(id=2, rule_name="Meals", description="Meals up to $75."),
+    ])
+
+    assert rules.check({"category": "Gambling", "amount": 10}) == ("VIOLATION", "Policy Violation: No Gambling")
+
+def test_ruleset_defers_to_llm_with_unstructured_policies():
+    rules = compile_policies([
+        Policy(id=1, rule_name="No Gambling", category="Gambling"),
+        Policy(id=2, rule_name="Meals", description="Meals up to $75."),
+    ])
+
+    assert rules.check({"category": "Food", "amount": 10}) is None
+
+def test_ruleset_safe_when_all_policies_structured():
+    rules = compile_policies([
+        Policy(id=1, rule_name="No Gambling", category="Gambling"),
+        Policy(id=2, rule_name="High Value", amount_threshold=5000),
+    ])
+
+    assert rules.check({"category": "Food", "amount": 10})[0] == "SAFE"
+    assert rules.check({"category": "Food", "amount": 6000})[0] == "VIOLATION"
+
+def test_empty_ruleset_defers_to_llm():
+    assert compile_policies([]).check({"category": "Food", "amount": 10}) is None
+
+def test_velocity_limit():
+    from corpcard_sentinel.velocity import VelocityStore
+    rule = compile_policy(Policy(id=1, rule_name="Card Testing", velocity_limit=3, velocity_window_minutes=10, velocity_per_merchant=True))
+    store = VelocityStore()
+
+    counts = [store.observe(1, "Gift Cards Inc", 1.0, at=1000 + i) for i in range(4)]
+    other_merchant = store.observe(1, "Cafe", 5.0, at=1010)
+
+    assert not rule.matches({}, counts[2])
+    assert rule.matches({}, counts[3])
+    assert not rule.matches({}, other_merchant)
+    # No counters, no burst
+    assert not rule.matches({})
+
+def test_velocity_limit_needs_window():
+    assert compile_policy(Policy(id=1, rule_name="Burst", velocity_limit=3)) is None
@@ -0,0 +1,75 @@
+import datetime
+from unittest.mock import MagicMock
+from corpcard_sentinel import policy_selection
+from corpcard_sentinel.policy_selection import PolicyIndex, tokens
+from corpcard_sentinel.policy_rules import compile_policies
+from corpcard_sentinel.models import Policy
+from corpcard_sentinel.sentinel_agent import AgentState, precheck, evaluate_batch
+
+def catalog():
+    policies = [
+        Policy(id=100, rule_name="No Gambling", description="Transactions at casinos or betting sites are prohibited."),
+        Policy(id=101, rule_name="Travel Meal Limit", description="Single meal expenses during travel cannot exceed $75."),
+        Policy(id=102, rule_name="Weekend Expense Ban", description="Expenses on Saturday or Sunday are flagged for review."),
+        Policy(id=103, rule_name="Rideshare", description="Premium Uber services are prohibited.", merchant_pattern="uber"),
+    ]
+    # Filler the transactions below have nothing to do with
+    policies += [Policy(id=i, rule_name=f"Vendor {i}", description=f"Purchases from supplier{i} need procurement approval.")
+                 for i in range(1, 31)]
+    return policies
+
+def selected_ids(index, **transaction):
+    return index.render(index.select({"merchant": "", "category": "", "amount": 1, **transaction}))[0]
+
+def test_tokens():
+    assert tokens("Casinos, betting SITES and the Uber rides ($75)") == ["casino", "betting", "site", "uber", "ride"]
+
+def test_selects_relevant_policies_only():
+    index = PolicyIndex(catalog())
+    monday = datetime.datetime(2024, 1, 1, 12)
+
+    assert selected_ids(index, merchant="Lucky Casino", category="Entertainment", timestamp=monday) == [100]
+    assert selected_ids(index, merchant="Bistro", category="Food", amount=60, timestamp=monday) == [101]
+    assert selected_ids(index, merchant="Uber Black", category="Travel", timestamp=monday + datetime.timedelta(days=5)) == [101, 102, 103]
+
+def test_token_budget_keeps_most_relevant_in_canonical_order():
+    index = PolicyIndex(catalog())
+    transaction = {"merchant": "Uber", "category": "Travel", "amount": 80, "timestamp": datetime.datetime(2024, 1, 6)}
+    budget = index.costs[3]
+
+    assert index.render(index.select(transaction, budget=budget))[0] == [103]
+    assert index.render(index.select(transaction, budget=10_000))[0] == [101, 102, 103]
+
+def test_small_catalog_is_sent_whole():
+    index = PolicyIndex(catalog()[:4])
+    assert selected_ids(index, merchant="Bookshop", category="Retail") == [100, 101, 102, 103]
+
+def agent_state(transaction, index):
+    return AgentState(
+        transaction=transaction,
+        policies=[], violation_reason=None, is_violation=False, investigation_count=0, spending_history=None,
+        decision=None, rules=compile_policies([]), policy_hash=None, policy_index=index, policy_ids=None,
+    )
+
+def test_precheck_records_selected_policies(mocker):
+    index = PolicyIndex(catalog())
+    state = precheck(agent_state({"id": 1, "user_id": 1, "merchant": "Lucky Casino", "category": "Games", "amount": 20}, index))
+
+    assert state["policy_ids"] == [100]
+    assert state["policies"] == ["No Gambling: Transactions at casinos or betting sites are prohibited."]
+
+    mocker.patch.object(policy_selection, "POLICY_SELECTION", False)
+    assert precheck(agent_state({"id": 1, "user_id": 1, "merchant": "Casino", "category": "Games", "amount": 20}, index))["policy_ids"] is None
+
+def test_batch_prompt_carries_union_of_selections(mocker):
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    llm.invoke.return_value = MagicMock(content='[{"item": 0, "decision": "SAFE", "reason": "ok"}, {"item": 1, "decision": "SAFE", "reason": "ok"}]')
+    index = PolicyIndex(catalog())
+    states = [precheck(agent_state({"id": 1, "user_id": 1, "merchant": "Lucky Casino", "category": "Games", "amount": 20}, index)),
+              precheck(agent_state({"id": 2, "user_id": 1, "merchant": "Uber", "category": "Rides", "amount": 20}, index))]
+
+    evaluate_batch(states)
+
+    prompt = llm.invoke.call_args.args[0]
+    assert prompt.index("No Gambling") < prompt.index("Rideshare")
+    assert "Vendor" not in prompt
@@ -0,0 +1,86 @@
+from corpcard_sentinel.models import Policy
+from corpcard_sentinel.policy_snapshot import PolicySnapshot, PolicySnapshotCache, bump_version, read_version
+from corpcard_sentinel.policy_rules import compile_policies
+
+def add_policy(db, name, **conditions):
+    db.add(Policy(rule_name=name, description=f"{name} rule", is_active=True, **conditions))
+    bump_version(db)
+    db.commit()
+
+def test_bump_version_is_monotonic(db_session):
+    assert read_version(db_session) == 0
+    bump_version(db_session)
+    db_session.commit()
+    bump_version(db_session)
+    db_session.commit()
+    assert read_version(db_session) == 2
+
+def test_snapshot_renders_policies_and_rules(db_session):
+    add_policy(db_session, "No Gambling", category="Gambling")
+    add_policy(db_session, "Meals")
+
+    snapshot = PolicySnapshotCache().refresh(db_session)
+
+    assert snapshot.version == 2
+    assert snapshot.policies == ["No Gambling: No Gambling rule", "Meals: Meals rule"]
+    assert snapshot.rules.check({"category": "Gambling"})[0] == "VIOLATION"
+
+def test_get_skips_database_within_check_interval(db_session, mocker):
+    add_policy(db_session, "Meals")
+    session_factory = mocker.patch("corpcard_sentinel.policy_snapshot.database.SessionLocal", return_value=db_session)
+    mocker.patch.object(db_session, "close")
+    cache = PolicySnapshotCache(check_interval=60)
+
+    first = cache.get()
+    second = cache.get()
+
+    assert first is second
+    assert session_factory.call_count == 1
+
+def test_version_change_triggers_reload(db_session):
+    add_policy(db_session, "Meals")
+    cache = PolicySnapshotCache(check_interval=0)
+    first = cache.refresh(db_session)
+
+    # Unchanged version: the snapshot is reused
+    assert cache.refresh(db_session) is first
+
+    # Another worker changed the policies
+    add_policy(db_session, "Travel")
+    second = cache.refresh(db_session)
+
+    assert second.version == first.version + 1
+    assert len(second.policies) == 2
+    assert cache.reloads == 2
+
+def test_invalidate_forces_reload(db_session):
+    add_policy(db_session, "Meals")
+    cache = PolicySnapshotCache(check_interval=60)
+    first = cache.refresh(db_session)
+
+    cache.invalidate()
+
+    assert cache.refresh(db_session) is not first
+
+def test_get_reuses_callers_session(db_session, mocker):
+    add_policy(db_session, "Meals")
+    session_factory = mocker.patch("corpcard_sentinel.policy_snapshot.database.SessionLocal")
+
+    snapshot = PolicySnapshotCache().get(db_session)
+
+    assert snapshot.policies == ["Meals: Meals rule"]
+    session_factory.assert_not_called()
+
+def test_load_started_before_invalidate_is_not_installed(db_session, mocker):
+    add_policy(db_session, "Meals")
+    cache = PolicySnapshotCache(check_interval=60)
+    stale = PolicySnapshot(1, ["Meals: stale"], compile_policies([]))
+
+    def load_racing_a_policy_change(db):
+        cache.invalidate()
+        return stale
+    mocker.patch("corpcard_sentinel.policy_snapshot.load_snapshot", side_effect=load_racing_a_policy_change)
+
+    assert cache.refresh(db_session) is stale
+    # The next request reloads instead of reusing the stale snapshot
+    assert cache._fresh() is None
@@ -0,0 +1,52 @@
+from corpcard_sentinel import metrics
+from corpcard_sentinel.prompts import PromptRenderer
+from corpcard_sentinel.sentinel_agent import evaluate, AgentState
+
+POLICIES = ["No Alcohol: alcohol purchases are prohibited", "Weekend Travel: no travel on weekends"]
+
+def test_prefix_is_shared_across_transactions():
+    renderer = PromptRenderer()
+    first = renderer.evaluation({"id": 1, "amount": 100, "merchant": "Cafe"}, POLICIES, None)
+    second = renderer.evaluation({"id": 2, "amount": 9000, "merchant": "Airline"}, POLICIES, "Total spend: $10")
+    prefix = renderer.prefix(POLICIES)
+
+    assert first.startswith(prefix) and second.startswith(prefix)
+    # Policies come before anything that varies per transaction
+    assert prefix.index(POLICIES[-1]) < first.index("Transaction:")
+    assert "Cafe" not in prefix and "No history available yet." in first
+
+def test_prefix_rendered_once_per_policy_set():
+    renderer = PromptRenderer()
+    renderer.evaluation({"id": 1}, POLICIES, None, policy_hash="v1")
+    renderer.evaluation({"id": 2}, POLICIES, None, policy_hash="v1")
+    renderer.evaluation({"id": 3}, POLICIES[:1], None, policy_hash="v2")
+
+    stats = renderer.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 1
+
+def test_batch_prompt_shares_policy_block():
+    renderer = PromptRenderer()
+    prompt = renderer.batch([{"id": 1}, {"id": 2}], POLICIES)
+
+    assert prompt.startswith(renderer.prefix(POLICIES, batch=True))
+    assert '"item": 0' in prompt and '"item": 1' in prompt
+
+def test_evaluate_reports_prompt_length(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = '{"decision": "SAFE", "reason": "All good"}'
+    before = metrics.PROMPT_LENGTH.count(mode="single")
+
+    evaluate(AgentState(
+        transaction={"id": 1, "amount": 123.45, "merchant": "Prompt Length Test"},
+        policies=POLICIES,
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    ))
+
+    prompt = mock_llm.invoke.call_args[0][0]
+    assert prompt.startswith("You are a Visa Security Officer.")
+    assert metrics.PROMPT_LENGTH.count(mode="single") == before + 1
@@ -0,0 +1,101 @@
+import datetime
+from unittest.mock import MagicMock
+from corpcard_sentinel import risk_model, train_risk_model, metrics
+from corpcard_sentinel.risk_model import RiskModel, UserProfile
+from corpcard_sentinel.sentinel_agent import score, decide_after_score, AgentState
+from corpcard_sentinel.models import Transaction, User, CardStatus
+
+# Risky: large amounts at merchants and in categories the user has not used before
+SCORECARD = RiskModel(-6.0, {"log_amount": 0.5, "new_user": 3.0, "new_merchant": 1.5, "new_category": 2.0, "category=gambling": 6.0})
+
+def make_state(transaction):
+    return AgentState(
+        transaction=transaction,
+        policies=["Rule 1"],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    )
+
+def test_features_compare_against_the_users_history():
+    profile = UserProfile(4, 100.0, {"Food": 4}, ["Cafe"])
+    routine = risk_model.features({"amount": 20, "merchant": "cafe ", "category": "Food",
+                                   "timestamp": datetime.datetime(2024, 1, 3, 12)}, profile)
+    assert routine["new_merchant"] == 0.0 and routine["new_category"] == 0.0
+    assert routine["category_share"] == 1.0
+    assert "night" not in routine and "weekend" not in routine
+
+    unusual = risk_model.features({"amount": 900, "merchant": "Casino", "category": "Gambling",
+                                   "timestamp": datetime.datetime(2024, 1, 6, 3)}, profile)
+    assert unusual["new_merchant"] == 1.0 and unusual["new_category"] == 1.0
+    assert unusual["amount_vs_mean"] > 3
+    assert unusual["night"] == 1.0 and unusual["weekend"] == 1.0
+    assert risk_model.features({"amount": 5, "category": "Food"}, UserProfile())["new_user"] == 1.0
+
+def test_score_routes_tiers(mocker):
+    mocker.patch.object(risk_model, "model", SCORECARD)
+    config = {"configurable": {"user_profile": UserProfile(10, 200.0, {"Food": 10}, ["Cafe"])}}
+    before = metrics.DECISIONS.value(decision="SAFE", source="risk_model")
+
+    low = score(make_state({"user_id": 1, "merchant": "Cafe", "amount": 5, "category": "Food"}), config)
+    assert low["decision"] == "SAFE"
+    assert metrics.DECISIONS.value(decision="SAFE", source="risk_model") == before + 1
+
+    high = score(make_state({"user_id": 1, "merchant": "Casino", "amount": 500, "category": "Gambling"}), config)
+    assert high["decision"] == "VIOLATION" and high["is_violation"] is True
+    assert decide_after_score(high) == "enforce"
+
+    middle = score(make_state({"user_id": 1, "merchant": "Hotel", "amount": 40, "category": "Food"}), config)
+    assert middle["decision"] is None
+    assert decide_after_score(middle) == "evaluate"
+
+def test_low_risk_transaction_skips_llm(client, api_db, mocker):
+    mocker.patch.object(risk_model, "model", SCORECARD)
+    llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    llm.invoke.side_effect = [MagicMock(content='{"decision": "SAFE", "reason": "Fine"}')]
+    user = client.post("/users", json={"name": "Alice", "email": "alice@example.com", "card_status": "ACTIVE"}).json()
+    client.post("/policies", json={"rule_name": "Meals", "description": "Meals up to $75."})
+    before = client.get("/stats/risk_tiers").json()["tiers"]
+
+    # A new user's first purchase is uncertain; the same purchase afterwards is routine
+    first = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Cafe", "amount": 5, "category": "Food"})
+    second = client.post("/simulate_transaction", json={"user_id": user["id"], "merchant": "Cafe", "amount": 5, "category": "Food"})
+
+    assert first.json()["violation_reason"] == "Fine"
+    assert second.json()["violation_reason"].startswith("Low risk score")
+    assert llm.invoke.call_count == 1
+    after = client.get("/stats/risk_tiers").json()["tiers"]
+    assert after["uncertain"]["count"] == before["uncertain"]["count"] + 1
+    assert after["low"]["count"] == before["low"]["count"] + 1
+    assert 'sentinel_risk_tier_rate{tier="low"}' in client.get("/metrics").text
+
+def test_training_learns_from_labelled_history(db_session, tmp_path):
+    db_session.add(User(id=1, name="Alice", email="alice@example.com", card_status=CardStatus.ACTIVE))
+    start = datetime.datetime(2024, 1, 1, 12)
+    for i in range(60):
+        gambling = i % 6 == 5
+        db_session.add(Transaction(user_id=1, merchant="Casino" if gambling else "Cafe", category="Gambling" if gambling else "Food",
+                                   amount=400.0 if gambling else 12.0, timestamp=start + datetime.timedelta(hours=i),
+                                   is_violation=gambling, violation_reason="Gambling" if gambling else None))
+    # Unlabelled: skipped
+    db_session.add(Transaction(user_id=1, merchant="Hotel", category="Travel", amount=200.0, timestamp=start - datetime.timedelta(days=1),
+                               is_violation=False, violation_reason="MANUAL REVIEW REQUIRED: System Error (timeout)"))
+    db_session.commit()
+
+    examples = train_risk_model.load_examples(db_session)
+    assert len(examples) == 60
+    model = train_risk_model.train(examples, epochs=30)
+    gambling = [model.score_features(values) for values, label in examples if label]
+    food = [model.score_features(values) for values, label in examples if not label]
+    assert min(gambling) > max(food)
+
+    report = train_risk_model.tier_report(model, examples, 0.2, 0.8)
+    assert sum(t["count"] for t in report["tiers"].values()) == 60
+    assert report["tiers"]["high"]["violation_rate"] == 1.0
+
+    path = tmp_path / "risk_model.json"
+    model.save(str(path))
+    loaded = RiskModel.load(str(path))
+    assert loaded.score_features(examples[0][0]) == model.score_features(examples[0][0])
@@ -1,7 +1,14 @@
+import asyncio
+import datetime
 import pytest
-from unittest.mock import MagicMock
-from corpcard_sentinel.sentinel_agent import monitor, evaluate, investigate, enforce, AgentState, decide_next_step
-from corpcard_sentinel.models import CardStatus, User, Transaction
+from unittest.mock import MagicMock, AsyncMock
+from corpcard_sentinel.sentinel_agent import monitor, precheck, evaluate, evaluate_batch, investigate, enforce, AgentState, decide_next_step, decide_after_precheck
+from corpcard_sentinel.sentinel_agent import aevaluate, ainvestigate, get_user_spending_history
+from corpcard_sentinel.sentinel_agent import HistoryPrefetch, AsyncHistoryPrefetch, run_transaction_check, arun_transaction_check
+from corpcard_sentinel.policy_snapshot import PolicySnapshot
+from corpcard_sentinel.models import CardStatus, User, Transaction, Policy
+from corpcard_sentinel.policy_rules import compile_policies
+from corpcard_sentinel.policy_selection import PolicyIndex
 
 def test_monitor():
     state = AgentState(
@@ -111,6 +118,7 @@ def test_investigate(mocker):
 def test_enforce_violation(mocker):
     mock_db = MagicMock()
     mocker.patch("corpcard_sentinel.sentinel_agent.database.SessionLocal", return_value=mock_db)
+    mock_remove = mocker.patch("corpcard_sentinel.aggregates.remove_transaction")
     
     mock_user = User(id=1, card_status=CardStatus.ACTIVE)
     mock_trans = Transaction(id=10, is_violation=False)
@@ -133,6 +141,8 @@ def test_enforce_violation(mocker):
     assert mock_user.card_status == CardStatus.FROZEN
     assert mock_trans.is_violation is True
     assert mock_trans.violation_reason == "Gambling"
+    # The transaction no longer counts towards the user's approved spending
+    mock_remove.assert_called_once_with(mock_db, mock_trans)
     mock_db.commit.assert_called_once()
 
 def test_decide_next_step():
@@ -198,3 +208,366 @@ def test_enforce_manual_review(mocker):
     assert mock_trans.is_violation is False
     assert mock_trans.violation_reason == "MANUAL REVIEW REQUIRED: API Down"
     mock_db.commit.assert_called_once()
+
+def test_precheck_violation_skips_llm(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    rules = compile_policies([Policy(id=1, rule_name="No Gambling", category="Gambling")])
+
+    state = AgentState(
+        transaction={"id": 1, "amount": 100, "category": "Gambling"},
+        policies=["No Gambling: Gambling transactions are forbidden."],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None,
+        rules=rules
+    )
+
+    new_state = precheck(state)
+    assert new_state["decision"] == "VIOLATION"
+    assert new_state["is_violation"] is True
+    assert decide_after_precheck(new_state) == "enforce"
+    mock_llm.invoke.assert_not_called()
+
+def test_precheck_defers_ambiguous_to_evaluate():
+    rules = compile_policies([
+        Policy(id=1, rule_name="No Gambling", category="Gambling"),
+        Policy(id=2, rule_name="Meals", description="Meals up to $75."),
+    ])
+
+    state = AgentState(
+        transaction={"id": 1, "amount": 100, "category": "Food"},
+        policies=[],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None,
+        rules=rules
+    )
+
+    new_state = precheck(state)
+    assert new_state["decision"] is None
+    assert decide_after_precheck(new_state) == "score"
+
+def make_cache_state(tx_id, amount, timestamp=None):
+    policies = [Policy(id=1, rule_name="Meals", description="Meals up to $100.", is_active=True)]
+    return AgentState(
+        transaction={"id": tx_id, "user_id": 7, "merchant": "Blue Bottle", "category": "Food", "amount": amount, "timestamp": timestamp},
+        policies=["Rule 1"],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None,
+        policy_index=PolicyIndex(policies)
+    )
+
+def test_evaluate_reuses_cached_verdict(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = '{"decision": "SAFE", "reason": "Coffee"}'
+    make_state = make_cache_state
+
+    assert evaluate(make_state(1, 4.40))["decision"] == "SAFE"
+    assert evaluate(make_state(2, 4.45))["decision"] == "SAFE"
+    assert mock_llm.invoke.call_count == 1
+
+    # A different policy set must not reuse the verdict
+    state = make_state(3, 4.40)
+    state["policies"] = ["Rule 1", "Rule 2"]
+    evaluate(state)
+    assert mock_llm.invoke.call_count == 2
+
+def test_cached_verdict_respects_policy_limits_and_time(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = '{"decision": "SAFE", "reason": "Meal"}'
+    monday_noon = datetime.datetime(2024, 1, 1, 12, 5)
+
+    evaluate(make_cache_state(1, 99, monday_noon))
+    # Within 5% of $99, but over the $100 limit
+    evaluate(make_cache_state(2, 101, monday_noon))
+    assert mock_llm.invoke.call_count == 2
+
+    # Same hour of the same weekday reuses the verdict; another hour or day does not
+    evaluate(make_cache_state(3, 99, monday_noon + datetime.timedelta(minutes=30)))
+    assert mock_llm.invoke.call_count == 2
+    evaluate(make_cache_state(4, 99, monday_noon + datetime.timedelta(hours=10)))
+    evaluate(make_cache_state(5, 99, monday_noon + datetime.timedelta(days=5)))
+    assert mock_llm.invoke.call_count == 4
+
+def test_evaluate_does_not_cache_errors(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.side_effect = [Exception("API Down"), mocker.Mock(content='{"decision": "SAFE", "reason": "ok"}')]
+    # Without a retry, so the failure reaches evaluate
+    mocker.patch("corpcard_sentinel.llm_resilience.LLM_MAX_ATTEMPTS", 1)
+
+    state = AgentState(
+        transaction={"id": 1, "user_id": 7, "merchant": "Cafe", "category": "Food", "amount": 5},
+        policies=["Rule 1"],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    )
+
+    assert evaluate(state)["decision"] == "MANUAL_REVIEW"
+    assert evaluate(state)["decision"] == "SAFE"
+
+def make_batch_state(tx_id, amount):
+    return AgentState(
+        transaction={"id": tx_id, "user_id": tx_id, "merchant": "Shop", "category": "Retail", "amount": amount},
+        policies=["Rule 1"],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    )
+
+def test_evaluate_batch_single_llm_call(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = (
+        '[{"item": 1, "decision": "VIOLATION", "reason": "Bad"},'
+        ' {"item": 0, "decision": "SAFE", "reason": "Fine"},'
+        ' {"item": 2, "decision": "SUSPICIOUS", "reason": "Odd"}]'
+    )
+
+    results = evaluate_batch([make_batch_state(1, 10), make_batch_state(2, 20), make_batch_state(3, 30)])
+
+    assert [r["decision"] for r in results] == ["SAFE", "VIOLATION", "SUSPICIOUS"]
+    assert results[1]["is_violation"] is True
+    mock_llm.invoke.assert_called_once()
+
+def test_evaluate_batch_missing_item_goes_to_manual_review(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = '[{"item": 0, "decision": "SAFE", "reason": "Fine"}]'
+
+    results = evaluate_batch([make_batch_state(1, 10), make_batch_state(2, 20)])
+
+    assert results[0]["decision"] == "SAFE"
+    assert results[1]["decision"] == "MANUAL_REVIEW"
+    assert results[1]["is_violation"] is False
+
+def test_evaluate_batch_chunks_prompts(mocker):
+    mocker.patch("corpcard_sentinel.sentinel_agent.BATCH_EVAL_SIZE", 2)
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = '[{"item": 0, "decision": "SAFE", "reason": "Fine"}, {"item": 1, "decision": "SAFE", "reason": "Fine"}]'
+
+    results = evaluate_batch([make_batch_state(i, 10 * i) for i in range(1, 4)])
+
+    assert [r["decision"] for r in results] == ["SAFE", "SAFE", "SAFE"]
+    assert mock_llm.invoke.call_count == 2
+
+def test_aevaluate_awaits_llm(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.ainvoke = AsyncMock(return_value=MagicMock(content='{"decision": "VIOLATION", "reason": "Bad stuff"}'))
+
+    state = AgentState(
+        transaction={"id": 1, "amount": 100},
+        policies=["Rule 1"],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    )
+
+    new_state = asyncio.run(aevaluate(state))
+    assert new_state["decision"] == "VIOLATION"
+    assert new_state["is_violation"] is True
+    mock_llm.ainvoke.assert_awaited_once()
+    mock_llm.invoke.assert_not_called()
+
+def test_aevaluate_exception_fail_open(mocker):
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.ainvoke = AsyncMock(side_effect=Exception("API Down"))
+
+    state = AgentState(
+        transaction={"id": 1, "amount": 100},
+        policies=["Rule 1"],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    )
+
+    new_state = asyncio.run(aevaluate(state))
+    assert new_state["decision"] == "MANUAL_REVIEW"
+    assert new_state["is_violation"] is False
+
+def test_ainvestigate(mocker):
+    mock_db = MagicMock()
+    mock_db.run_sync = AsyncMock(return_value="History data")
+    mock_session = mocker.patch("corpcard_sentinel.sentinel_agent.database.AsyncSessionLocal")
+    mock_session.return_value.__aenter__ = AsyncMock(return_value=mock_db)
+    mock_session.return_value.__aexit__ = AsyncMock(return_value=False)
+
+    state = AgentState(
+        transaction={"user_id": 123},
+        policies=[],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None
+    )
+
+    new_state = asyncio.run(ainvestigate(state))
+    assert new_state["spending_history"] == "History data"
+    assert new_state["investigation_count"] == 1
+    mock_db.run_sync.assert_awaited_once_with(get_user_spending_history, 123)
+
+def test_enforce_within_unit_of_work_does_not_commit():
+    mock_db = MagicMock()
+    mock_user = User(id=1, card_status=CardStatus.ACTIVE)
+    mock_db.get.return_value = mock_user
+
+    state = AgentState(
+        transaction={"user_id": 1, "id": None},
+        policies=[],
+        violation_reason="Gambling",
+        is_violation=True,
+        investigation_count=0,
+        spending_history=None,
+        decision="VIOLATION"
+    )
+
+    enforce(state, {"configurable": {"db": mock_db}})
+
+    assert mock_user.card_status == CardStatus.FROZEN
+    mock_db.commit.assert_not_called()
+
+def test_precheck_starts_history_prefetch_only_when_undecided():
+    rules = compile_policies([Policy(id=1, rule_name="No Gambling", description="...", category="Gambling")])
+    prefetch = MagicMock()
+    config = {"configurable": {"history_prefetch": prefetch}}
+    state = AgentState(
+        transaction={"user_id": 1, "amount": 100, "merchant": "Casino", "category": "Gambling"},
+        policies=["No Gambling: ..."],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision=None,
+        rules=rules
+    )
+
+    precheck(state, config)
+    prefetch.start.assert_not_called()
+
+    precheck({**state, "transaction": {**state["transaction"], "category": "Food"}, "rules": None}, config)
+    prefetch.start.assert_called_once_with(1)
+
+def test_investigate_uses_prefetched_history(mocker):
+    mocker.patch("corpcard_sentinel.sentinel_agent.prefetch_spending_history", return_value="Prefetched history")
+    mock_session = mocker.patch("corpcard_sentinel.sentinel_agent.database.SessionLocal")
+    prefetch = HistoryPrefetch()
+    prefetch.start(123)
+
+    state = AgentState(
+        transaction={"user_id": 123},
+        policies=[],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision="SUSPICIOUS"
+    )
+
+    new_state = investigate(state, {"configurable": {"history_prefetch": prefetch}})
+    assert new_state["spending_history"] == "Prefetched history"
+    assert new_state["investigation_count"] == 1
+    mock_session.assert_not_called()
+
+def test_investigate_falls_back_when_prefetch_fails(mocker):
+    mocker.patch("corpcard_sentinel.sentinel_agent.prefetch_spending_history", side_effect=Exception("DB down"))
+    mock_db = MagicMock()
+    mocker.patch("corpcard_sentinel.sentinel_agent.get_user_spending_history", return_value="History data")
+    prefetch = HistoryPrefetch()
+    prefetch.start(123)
+
+    state = AgentState(
+        transaction={"user_id": 123},
+        policies=[],
+        violation_reason=None,
+        is_violation=False,
+        investigation_count=0,
+        spending_history=None,
+        decision="SUSPICIOUS"
+    )
+
+    new_state = investigate(state, {"configurable": {"db": mock_db, "history_prefetch": prefetch}})
+    assert new_state["spending_history"] == "History data"
+
+def test_run_transaction_check_prefetches_for_suspicious(mocker):
+    mocker.patch("corpcard_sentinel.sentinel_agent.HISTORY_PREFETCH", True)
+    mocker.patch("corpcard_sentinel.sentinel_agent.snapshot_cache.get", return_value=PolicySnapshot(1, ["Rule 1"], compile_policies([])))
+    mocker.patch("corpcard_sentinel.sentinel_agent.prefetch_spending_history", return_value="Prefetched history")
+    mock_session = mocker.patch("corpcard_sentinel.sentinel_agent.database.SessionLocal")
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.side_effect = [
+        MagicMock(content='{"decision": "SUSPICIOUS", "reason": "Unusual"}'),
+        MagicMock(content='{"decision": "SAFE", "reason": "Fits history"}'),
+    ]
+
+    result = run_transaction_check({"id": 1, "user_id": 7, "amount": 900, "merchant": "Store", "category": "Retail"})
+    assert result["decision"] == "SAFE"
+    assert result["spending_history"] == "Prefetched history"
+    assert "Prefetched history" in mock_llm.invoke.call_args_list[1].args[0]
+    mock_session.assert_not_called()
+
+def test_run_transaction_check_cancels_unused_prefetch(mocker):
+    mocker.patch("corpcard_sentinel.sentinel_agent.HISTORY_PREFETCH", True)
+    mocker.patch("corpcard_sentinel.sentinel_agent.snapshot_cache.get", return_value=PolicySnapshot(1, ["Rule 1"], compile_policies([])))
+    prefetch = MagicMock()
+    mocker.patch("corpcard_sentinel.sentinel_agent.HistoryPrefetch", return_value=prefetch)
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.invoke.return_value.content = '{"decision": "SAFE", "reason": "All good"}'
+
+    result = run_transaction_check({"id": 1, "user_id": 7, "amount": 20, "merchant": "Cafe", "category": "Food"})
+    assert result["decision"] == "SAFE"
+    prefetch.start.assert_called_once_with(7)
+    prefetch.result.assert_not_called()
+    prefetch.cancel.assert_called_once()
+
+def test_arun_transaction_check_prefetches_for_suspicious(mocker):
+    mocker.patch("corpcard_sentinel.sentinel_agent.HISTORY_PREFETCH", True)
+    mocker.patch("corpcard_sentinel.sentinel_agent.snapshot_cache.aget", AsyncMock(return_value=PolicySnapshot(1, ["Rule 1"], compile_policies([]))))
+    mocker.patch("corpcard_sentinel.sentinel_agent.aprefetch_spending_history", AsyncMock(return_value="Prefetched history"))
+    mock_session = mocker.patch("corpcard_sentinel.sentinel_agent.database.AsyncSessionLocal")
+    mock_llm = mocker.patch("corpcard_sentinel.sentinel_agent.llm")
+    mock_llm.ainvoke = AsyncMock(side_effect=[
+        MagicMock(content='{"decision": "SUSPICIOUS", "reason": "Unusual"}'),
+        MagicMock(content='{"decision": "SAFE", "reason": "Fits history"}'),
+    ])
+
+    result = asyncio.run(arun_transaction_check({"id": 1, "user_id": 7, "amount": 900, "merchant": "Store", "category": "Retail"}))
+    assert result["decision"] == "SAFE"
+    assert result["spending_history"] == "Prefetched history"
+    mock_session.assert_not_called()
+
+def test_async_prefetch_is_not_cancelled_mid_query(mocker):
+    finished = []
+
+    async def slow_history(user_id):
+        await asyncio.sleep(0.05)
+        finished.append(user_id)
+        return "History"
+
+    mocker.patch("corpcard_sentinel.sentinel_agent.aprefetch_spending_history", slow_history)
+
+    async def run():
+        prefetch = AsyncHistoryPrefetch()
+        prefetch.start(7)
+        await asyncio.sleep(0)
+        # The query is in flight: it runs to completion (closing its session) and is discarded
+        prefetch.cancel()
+        await asyncio.sleep(0.1)
+        return prefetch.task
+
+    task = asyncio.run(run())
+    assert finished == [7]
+    assert not task.cancelled()
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+from corpcard_sentinel import user_locks
+from corpcard_sentinel.user_locks import ShardedLocks, LockTimeout
+from corpcard_sentinel.models import User, CardStatus
+
+def run_in_thread(locks, user_id, events, name):
+    def run():
+        try:
+            with locks.hold([user_id]):
+                events.append(name)
+        except LockTimeout:
+            events.append(f"{name} timed out")
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def test_same_user_serializes_other_users_do_not():
+    locks = ShardedLocks(shards=64)
+    events = []
+    with locks.hold([1]):
+        same = run_in_thread(locks, 1, events, "same")
+        run_in_thread(locks, 2, events, "other").join(timeout=5)
+        assert events == ["other"]
+    same.join(timeout=5)
+    assert events == ["other", "same"]
+
+def test_batches_lock_shards_once_in_order():
+    locks = ShardedLocks(shards=4)
+    assert locks.shards([5, 1, 2, 9]) == [1, 2]
+    # Users 1, 5 and 9 share a shard: taken once, no self-deadlock
+    with locks.hold([9, 5, 1]):
+        pass
+
+def test_lock_timeout():
+    locks = ShardedLocks(shards=4, timeout=0.01)
+    events = []
+    with locks.hold([1]):
+        run_in_thread(locks, 1, events, "waiter").join(timeout=5)
+    assert events == ["waiter timed out"]
+
+def test_async_locks_serialize_same_user():
+    locks = ShardedLocks(shards=64)
+    order = []
+
+    async def decide(user_id, name, delay):
+        async with locks.ahold([user_id]):
+            order.append(f"{name} start")
+            await asyncio.sleep(delay)
+            order.append(f"{name} end")
+
+    async def main():
+        await asyncio.gather(decide(1, "a", 0.02), decide(1, "b", 0), decide(2, "c", 0))
+
+    asyncio.run(main())
+    assert order.index("a end") < order.index("b start")
+    assert order.index("c start") < order.index("a end")
+
+def test_lock_wait_is_reported(db_session, mocker):
+    db_session.add(User(id=1, name="Alice", email="alice@example.com", card_status=CardStatus.ACTIVE))
+    db_session.commit()
+    before = (user_locks.LOCK_WAIT.count(mode="process"), user_locks.LOCK_WAIT.count(mode="db"))
+    mocker.patch.object(user_locks, "USER_LOCKS", "db")
+
+    with user_locks.hold([1]):
+        users = user_locks.lock_rows(db_session, [1])
+
+    assert [u.id for u in users] == [1]
+    assert user_locks.LOCK_WAIT.count(mode="process") == before[0] + 1
+    assert user_locks.LOCK_WAIT.count(mode="db") == before[1] + 1
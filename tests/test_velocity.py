@@ -0,0 +1,42 @@
+from corpcard_sentinel.velocity import VelocityStore
+from corpcard_sentinel.sentinel_agent import build_evaluation_prompt
+
+def test_counts_expire_with_the_window():
+    store = VelocityStore(bucket_seconds=60, window_minutes=60)
+    store.observe(1, "Shop", 10.0, at=0)
+    store.observe(1, "Shop", 20.0, at=30)
+    later = store.observe(1, "Shop", 5.0, at=10 * 60)
+
+    assert later.count(5) == 1
+    assert later.count(60) == 3
+    assert later.amount(60) == 35.0
+    assert store.observe(1, "Shop", 1.0, at=3 * 3600).count(60) == 1
+
+def test_users_and_merchants_are_counted_separately():
+    store = VelocityStore()
+    store.observe(1, "Shop", 10.0, at=0)
+    store.observe(2, "Shop", 10.0, at=0)
+    features = store.observe(1, "Cafe", 10.0, at=0)
+
+    assert features.count(5) == 2
+    assert features.count(5, per_merchant=True) == 1
+
+def test_memory_is_bounded_by_lru_eviction():
+    store = VelocityStore(max_keys=4)
+    for user_id in range(10):
+        store.observe(user_id, "Shop", 1.0, at=0)
+
+    assert len(store) == 4
+    assert store.stats()["evictions"] == 16
+    # Evicted users start over
+    assert store.observe(0, "Shop", 1.0, at=0).count(5) == 1
+
+def test_bursts_change_the_cache_key_and_reach_the_prompt():
+    store = VelocityStore()
+    first = store.observe(1, "Shop", 1.0, at=0)
+    for i in range(7):
+        burst = store.observe(1, "Shop", 1.0, at=i)
+
+    assert first.cache_key() != burst.cache_key()
+    prompt = build_evaluation_prompt({"id": 1}, ["Rule 1"], None, velocity_summary=burst.summary())
+    assert "Recent Velocity: 8 transactions ($8.00) in the last 5 min, 8 at this merchant" in prompt